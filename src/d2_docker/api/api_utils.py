@@ -1,10 +1,12 @@
 import os
 import base64
 from datetime import datetime
-from d2_docker.commands import list_
 from flask import jsonify, Response
 from dotenv import dotenv_values
 
+from .instances_cache import get_instances_cache
+from .jobs import get_scheduler
+
 
 class Struct(object):
     def __init__(self, dictionary):
@@ -32,9 +34,24 @@ def get_auth_headers(user, password):
     return {"Authorization": "Basic " + encoded_auth}
 
 
+def get_instances_state():
+    """Return the (cached) instances state, see InstancesCache."""
+    ttl = get_config().get("INSTANCES_CACHE_TTL")
+    return get_instances_cache(ttl=float(ttl) if ttl else None)
+
+
+def get_jobs_scheduler():
+    """Return the jobs scheduler (limits from config: JOBS_MAX_WORKERS, JOBS_MAX_PER_IMAGE,
+    JOBS_MAX_PENDING)."""
+    config = get_config()
+    keys = ["JOBS_MAX_WORKERS", "JOBS_MAX_PER_IMAGE", "JOBS_MAX_PENDING"]
+    limits = [config.get(key) for key in keys]
+    max_workers, max_per_image, max_pending = [int(value) if value else None for value in limits]
+    return get_scheduler(max_workers, max_per_image, max_pending)
+
+
 def get_container(name):
-    containers = list_.get_containers()
-    return next((c for c in containers if c["name"] == name), None)
+    return get_instances_state().get_container(name)
 
 
 def success():
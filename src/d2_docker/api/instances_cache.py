@@ -0,0 +1,118 @@
+import threading
+import time
+
+from d2_docker import utils, docker_api
+from d2_docker.commands import list_
+
+CONTAINER_EVENTS = ["create", "start", "stop", "die", "destroy", "rename", "pause", "unpause"]
+IMAGE_EVENTS = ["tag", "untag", "delete", "import", "load", "pull"]
+
+
+class InstancesCache:
+    """
+    In-process cache of d2-docker data images and running instances (list_.get_containers).
+
+    The cache is filled on first use and then refreshed in the background whenever the docker
+    events stream reports a container/image change (debounced, so a `compose up` triggers a single
+    refresh). If the events stream is not available, entries older than `ttl` seconds are
+    refreshed on read.
+    """
+
+    def __init__(self, ttl=60, debounce=0.5):
+        self.ttl = ttl
+        self.debounce = debounce
+        self.containers = None
+        self.containers_by_name = {}
+        self.updated_at = 0
+        self.refresh_lock = threading.Lock()
+        self.dirty = threading.Event()
+        self.started = False
+        self.start_lock = threading.Lock()
+
+    def get_containers(self):
+        self.start()
+        if self.containers is None or time.monotonic() - self.updated_at > self.ttl:
+            self.refresh()
+        return self.containers
+
+    def get_container(self, name):
+        self.get_containers()
+        return self.containers_by_name.get(name)
+
+    def refresh(self):
+        with self.refresh_lock:
+            containers = list_.get_containers()
+            # Replace references in one go, readers always see a consistent pair.
+            self.containers, self.containers_by_name = (
+                containers,
+                dict((container["name"], container) for container in containers),
+            )
+            self.updated_at = time.monotonic()
+        return containers
+
+    def invalidate(self):
+        """Mark the cache as stale: the next read refreshes it (if the background refresher
+        has not done it yet)."""
+        self.updated_at = 0
+        self.dirty.set()
+
+    def start(self):
+        """Start (once) the background threads that keep the cache updated."""
+        with self.start_lock:
+            if self.started:
+                return
+            self.started = True
+
+        if docker_api.get_client():
+            threading.Thread(target=self._watch_events, name="instances-events", daemon=True).start()
+            threading.Thread(target=self._refresher, name="instances-refresh", daemon=True).start()
+        else:
+            utils.logger.debug("Docker events not available, instances cache uses TTL only")
+
+    def _watch_events(self):
+        filters = {"type": ["container", "image"], "event": CONTAINER_EVENTS + IMAGE_EVENTS}
+
+        while True:
+            client = docker_api.get_client()
+            try:
+                # Events may have been lost while (re)connecting
+                self.invalidate()
+                for event in client.events(filters=filters):
+                    if is_relevant_event(event):
+                        self.dirty.set()
+            except docker_api.DockerApiError as exc:
+                utils.logger.debug("Docker events stream error: {}".format(exc))
+            time.sleep(5)
+
+    def _refresher(self):
+        while True:
+            self.dirty.wait()
+            # Debounce: wait until there are no new events for a while
+            while True:
+                self.dirty.clear()
+                time.sleep(self.debounce)
+                if not self.dirty.is_set():
+                    break
+            try:
+                self.refresh()
+            except Exception as exc:  # pylint: disable=broad-except
+                utils.logger.error("Cannot refresh instances cache: {}".format(exc))
+                self.updated_at = 0
+
+
+def is_relevant_event(event):
+    if event.get("Type") == "container":
+        attributes = (event.get("Actor") or {}).get("Attributes") or {}
+        return utils.IMAGE_NAME_LABEL in attributes
+    else:
+        return True
+
+
+_instances_cache = None
+
+
+def get_instances_cache(ttl=None):
+    global _instances_cache
+    if _instances_cache is None:
+        _instances_cache = InstancesCache(ttl=ttl or 60)
+    return _instances_cache
@@ -0,0 +1,239 @@
+import collections
+import concurrent.futures
+import contextlib
+import itertools
+import logging
+import threading
+import time
+import uuid
+
+from d2_docker import tracing, utils
+
+PENDING, RUNNING, SUCCESS, ERROR = "PENDING", "RUNNING", "SUCCESS", "ERROR"
+FINISHED_STATES = [SUCCESS, ERROR]
+
+
+class JobsQueueFullError(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, name, images, func):
+        self.id = str(uuid.uuid4())
+        self.name = name
+        self.images = [image for image in images if image]
+        self.func = func
+        self.status = PENDING
+        self.phase = None
+        self.events = []
+        self.result = None
+        self.spans = []
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.changed = threading.Condition()
+
+    def add_event(self, message):
+        with self.changed:
+            self.phase = message
+            self.events.append(dict(time=time.time(), message=message))
+            self.changed.notify_all()
+
+    def set_status(self, status, result=None, error=None):
+        with self.changed:
+            self.status = status
+            self.result = result
+            self.error = error
+            if status == RUNNING:
+                self.started_at = time.time()
+            elif status in FINISHED_STATES:
+                self.finished_at = time.time()
+            self.changed.notify_all()
+
+    def is_finished(self):
+        return self.status in FINISHED_STATES
+
+    def wait(self, timeout=None):
+        with self.changed:
+            self.changed.wait_for(self.is_finished, timeout=timeout)
+        return self.is_finished()
+
+    def iter_events(self, keepalive=15):
+        """Yield the progress events (and None every `keepalive` seconds without events)
+        until the job is finished."""
+        index = 0
+        while True:
+            with self.changed:
+                self.changed.wait_for(
+                    lambda: len(self.events) > index or self.is_finished(), timeout=keepalive
+                )
+                events = self.events[index:]
+                finished = self.is_finished()
+            index += len(events)
+            if not events and not finished:
+                yield None
+            for event in events:
+                yield event
+            if finished:
+                break
+
+    def to_dict(self, with_events=False):
+        """Return the job info (with_events: also progress events and timing spans)."""
+        value = dict(
+            id=self.id,
+            name=self.name,
+            images=self.images,
+            status=self.status,
+            phase=self.phase,
+            result=self.result,
+            error=self.error,
+            created_at=self.created_at,
+            started_at=self.started_at,
+            finished_at=self.finished_at,
+        )
+        return dict(value, events=self.events, spans=self.spans) if with_events else value
+
+
+class JobsScheduler:
+    """
+    Run jobs (API operations) in a bounded pool of worker threads.
+
+    - max_workers: Maximum number of jobs running at the same time.
+    - max_per_image: Maximum number of running jobs that use the same image (1 = jobs for an
+      image are serialized, in submission order).
+    - max_pending: Maximum number of jobs waiting to run (submit fails when the queue is full).
+    - history: Number of finished jobs kept for GET /jobs/ID.
+    """
+
+    def __init__(self, max_workers=4, max_per_image=1, max_pending=100, history=200):
+        self.max_workers = max_workers
+        self.max_per_image = max_per_image
+        self.max_pending = max_pending
+        self.history = history
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="job"
+        )
+        self.lock = threading.Lock()
+        self.jobs = collections.OrderedDict()
+        self.pending = []
+        self.running_by_image = collections.Counter()
+        self.running_count = 0
+
+    def submit(self, name, images, func):
+        """Add a job that runs func() and return it. The job result is the value returned by
+        func (it must be JSON-serializable)."""
+        return self.submit_many(name, [(images, func)])[0]
+
+    def submit_many(self, name, items):
+        """Add a job for each (images, func) pair and return them. All or none of the jobs are
+        added (JobsQueueFullError if the queue has no room for all of them)."""
+        new_jobs = [Job(name, images, func) for (images, func) in items]
+        with self.lock:
+            if len(self.pending) + len(new_jobs) > self.max_pending:
+                msg = "Jobs queue is full ({} pending, {} new)".format(
+                    len(self.pending), len(new_jobs)
+                )
+                raise JobsQueueFullError(msg)
+            for job in new_jobs:
+                self.jobs[job.id] = job
+                self.pending.append(job)
+            self._remove_old_jobs()
+            self._schedule()
+        for job in new_jobs:
+            utils.logger.info("Job queued: {} {} [{}]".format(job.name, job.images, job.id))
+        return new_jobs
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def get_jobs(self):
+        return list(self.jobs.values())
+
+    def _schedule(self):
+        """Start the pending jobs allowed by the limits (called with the lock held)."""
+        blocked_images = set()
+
+        for job in list(self.pending):
+            if self.running_count >= self.max_workers:
+                break
+            can_run = all(
+                self.running_by_image[image] < self.max_per_image and image not in blocked_images
+                for image in job.images
+            )
+            if can_run:
+                self.pending.remove(job)
+                self.running_count += 1
+                self.running_by_image.update(job.images)
+                job.set_status(RUNNING)
+                self.executor.submit(self._run, job)
+            else:
+                # Keep the submission order for the jobs of an image
+                blocked_images.update(job.images)
+
+    def _run(self, job):
+        utils.logger.info("Job started: {} {} [{}]".format(job.name, job.images, job.id))
+        try:
+            with tracing.recording() as recorder, job_events_handler(job):
+                try:
+                    result = job.func()
+                finally:
+                    job.spans = recorder.to_list()
+        except Exception as exc:  # pylint: disable=broad-except
+            utils.logger.error("Job failed: {} [{}]: {}".format(job.name, job.id, exc))
+            job.set_status(ERROR, error=str(exc))
+        else:
+            utils.logger.info("Job finished: {} [{}]".format(job.name, job.id))
+            job.set_status(SUCCESS, result=result)
+        finally:
+            with self.lock:
+                self.running_count -= 1
+                self.running_by_image.subtract(job.images)
+                self._schedule()
+
+    def _remove_old_jobs(self):
+        finished_jobs = [job for job in self.jobs.values() if job.is_finished()]
+        for job in itertools.islice(finished_jobs, max(len(finished_jobs) - self.history, 0)):
+            self.jobs.pop(job.id)
+
+
+class JobEventsHandler(logging.Handler):
+    """Add the log messages of a job (info level and up) as progress events. The messages of
+    the job thread and of the functions it runs with tracing.propagate (worker threads) are
+    included."""
+
+    def __init__(self, job):
+        super().__init__(level=logging.INFO)
+        self.job = job
+
+    def emit(self, record):
+        if tracing.get_context_value("job") is self.job:
+            self.job.add_event(record.getMessage())
+
+
+@contextlib.contextmanager
+def job_events_handler(job):
+    handler = JobEventsHandler(job)
+    utils.logger.addHandler(handler)
+    try:
+        with tracing.context(job=job):
+            yield
+    finally:
+        utils.logger.removeHandler(handler)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler(max_workers=None, max_per_image=None, max_pending=None):
+    global _scheduler
+
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = JobsScheduler(
+                max_workers=max_workers or 4,
+                max_per_image=max_per_image or 1,
+                max_pending=max_pending or 100,
+            )
+        return _scheduler
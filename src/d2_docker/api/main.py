@@ -1,3 +1,4 @@
+import json
 import requests
 from codecs import decode
 
@@ -7,17 +8,21 @@ from flask_cors import CORS
 
 from werkzeug.exceptions import HTTPException, BadRequest
 
-from d2_docker import utils
-from d2_docker.commands import version, list_, start, stop, logs, commit, push, pull, run_sql
-from d2_docker.commands import copy, rm
+from d2_docker import utils, compression
+from d2_docker.commands import version, start, stop, logs, commit, push, pull, run_sql
+from d2_docker.commands import copy, rm, snapshot
+from . import jobs
 from .api_utils import (
     get_args_from_query_strings,
     get_args_from_request,
     get_container,
+    get_instances_state,
+    get_jobs_scheduler,
     get_timestamp,
     stream_response,
     success,
     server_error,
+    Struct,
 )
 from .api_utils import get_auth_headers, get_config
 
@@ -35,22 +40,27 @@ def get_version():
 
 @api.route("/instances", methods=["GET"])
 def get_instances():
-    containers = list_.get_containers()
+    containers = get_instances_state().get_containers()
     return jsonify({"containers": containers})
 
 
 @api.route("/instances/start", methods=["POST"])
 def start_instance():
     args = get_args_from_request(request)
-    start.run(args)
-    container = get_container(args.image)
-    return jsonify(dict(status="SUCCESS", container=container))
+
+    def run():
+        start.run(args)
+        get_instances_state().refresh()
+        return dict(container=get_container(args.image))
+
+    return submit_job("start", [args.image], run, args)
 
 
 @api.route("/instances/stop", methods=["POST"])
 def stop_instance():
     args = get_args_from_request(request)
     stop.run(args)
+    get_instances_state().refresh()
     container = get_container(args.image)
     return jsonify(dict(status="SUCCESS", container=container))
 
@@ -66,46 +76,183 @@ def logs_instance():
 @api.route("/instances/db", methods=["GET"])
 def dump_db_instance():
     args = get_args_from_query_strings(request)
-    db_stream = run_sql.get_stream_db(args.image)
-    filename = "{}.{}.sql.gz".format(args.image, get_timestamp())
-    return stream_response(db_stream, mimetype="application/gzip", filename=filename)
+    try:
+        db_compression = compression.get_compression(
+            args.compression, args.compression_level, args.compression_threads
+        )
+    except compression.CompressionError as exc:
+        return server_error(str(exc), status=400)
+    codec = compression.get_codec(db_compression)
+    db_stream = run_sql.get_stream_db(args.image, db_compression)
+    filename = "{}.{}.sql{}".format(args.image, get_timestamp(), codec.extension)
+    return stream_response(db_stream, mimetype=codec.mimetype, filename=filename)
 
 
 @api.route("/instances/commit", methods=["POST"])
 def commit_instance():
     args = get_args_from_request(request)
-    commit.run(args)
-    return success()
+
+    def run():
+        commit.run(args)
+        get_instances_state().invalidate()
+
+    return submit_job("commit", [args.image], run, args)
 
 
 @api.route("/instances/pull", methods=["POST"])
 def pull_instance():
     args = get_args_from_request(request)
-    pull.run(args)
-    return success()
+
+    def run():
+        pull.run(args)
+        get_instances_state().invalidate()
+
+    return submit_job("pull", [args.image], run, args)
 
 
 @api.route("/instances/push", methods=["POST"])
 def push_instance():
     args = get_args_from_request(request)
-    push.run(args)
-    return success()
+    return submit_job("push", [args.image], lambda: push.run(args), args)
 
 
 @api.route("/instances/copy", methods=["POST"])
 def copy_instance():
     args = get_args_from_request(request)
-    copy.run(args)
-    return success()
+
+    def run():
+        copy.run(args)
+        get_instances_state().invalidate()
+
+    return submit_job("copy", [args.source, *(args.destinations or [])], run, args)
 
 
 @api.route("/instances/rm", methods=["POST"])
 def rm_instance():
     args = get_args_from_request(request)
     rm.run(args)
+    get_instances_state().invalidate()
     return success()
 
 
+BATCH_COMMANDS = dict(start=start, stop=stop, rm=rm, pull=pull, push=push)
+
+
+@api.route("/instances/batch/<action>", methods=["POST"])
+def batch_instances(action):
+    """Run an action (start, stop, rm, pull, push) for many images (body: {"images": [...]}
+    plus the action arguments), as a job per image."""
+    command = BATCH_COMMANDS.get(action)
+    if not command:
+        return server_error("Unknown batch action: {}".format(action), status=404)
+
+    args = get_args_from_request(request)
+    items = []
+
+    for image in dict.fromkeys(args.images or []):
+        image_args = Struct(dict(vars(args), image=image, images=[image] if action == "rm" else []))
+
+        def run(command=command, image_args=image_args):
+            command.run(image_args)
+            get_instances_state().invalidate()
+
+        items.append(([image], run))
+
+    # All jobs are queued, or none (the client gets no partially submitted batch)
+    try:
+        batch_jobs = get_jobs_scheduler().submit_many(action, items)
+    except jobs.JobsQueueFullError as exc:
+        return server_error(str(exc), status=503)
+
+    if not args.wait:
+        jobs_info = [job.to_dict() for job in batch_jobs]
+        return (jsonify(dict(status=jobs.PENDING, jobs=jobs_info)), 202)
+
+    for job in batch_jobs:
+        job.wait()
+    results = [dict(image=job.images[0], status=job.status, error=job.error) for job in batch_jobs]
+    ok = all(job.status == jobs.SUCCESS for job in batch_jobs)
+    body = jsonify(dict(status="SUCCESS" if ok else "ERROR", results=results))
+    return (body, 200 if ok else 500)
+
+
+@api.route("/instances/snapshots", methods=["GET"])
+def list_snapshots_instance():
+    args = get_args_from_query_strings(request)
+    snapshots = snapshot.list_snapshots(args.image)
+    return jsonify(dict(snapshots=snapshots))
+
+
+@api.route("/instances/snapshots/create", methods=["POST"])
+def create_snapshot_instance():
+    args = get_args_from_request(request)
+    snapshot.create_snapshot(args.image, args.name)
+    return success()
+
+
+@api.route("/instances/snapshots/restore", methods=["POST"])
+def restore_snapshot_instance():
+    args = get_args_from_request(request)
+    snapshot.restore_snapshot(args.image, args.name, restart_core=bool(args.restart_core))
+    return success()
+
+
+@api.route("/instances/snapshots/drop", methods=["POST"])
+def drop_snapshot_instance():
+    args = get_args_from_request(request)
+    snapshot.drop_snapshot(args.image, args.name)
+    return success()
+
+
+@api.route("/jobs", methods=["GET"])
+def get_jobs():
+    scheduler = get_jobs_scheduler()
+    return jsonify(dict(jobs=[job.to_dict() for job in scheduler.get_jobs()]))
+
+
+@api.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = get_jobs_scheduler().get(job_id)
+    if not job:
+        return server_error("Job not found: {}".format(job_id), status=404)
+    return jsonify(job.to_dict(with_events=True))
+
+
+@api.route("/jobs/<job_id>/stream", methods=["GET"])
+def stream_job(job_id):
+    """Stream the progress events of a job (newline-delimited JSON). Empty lines are sent as
+    keep-alive, the last line is the finished job."""
+    job = get_jobs_scheduler().get(job_id)
+    if not job:
+        return server_error("Job not found: {}".format(job_id), status=404)
+
+    def generate():
+        for event in job.iter_events():
+            yield (json.dumps(event) if event else "") + "\n"
+        yield json.dumps(job.to_dict()) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+def submit_job(name, images, func, args):
+    """Queue a job and return its info (202). If the request has {"wait": true}, wait for the
+    job and return its result (synchronous behaviour)."""
+    try:
+        job = get_jobs_scheduler().submit(name, images, func)
+    except jobs.JobsQueueFullError as exc:
+        return server_error(str(exc), status=503)
+
+    if not args.wait:
+        return (jsonify(dict(status=jobs.PENDING, job=job.to_dict())), 202)
+
+    job.wait()
+    if job.status == jobs.ERROR:
+        return server_error(job.error)
+    else:
+        job_info = job.to_dict(with_events=True)
+        return jsonify(dict(status="SUCCESS", job=job_info, **(job.result or {})))
+
+
 def get_request_json(request):
     try:
         # Use force so we don't fail even if the content type JSON is not specified in the request
@@ -158,4 +305,5 @@ def internal_error(error):
 
 def run(args):
     get_config()
+    get_instances_state().start()
     api.run(host=args.host or "127.0.0.1", port=args.port or 5000)
@@ -0,0 +1,202 @@
+"""
+Docker build contexts generated on the fly.
+
+Instead of copying the image skeleton and the data (DB dump, apps, files) to a temporal directory
+for docker to tar it again, the context tar is written directly into the stdin of
+`docker build -`, reading from the original directories and from container archive streams.
+
+The context also gets a content manifest (CONTENT_MANIFEST: a hash per data folder), computed
+while the files are streamed, so no file is read twice. The data image copies it to /data and
+its run.sh uses it to populate only the folders that changed in the data volume.
+"""
+import contextlib
+import hashlib
+import io
+import os
+import subprocess
+import tarfile
+import time
+
+from . import tracing, utils
+
+CONTENT_MANIFEST = ".d2-docker-manifest"
+DATA_FOLDERS = ["db", "apps", "document", "dataValue"]
+
+
+class BuildContext:
+    def __init__(self, tar):
+        self.tar = tar
+        self.file_hashes = {}
+
+    def add_path(self, path, arcname):
+        """Add a file or a directory (recursively) to the context."""
+        utils.logger.debug("Build context: {} -> {}".format(path, arcname))
+        self._add_local_path(path, arcname)
+
+    def _add_local_path(self, path, arcname):
+        tarinfo = self.tar.gettarinfo(path, arcname)
+        if not tarinfo:
+            utils.logger.debug("Skip unsupported file type: {}".format(path))
+        elif tarinfo.isreg():
+            with open(path, "rb") as input_file:
+                self.tar.addfile(tarinfo, self._hashing_reader(input_file, arcname))
+        else:
+            self.tar.addfile(tarinfo)
+            if tarinfo.isdir():
+                for entry in sorted(os.listdir(path)):
+                    self._add_local_path(os.path.join(path, entry), os.path.join(arcname, entry))
+
+    def add_directory_contents(self, directory, arcname_prefix=""):
+        """Add the entries of a directory (but not the directory itself) to the context."""
+        for entry in sorted(os.listdir(directory)):
+            self.add_path(os.path.join(directory, entry), os.path.join(arcname_prefix, entry))
+
+    def add_empty_directory(self, arcname):
+        tarinfo = tarfile.TarInfo(arcname)
+        tarinfo.type = tarfile.DIRTYPE
+        tarinfo.mode = 0o755
+        tarinfo.mtime = int(time.time())
+        self.tar.addfile(tarinfo)
+
+    def add_container_folders(self, container, source_path, folders, arcname_prefix=""):
+        """Add folders in a path of a container to the context (PREFIX/FOLDER), streaming its
+        archive directly. Folders that are symlinks to absolute paths (ex: the file store folders
+        linked to the data volume) are followed. Return the set of folders found."""
+        found_folders = set()
+        linked_folders = {}
+
+        def rename(name):
+            return os.path.join(arcname_prefix, name)
+
+        with utils.open_container_archive(container, source_path) as stream:
+            if not stream:
+                msg = "Path not found in container {}: {}".format(container, source_path)
+                utils.logger.debug(msg)
+                return found_folders
+
+            source_tar = tarfile.open(fileobj=stream, mode="r|", bufsize=utils.TAR_BUFFER_SIZE)
+            with source_tar:
+                for member in source_tar:
+                    relative_name = utils.get_relative_member_name(member.name)
+                    folder = relative_name.split("/")[0] if relative_name else None
+                    if folder not in folders:
+                        continue
+                    elif relative_name == folder and is_absolute_symlink(member):
+                        linked_folders[folder] = member.linkname
+                        continue
+                    elif folder not in found_folders:
+                        utils.logger.info("Include folder: {}".format(folder))
+                        found_folders.add(folder)
+                    self._add_member(source_tar, member, relative_name, rename)
+
+        for (folder, target_path) in linked_folders.items():
+            utils.logger.info("Include folder: {} -> {}".format(folder, target_path))
+            if self.add_container_path(container, target_path, rename(folder)):
+                found_folders.add(folder)
+
+        return found_folders
+
+    def add_container_path(self, container, path, arcname):
+        """Add a path of a container (recursively) to the context as arcname. Return False if
+        the path does not exist."""
+
+        def rename(name):
+            return os.path.join(arcname, name) if name else arcname
+
+        with utils.open_container_archive(container, path) as stream:
+            if not stream:
+                utils.logger.debug("Path not found in container {}: {}".format(container, path))
+                return False
+
+            source_tar = tarfile.open(fileobj=stream, mode="r|", bufsize=utils.TAR_BUFFER_SIZE)
+            with source_tar:
+                for member in source_tar:
+                    relative_name = utils.get_relative_member_name(member.name)
+                    self._add_member(source_tar, member, relative_name, rename)
+
+        return True
+
+    def _add_member(self, source_tar, member, relative_name, rename):
+        member.name = rename(relative_name)
+        if member.islnk():
+            member.linkname = rename(utils.get_relative_member_name(member.linkname))
+            self.file_hashes[member.name] = self.file_hashes.get(member.linkname)
+        fileobj = source_tar.extractfile(member) if member.isfile() else None
+        if fileobj:
+            fileobj = self._hashing_reader(fileobj, member.name)
+        self.tar.addfile(member, fileobj)
+
+    def _hashing_reader(self, fileobj, arcname):
+        reader = HashingReader(fileobj)
+        self.file_hashes[arcname] = reader.sha256
+        return reader
+
+    def get_content_manifest(self):
+        """Return the content manifest: a line "FOLDER HASH" per data folder."""
+        lines = []
+        for folder in DATA_FOLDERS:
+            prefix = folder + "/"
+            entries = sorted(
+                "{} {}".format(sha256.hexdigest() if sha256 else "-", arcname)
+                for (arcname, sha256) in self.file_hashes.items()
+                if arcname.startswith(prefix)
+            )
+            folder_hash = hashlib.sha256("\n".join(entries).encode("utf-8")).hexdigest()
+            lines.append("{} {}\n".format(folder, folder_hash))
+        return "".join(lines)
+
+    def add_file_contents(self, arcname, contents):
+        data = contents.encode("utf-8")
+        tarinfo = tarfile.TarInfo(arcname)
+        tarinfo.size = len(data)
+        tarinfo.mode = 0o644
+        tarinfo.mtime = int(time.time())
+        self.tar.addfile(tarinfo, io.BytesIO(data))
+
+
+class HashingReader:
+    """File-like wrapper that computes the SHA-256 of the data read."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.sha256.update(data)
+        return data
+
+
+def is_absolute_symlink(member):
+    return member.issym() and member.linkname.startswith("/")
+
+
+@contextlib.contextmanager
+def docker_build_stream(tags):
+    """Run `docker build -` for some tags and yield a BuildContext to fill its context tar."""
+    tag_args = [arg for tag in tags for arg in ["--tag", tag]]
+    cmd = ["docker", "build", "--platform", "linux/amd64", *tag_args, "-"]
+
+    with tracing.span("docker_build", tags=list(tags)) as build_span:
+        popen = utils.run(cmd, return_popen=True, universal_newlines=False, stdin=subprocess.PIPE)
+
+        try:
+            tar = tarfile.open(
+                fileobj=popen.stdin, mode="w|", bufsize=utils.TAR_BUFFER_SIZE, dereference=True
+            )
+            with tar:
+                context = BuildContext(tar)
+                yield context
+                context.add_file_contents(CONTENT_MANIFEST, context.get_content_manifest())
+            build_span.args["bytes"] = tar.offset
+            popen.stdin.close()
+        except BaseException:
+            popen.kill()
+            popen.wait()
+            raise
+
+        return_code = popen.wait()
+        build_span.args["returncode"] = return_code
+        if return_code != 0:
+            msg = "docker build failed with code {}: {}".format(return_code, tags)
+            raise utils.D2DockerError(msg)
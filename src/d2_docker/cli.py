@@ -1,52 +1,54 @@
 #!/usr/bin/env python3
 import sys
 import argparse
+import collections
+import contextlib
+import importlib
 
-from d2_docker import utils
-from d2_docker.commands import (
-    api,
-    start,
-    logs,
-    stop,
-    rm,
-    commit,
-    push,
-    pull,
-    copy,
-    export,
-    import_,
-    list_,
-    run_sql,
-    create,
-    upgrade,
-    version,
-    shell,
-)
-
-COMMAND_MODULES = [
+from d2_docker import utils, compression, tracing
+
+# Command metadata, the module of a command is only imported when the command is run (or its
+# help requested), so the CLI starts fast and does not load the dependencies of other commands.
+Command = collections.namedtuple("Command", ["name", "module", "description"])
+
+COMMANDS = [
     # Implemented in the API:
-    version,
-    list_,
-    start,
-    stop,
-    logs,
-    commit,
-    push,
-    pull,
-    copy,
-    rm,
+    Command("version", "version", "Show version"),
+    Command("list", "list_", "List d2-docker data images"),
+    Command(
+        "start",
+        "start",
+        "Start a container from an existing dhis2-data Docker image or from an exported file",
+    ),
+    Command("stop", "stop", "Stop docker containers"),
+    Command("logs", "logs", "Show docker logs"),
+    Command("commit", "commit", "Commit d2-docker data image"),
+    Command("push", "push", "Push dhis2-data docker image"),
+    Command("pull", "pull", "Pull dhis2-data docker image"),
+    Command("copy", "copy", "Copy databases from/to docker containers"),
+    Command("rm", "rm", "Remove dhis2-data docker images/containers"),
+    Command(
+        "snapshot",
+        "snapshot",
+        "Create/restore snapshots of the database of a running d2-docker instance",
+    ),
     # Not to be implemented in the API:
-    export,
-    import_,
-    run_sql,
-    create,
-    upgrade,
-    shell,
-    api,
+    Command("export", "export", "Export d2-docker images to a single file"),
+    Command("import", "import_", "Import d2-docker images from file"),
+    Command("run-sql", "run_sql", "Run SQL or open interactive session in a d2-docker container"),
+    Command("create", "create", "Create d2-docker images"),
+    Command("upgrade", "upgrade", "Upgrade DHIS2 version on core+data containers/images"),
+    Command("shell", "shell", "Run shell terminal in core container"),
+    Command("api", "api", "d2-docker API"),
 ]
 
 
-def get_parser():
+def load_command_module(command):
+    return importlib.import_module("d2_docker.commands." + command.module)
+
+
+def get_parser(command_name=None):
+    """Return the CLI parser. Only the arguments of command_name are set up."""
     parser = argparse.ArgumentParser(prog="d2-docker")
     parser.add_argument(
         "--dhis2-docker-images-directory",
@@ -64,20 +66,35 @@ def get_parser():
         default="INFO",
         help="Run command with the given log level",
     )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="Write a timeline of the command phases (Chrome trace JSON, see chrome://tracing)",
+    )
     subparsers = parser.add_subparsers(help="Subcommands", dest="command")
 
-    for command_module in COMMAND_MODULES:
-        name = getattr(command_module, "NAME", None) or command_module.__name__.split(".")[-1]
-        subparser = subparsers.add_parser(name, help=command_module.DESCRIPTION)
-        command_module.setup(subparser)
-        subparser.set_defaults(func=command_module.run)
+    for command in COMMANDS:
+        if command.name == command_name:
+            command_module = load_command_module(command)
+            subparser = subparsers.add_parser(command.name, help=command.description)
+            command_module.setup(subparser)
+            subparser.set_defaults(func=command_module.run)
+        else:
+            subparsers.add_parser(command.name, help=command.description, add_help=False)
 
     return parser
 
 
-def main():
-    parser = get_parser()
-    args = parser.parse_args()
+def get_command_name(argv):
+    """Return the command name in the arguments (None if there is no command)."""
+    args, _unknown_args = get_parser().parse_known_args(argv)
+    return args.command
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    parser = get_parser(get_command_name(argv))
+    args = parse_args(parser, argv)
     utils.logger.setLevel(args.log_level.upper())
 
     if not getattr(args, "func", None):
@@ -85,11 +102,43 @@ def main():
         return 1
     else:
         try:
-            return args.func(args)
-        except utils.D2DockerError as exc:
+            with profile(args.profile, args.command):
+                return args.func(args)
+        except (utils.D2DockerError, compression.CompressionError) as exc:
             print(str(exc), file=sys.stderr)
             return 2
 
 
+def parse_args(parser, argv):
+    """Parse the arguments. argparse only takes the positionals before the first option, so
+    the images of a batch command (utils.add_batch_args) after an option are added here (as
+    parse_intermixed_args does, not available with subcommands): start IMAGE1 -d IMAGE2."""
+    args, extra_args = parser.parse_known_args(argv)
+    images = getattr(args, "images", None)
+
+    if extra_args and isinstance(images, list) and not any(a.startswith("-") for a in extra_args):
+        images.extend(extra_args)
+    elif extra_args:
+        parser.error("unrecognized arguments: {}".format(" ".join(extra_args)))
+
+    return args
+
+
+@contextlib.contextmanager
+def profile(path, command):
+    """Record the spans of all threads and write them as a Chrome trace to path."""
+    if not path:
+        yield
+        return
+
+    with tracing.recording(all_threads=True) as recorder:
+        try:
+            with tracing.span(command):
+                yield
+        finally:
+            tracing.write_chrome_trace(path, recorder.spans)
+            utils.logger.info("Profile written: {}".format(path))
+
+
 if __name__ == "__main__":
     sys.exit(main())
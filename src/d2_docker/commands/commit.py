@@ -16,10 +16,21 @@ def setup(parser):
         choices=utils.default_folders,
         help="Folders to include in the image",
     )
+    utils.add_db_format_args(parser)
+    utils.add_compression_args(parser)
 
 def run(args):
     image_name = args.image or utils.get_running_image_name()
     docker_dir = utils.get_docker_directory("data", args)
     temp_dir = utils.get_temp_base_directory(args)
     utils.logger.info("Commit image: {}".format(image_name))
-    utils.build_image_from_source(docker_dir, image_name, image_name, temp_dir, args.folders)
+    utils.build_image_from_source(
+        docker_dir,
+        image_name,
+        image_name,
+        temp_dir,
+        args.folders,
+        db_format=args.db_format,
+        db_jobs=args.db_jobs,
+        db_compression=utils.get_compression_from_args(args),
+    )
@@ -1,3 +1,5 @@
+import os
+import tempfile
 from typing import Optional
 
 from d2_docker import utils
@@ -14,34 +16,85 @@ def setup(parser):
         nargs="+",
         help="Destinations (images or data folders)",
     )
+    utils.add_db_format_args(parser)
+    utils.add_jobs_arg(parser)
 
 
 def run(args):
     source = args.source
     docker_dir = utils.get_docker_directory("data", args)
     temp_dir = utils.get_temp_base_directory(args)
-    copy(source, args.destinations, docker_dir, temp_dir)
+    copy(
+        source,
+        args.destinations,
+        docker_dir,
+        temp_dir,
+        db_format=args.db_format,
+        db_jobs=args.db_jobs,
+        jobs=args.jobs,
+    )
+
 
+def copy(
+    source,
+    destinations,
+    docker_dir,
+    temp_dir: Optional[str] = None,
+    db_format=None,
+    db_jobs=None,
+    jobs=None,
+):
+    """
+    Copy the source (image or data folder) to the destinations (images or data folders).
 
-def copy(source, destinations, docker_dir, temp_dir: Optional[str] = None):
+    The source data is read (or exported from the image) once. The destination images have
+    the same contents, so a single image is built and tagged with all of them.
+    """
     logger = utils.logger
     source_type = utils.get_item_type(source)
     logger.debug("Source {} has type: {}".format(source, source_type))
+    dest_images = []
+    dest_folders = []
 
-    for dest in destinations:
+    for dest in dict.fromkeys(destinations):
         dest_type = utils.get_item_type(dest)
         logger.debug("Destination {} has type: {}".format(dest, dest_type))
         logger.info("Copying: {}:{} -> {}:{}".format(source_type, source, dest_type, dest))
+        (dest_images if dest_type == "docker-image" else dest_folders).append(dest)
+
+    if source_type == "docker-image" and not dest_folders and not db_format:
+        # No data on disk needed, stream the source image into the build
+        utils.copy_image(docker_dir, source, dest_images[0], temp_dir, tags=dest_images[1:])
+    elif source_type == "docker-image":
+        with tempfile.TemporaryDirectory(dir=temp_dir) as export_dir:
+            # Export into the first destination folder (if any), it's the source of the rest
+            data_dir = dest_folders.pop(0) if dest_folders else export_dir
+            utils.export_data_from_image(source, data_dir)
+            if db_format:
+                utils.convert_database(os.path.join(data_dir, "db"), db_format, db_jobs)
+            copy_from_directory(docker_dir, data_dir, dest_images, dest_folders, temp_dir, jobs)
+    else:
+        source_db_dir = os.path.join(source, "db")
+        with utils.converted_db_directory(source_db_dir, temp_dir, db_format, db_jobs) as db_dir:
+            copy_from_directory(
+                docker_dir, source, dest_images, dest_folders, temp_dir, jobs, db_dir=db_dir
+            )
+
+    logger.info("Done")
+
+
+def copy_from_directory(
+    docker_dir, data_dir, dest_images, dest_folders, temp_dir, jobs, db_dir=None
+):
+    """Build the destination images (one build, all tags) and copy the data to the destination
+    folders, concurrently. data_dir (and db_dir) are only read."""
 
-        if source_type == "docker-image" and dest_type == "docker-image":
-            utils.copy_image(docker_dir, source, dest, temp_dir)
-        elif source_type == "docker-image" and dest_type == "folder":
-            utils.export_data_from_image(source, dest)
-        elif source_type == "folder" and dest_type == "docker-image":
-            utils.build_image_from_directory(docker_dir, source, dest, temp_dir)
-        elif source_type == "folder" and dest_type == "folder":
-            utils.copytree(source, dest)
+    def copy_to(dest):
+        if dest in dest_images:
+            utils.build_image_from_directory(
+                docker_dir, data_dir, dest, temp_dir, tags=dest_images[1:], db_dir=db_dir
+            )
         else:
-            raise utils.D2DockerError("Not implemented")
+            utils.copy_data_directory(data_dir, dest, db_dir=db_dir)
 
-        logger.info("Done")
+    utils.run_batch(copy_to, dest_images[:1] + dest_folders, jobs, name="Copy")
@@ -1,8 +1,9 @@
 import os
 import shutil
 import re
+import tempfile
 
-from d2_docker import utils
+from d2_docker import build_context, compression, utils
 
 DESCRIPTION = "Create d2-docker images"
 
@@ -18,10 +19,14 @@ def setup(parser):
 
     data_parser = subparser.add_parser("data", help="Create data image")
     data_parser.add_argument("data_image", metavar="IMAGE", help="Image core name")
-    data_parser.add_argument("--sql", help="Supported sql / sql.gz / dump formats")
+    data_parser.add_argument(
+        "--sql", help="Supported sql / sql.gz / dump formats (or a pg_dump directory-format dump)"
+    )
     data_parser.add_argument("--apps-dir", help="Directory containing Dhis2 apps")
     data_parser.add_argument("--documents-dir", help="Directory containing Dhis2 documents")
     data_parser.add_argument("--datavalues-dir", help="Directory containing Dhis2 data values")
+    utils.add_db_format_args(data_parser)
+    utils.add_compression_args(data_parser, help_subject="plain SQL file")
 
 
 def run(args):
@@ -74,27 +79,65 @@ def create_data(args):
     temp_dir = utils.get_temp_base_directory(args)
     utils.logger.info("Create data image: {}".format(image))
 
-    with utils.temporal_build_directory(docker_dir, temp_dir) as build_dir:
-        db_path = os.path.join(build_dir, "db/")
-        utils.mkdir_p(db_path)
-        if args.apps_dir:
-            dest_apps_dir = os.path.join(build_dir, "apps")
-            utils.logger.debug("Copy apps: {} -> {}".format(args.apps_dir, dest_apps_dir))
-            utils.copytree(args.apps_dir, dest_apps_dir)
-        if args.documents_dir:
-            dest_documents_dir = os.path.join(build_dir, "document")
-            utils.logger.debug(
-                "Copy documents: {} -> {}".format(args.documents_dir, dest_documents_dir)
-            )
-            utils.copytree(args.documents_dir, dest_documents_dir)
-        if args.datavalues_dir:
-            dest_datavalues_dir = os.path.join(build_dir, "dataValue")
-            utils.logger.debug(
-                "Copy datavalues: {} -> {}".format(args.datavalues_dir, dest_datavalues_dir)
-            )
-            utils.copytree(args.datavalues_dir, dest_datavalues_dir)
-        if args.sql:
-            utils.logger.debug("Copy DB file:  {} -> {}".format(args.sql, db_path))
-            shutil.copy(args.sql, db_path)
-
-        utils.docker_build(build_dir, image)
+    # Only a DB that must be compressed or converted is written to a temporal directory, the
+    # rest of the inputs are streamed from their location into the docker build context.
+    with tempfile.TemporaryDirectory(dir=temp_dir) as db_temp_dir:
+        db_path = prepare_db(args, db_temp_dir)
+
+        with build_context.docker_build_stream([image]) as context:
+            context.add_directory_contents(docker_dir)
+            for (source_dir, folder) in [
+                (args.apps_dir, "apps"),
+                (args.documents_dir, "document"),
+                (args.datavalues_dir, "dataValue"),
+            ]:
+                if source_dir:
+                    utils.logger.debug("Add {}: {}".format(folder, source_dir))
+                    context.add_path(source_dir, folder)
+
+            if db_path == db_temp_dir:
+                context.add_path(db_temp_dir, "db")
+            elif db_path:
+                context.add_empty_directory("db")
+                context.add_path(db_path, "db/" + get_db_dump_name(db_path))
+            else:
+                context.add_empty_directory("db")
+
+
+def prepare_db(args, db_temp_dir):
+    """Return the path to add as DB dump: the --sql path, the temporal directory (if the dump
+    had to be compressed or converted) or None."""
+    if not args.sql:
+        return None
+    elif args.sql.endswith(".sql") and args.compression:
+        db_compression = utils.get_compression_from_args(args)
+        dest_sql_path = os.path.join(
+            db_temp_dir, os.path.basename(args.sql) + compression.get_extension(db_compression)
+        )
+        utils.logger.debug("Compress DB file: {} -> {}".format(args.sql, dest_sql_path))
+        compression.compress_file(args.sql, dest_sql_path, db_compression)
+    elif args.db_format and get_db_format(args.sql) != args.db_format:
+        dest_path = os.path.join(db_temp_dir, get_db_dump_name(args.sql))
+        utils.logger.debug("Copy DB: {} -> {}".format(args.sql, dest_path))
+        if os.path.isdir(args.sql):
+            utils.copytree(args.sql, dest_path)
+        else:
+            shutil.copy(args.sql, dest_path)
+    else:
+        return args.sql
+
+    if args.db_format:
+        utils.convert_database(db_temp_dir, args.db_format, args.db_jobs)
+    return db_temp_dir
+
+
+def get_db_format(path):
+    return "directory" if os.path.isdir(path) else "sql"
+
+
+def get_db_dump_name(path):
+    """Return the name of a --sql path in the data image db/ folder."""
+    if os.path.isdir(path):
+        return utils.get_db_dump_path("", "directory")
+    else:
+        return os.path.basename(path)
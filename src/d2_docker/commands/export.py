@@ -1,8 +1,7 @@
-import gzip
 import os
 import re
 
-from d2_docker import utils
+from d2_docker import utils, compression
 
 DESCRIPTION = "Export d2-docker images to a single file"
 
@@ -11,6 +10,7 @@ def setup(parser):
     utils.add_image_arg(parser)
     utils.add_core_image_arg(parser)
     parser.add_argument("output_file", metavar="TGZ_PATH", type=str, help="Output tar.gz file")
+    utils.add_compression_args(parser, help_subject="output file")
 
 
 def run(args):
@@ -22,18 +22,18 @@ def run(args):
     # Use regexp instead of using a third-party YAML parser to ease deployment on Windows.
     image_names = re.findall(r"image: (\S+)\r?$", yaml_contents, re.MULTILINE)
     utils.logger.info("Export images: {}".format(", ".join(image_names)))
-    tar_file = args.output_file + ".tar"
-    utils.save_images(image_names, tar_file)
-    compress_tar(tar_file, args.output_file)
+    export_images(image_names, args.output_file, utils.get_compression_from_args(args))
 
 
-def compress_tar(input_path, output_path):
-    gzip_file(input_path, output_path)
-    os.remove(input_path)
-    utils.logger.info("Compressed output file: {}".format(output_path))
-
+def export_images(image_names, output_path, output_compression=None):
+    """Stream `docker save` directly into the compressor, without intermediate files."""
+    try:
+        with utils.saved_images_stream(image_names) as images_stream:
+            with compression.compressed_writer(output_path, output_compression) as output:
+                utils.copy_stream(images_stream, output, "Export")
+    except BaseException:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
 
-def gzip_file(input_path, output_path):
-    with open(input_path, "rb") as fd_in:
-        with gzip.open(output_path, "wb") as fd_out:
-            fd_out.writelines(fd_in)
+    utils.logger.info("Compressed output file: {}".format(output_path))
@@ -1,4 +1,4 @@
-from d2_docker import utils
+from d2_docker import utils, images_archive
 
 NAME = "import"
 DESCRIPTION = "Import d2-docker images from file"
@@ -11,5 +11,5 @@ def setup(parser):
 def run(args):
     input_file = args.input_file
     utils.logger.info("Load images from file: {}".format(input_file))
-    info = utils.load_images_file(input_file)
-    print(info.stdout.decode("utf-8").strip())
+    repo_tags = images_archive.import_images(input_file)
+    print("\n".join("Image: {}".format(repo_tag) for repo_tag in repo_tags))
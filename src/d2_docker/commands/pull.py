@@ -4,12 +4,14 @@ DESCRIPTION = "Pull dhis2-data docker image"
 
 
 def setup(parser):
-    parser.add_argument(
-        "image", metavar="IMAGE", type=str, nargs="?", help="Docker dhis2-data image"
-    )
+    utils.add_batch_args(parser)
 
 
 def run(args):
-    image_name = args.image or utils.get_running_image_name()
+    image_names = utils.get_batch_images(args) or [utils.get_running_image_name()]
+    utils.run_batch(pull_image, image_names, args.jobs, name="Pull")
+
+
+def pull_image(image_name):
     utils.logger.info("Pull image: {}".format(image_name))
     utils.pull_image(image_name)
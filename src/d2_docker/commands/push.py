@@ -7,17 +7,21 @@ def setup(parser):
     parser.add_argument(
         "--with-core", action="store_true", help="Push also dhis2-core companion image"
     )
-    parser.add_argument(
-        "image", metavar="IMAGE", type=str, nargs="?", help="Docker dhis2-data image"
-    )
+    utils.add_batch_args(parser)
 
 
 def run(args):
-    data_image_name = args.image or utils.get_running_image_name()
-    utils.logger.info("Push data image: {}".format(data_image_name))
-    utils.push_image(data_image_name)
+    data_image_names = utils.get_batch_images(args) or [utils.get_running_image_name()]
+    # Data images of the same version share the core image, push it once
+    core_image_names = (
+        [utils.get_core_image_name(image_name) for image_name in data_image_names]
+        if args.with_core
+        else []
+    )
+    image_names = list(dict.fromkeys(data_image_names + core_image_names))
+    utils.run_batch(push_image, image_names, args.jobs, name="Push")
+
 
-    if args.with_core:
-        core_image_name = utils.get_core_image_name(data_image_name)
-        utils.logger.info("Push core image: {}".format(core_image_name))
-        utils.push_image(core_image_name)
+def push_image(image_name):
+    utils.logger.info("Push image: {}".format(image_name))
+    utils.push_image(image_name)
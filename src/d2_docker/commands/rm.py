@@ -1,15 +1,15 @@
-from d2_docker import utils
+from d2_docker import utils, ports
 
 DESCRIPTION = "Remove dhis2-data docker images/containers"
 
 
 def setup(parser):
-    parser.add_argument("images", metavar="IMAGE", nargs="+", help="Docker dhis2-data images")
+    utils.add_batch_args(parser, required=True)
 
 
 def run(args):
-    for image in args.images:
-        remove_image(image)
+    images = utils.get_batch_images(args)
+    utils.run_batch(remove_image, images, args.jobs, name="Remove")
 
 
 def remove_image(image):
@@ -21,4 +21,5 @@ def remove_image(image):
     if container_ids:
         utils.run_docker(["container", "rm", *container_ids])
     utils.run_docker(["image", "rm", image])
+    ports.release_ports(utils.get_project_name(image))
     utils.logger.info("Removed: {}".format(image))
@@ -47,7 +47,16 @@ def run(args):
                 return 1
 
 
-def get_stream_db(image):
+def run_psql(db_container, commands, database="dhis2", capture_output=False):
+    """Run SQL commands (each one in its own transaction) with psql in the DB container."""
+    command_args = [arg for command in commands for arg in ["-c", command]]
+    psql_cmd = ["psql", "-U", "dhis", "-v", "ON_ERROR_STOP=1", "-At", "-F", "\t", database]
+    cmd = ["docker", "exec", db_container, *psql_cmd, *command_args]
+    result = utils.run(cmd, capture_output=capture_output)
+    return result.stdout.decode("utf-8") if capture_output else None
+
+
+def get_stream_db(image, db_compression=None):
     image_name = image or utils.get_running_image_name()
     status = utils.get_image_status(image_name)
 
@@ -55,7 +64,12 @@ def get_stream_db(image):
         raise utils.D2DockerError("Container must be running to dump database")
 
     db_container = status["containers"]["db"]
-    cmd_parts = ["docker", "exec", db_container, *get_pg_dump_command()]
+    compress_cmd = utils.get_host_compress_command(db_compression)
+    level = db_compression.level if db_compression else None
+    pg_dump_cmd = get_pg_dump_command(compress=not compress_cmd, compress_level=level)
+    cmd_parts = ["docker", "exec", db_container, *pg_dump_cmd]
+    if compress_cmd:
+        cmd_parts += ["|", *compress_cmd]
     cmd = subprocess.list2cmdline(cmd_parts)
     utils.logger.info("Dump SQL for image: {}".format(cmd))
 
@@ -0,0 +1,159 @@
+import contextlib
+import re
+
+from d2_docker import utils
+from d2_docker.commands import run_sql
+
+DESCRIPTION = "Create/restore snapshots of the database of a running d2-docker instance"
+
+SNAPSHOT_DB_PREFIX = "d2_snapshot_"
+DB_NAME = "dhis2"
+
+
+def setup(parser):
+    subparser = parser.add_subparsers(help="Snapshot action", dest="action")
+
+    create_parser = subparser.add_parser("create", help="Create a snapshot of the database")
+    restore_parser = subparser.add_parser("restore", help="Restore the database from a snapshot")
+    list_parser = subparser.add_parser("list", help="List snapshots")
+    drop_parser = subparser.add_parser("drop", help="Remove a snapshot")
+
+    for action_parser in [create_parser, restore_parser, drop_parser]:
+        action_parser.add_argument("image", metavar="IMAGE", help="Docker dhis2-data image")
+        action_parser.add_argument("name", metavar="NAME", help="Snapshot name")
+    list_parser.add_argument("image", metavar="IMAGE", nargs="?", help="Docker dhis2-data image")
+
+    restore_parser.add_argument(
+        "--restart-core",
+        action="store_true",
+        help="Restart DHIS2 after the restore (clear the application caches)",
+    )
+
+
+def run(args):
+    if args.action == "create":
+        create_snapshot(args.image, args.name)
+    elif args.action == "restore":
+        restore_snapshot(args.image, args.name, restart_core=args.restart_core)
+    elif args.action == "list":
+        snapshots = list_snapshots(args.image)
+        print("\n".join("{name} {size}".format(**snapshot) for snapshot in snapshots))
+    elif args.action == "drop":
+        drop_snapshot(args.image, args.name)
+    else:
+        raise utils.D2DockerError("Unknown subcommand for snapshot: {}".format(args.action))
+
+
+def create_snapshot(image, name):
+    """Copy the DHIS2 database to a snapshot database (CREATE DATABASE ... TEMPLATE)."""
+    status = get_running_status(image)
+    snapshot_db = get_snapshot_db_name(name)
+    db_container = status["containers"]["db"]
+    utils.logger.info("Create snapshot: {} ({})".format(name, status["image_name"]))
+
+    # The template database cannot have other connections while it's copied
+    with quiesced_core(status):
+        run_sql.run_psql(
+            db_container,
+            [
+                get_terminate_connections_sql(DB_NAME),
+                "CREATE DATABASE {} TEMPLATE {} OWNER dhis".format(snapshot_db, DB_NAME),
+            ],
+            database="postgres",
+        )
+
+
+def restore_snapshot(image, name, restart_core=False):
+    """Replace the DHIS2 database with a copy of a snapshot database."""
+    status = get_running_status(image)
+    snapshot_db = get_snapshot_db_name(name)
+    restore_db = snapshot_db + "_restore"
+    db_container = status["containers"]["db"]
+    utils.logger.info("Restore snapshot: {} ({})".format(name, status["image_name"]))
+
+    if name.lower() not in [snapshot["name"] for snapshot in list_snapshots(image)]:
+        raise utils.D2DockerError("Snapshot not found: {}".format(name))
+
+    # Copy the snapshot while DHIS2 is running, so the core is paused only for the swap.
+    run_sql.run_psql(
+        db_container,
+        [
+            "DROP DATABASE IF EXISTS {}".format(restore_db),
+            "CREATE DATABASE {} TEMPLATE {} OWNER dhis".format(restore_db, snapshot_db),
+        ],
+        database="postgres",
+    )
+
+    with quiesced_core(status):
+        run_sql.run_psql(
+            db_container,
+            [
+                get_terminate_connections_sql(DB_NAME),
+                "DROP DATABASE {}".format(DB_NAME),
+                "ALTER DATABASE {} RENAME TO {}".format(restore_db, DB_NAME),
+            ],
+            database="postgres",
+        )
+
+    if restart_core:
+        utils.logger.info("Restart core container: {}".format(status["containers"]["core"]))
+        utils.run(["docker", "restart", status["containers"]["core"]], capture_output=True)
+
+
+def list_snapshots(image):
+    """Return a list of snapshots ({name, size}) of a running instance."""
+    status = get_running_status(image)
+    sql = (
+        "SELECT substr(datname, {}), pg_size_pretty(pg_database_size(datname)) FROM pg_database"
+        " WHERE datname LIKE '{}%' AND datname NOT LIKE '%\\_restore' ORDER BY datname"
+    ).format(len(SNAPSHOT_DB_PREFIX) + 1, SNAPSHOT_DB_PREFIX.replace("_", "\\_"))
+    output = run_sql.run_psql(
+        status["containers"]["db"], [sql], database="postgres", capture_output=True
+    )
+    rows = [line.split("\t") for line in output.splitlines() if line.strip()]
+    return [dict(name=name, size=size) for (name, size) in rows]
+
+
+def drop_snapshot(image, name):
+    status = get_running_status(image)
+    utils.logger.info("Drop snapshot: {} ({})".format(name, status["image_name"]))
+    run_sql.run_psql(
+        status["containers"]["db"],
+        ["DROP DATABASE {}".format(get_snapshot_db_name(name))],
+        database="postgres",
+    )
+
+
+def get_running_status(image):
+    image_name = image or utils.get_running_image_name()
+    status = utils.get_image_status(image_name)
+    if status["state"] != "running":
+        raise utils.D2DockerError("Container must be running: {}".format(image_name))
+    return dict(status, image_name=image_name)
+
+
+def get_snapshot_db_name(name):
+    if not re.match(r"^[a-zA-Z0-9_]+$", name or ""):
+        msg = "Invalid snapshot name (use letters, digits and _): {}".format(name)
+        raise utils.D2DockerError(msg)
+    return SNAPSHOT_DB_PREFIX + name.lower()
+
+
+def get_terminate_connections_sql(database):
+    return (
+        "SELECT pg_terminate_backend(pid) FROM pg_stat_activity"
+        " WHERE datname = '{}' AND pid <> pg_backend_pid()"
+    ).format(database)
+
+
+@contextlib.contextmanager
+def quiesced_core(status):
+    """Pause the core container (DHIS2) while the block runs."""
+    core_container = status["containers"]["core"]
+    utils.logger.debug("Pause core container: {}".format(core_container))
+    utils.run(["docker", "pause", core_container], capture_output=True)
+    try:
+        yield
+    finally:
+        utils.logger.debug("Unpause core container: {}".format(core_container))
+        utils.run(["docker", "unpause", core_container], capture_output=True)
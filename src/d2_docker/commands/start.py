@@ -1,7 +1,7 @@
 import os
 import re
 
-from d2_docker import utils
+from d2_docker import utils, images_archive, pgdata_cache
 
 DESCRIPTION = "Start a container from an existing dhis2-data Docker image or from an exported file"
 
@@ -12,8 +12,8 @@ def setup(parser):
     dhis_conf_path = utils.get_config_file("DHIS2_home/dhis.conf")
     dhis_conf_help = "Use a custom dhis.conf file. Template: {0}".format(dhis_conf_path)
 
-    parser.add_argument(
-        "image", metavar="IMAGE_OR_EXPORT_FILE", help="Docker image or exported file"
+    utils.add_batch_args(
+        parser, metavar="IMAGE_OR_EXPORT_FILE", help="Docker images or exported files", required=True
     )
     utils.add_core_image_arg(parser)
     parser.add_argument("--auth", metavar="USER:PASSWORD", help="Dhis2 instance authentication")
@@ -41,43 +41,76 @@ def setup(parser):
     parser.add_argument("--postgis-version", type=str, help="Set PostGIS database version")
     parser.add_argument("--enable-postgres-queries-logging", action="store_true",
                         help="Enable Postgres queries logging")
+    parser.add_argument(
+        "--db-jobs",
+        type=int,
+        metavar="N",
+        help="Parallel jobs to restore directory-format DB dumps (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--wait",
+        dest="wait_ready",
+        action="store_true",
+        help="Run on the background and wait until the DHIS2 instance is ready",
+    )
+    parser.add_argument(
+        "--wait-timeout",
+        type=int,
+        metavar="SECONDS",
+        help="Maximum time to wait with --wait (default: no limit)",
+    )
+    parser.add_argument(
+        "--pgdata-cache",
+        action="store_true",
+        help="Clone the DB volume from a cached snapshot of the restored image (create if missing)",
+    )
 
 
 def run(args):
-    image_or_file = args.image
+    images_or_files = utils.get_batch_images(args)
 
-    if os.path.exists(image_or_file) and os.path.isfile(image_or_file):
-        image2 = import_from_file(image_or_file)
+    if len(images_or_files) == 1:
+        args.image = get_image(images_or_files[0])
+        start(args)
     else:
-        image2 = args.image
+        if args.port:
+            raise utils.D2DockerError("Option --port cannot be used when starting many images")
+        elif not args.detach and not args.wait_ready:
+            raise utils.D2DockerError("Use --detach or --wait to start many images")
+
+        def start_image(image_or_file):
+            start(args, get_image(image_or_file))
 
-    args.image = image2
-    start(args)
+        utils.run_batch(start_image, images_or_files, args.jobs, name="Start")
+
+
+def get_image(image_or_file):
+    if os.path.exists(image_or_file) and os.path.isfile(image_or_file):
+        return import_from_file(image_or_file)
+    else:
+        return image_or_file
 
 
 def import_from_file(images_path):
     dhis2_data_image_re = "/{}:".format(utils.DHIS2_DATA_IMAGE)
-    result = utils.load_images_file(images_path)
-    lines = result.stdout.decode("utf-8").splitlines()
-    lines_splitted = [line.split() for line in lines]
-    dhis2_data_images = [
-        parts[-1] for parts in lines_splitted if parts and re.search(dhis2_data_image_re, parts[-1])
-    ]
-    if dhis2_data_images:
-        return dhis2_data_images[0]
+    repo_tags = images_archive.import_images(images_path)
+    data_image = images_archive.get_data_image_name(repo_tags)
+
+    if data_image:
+        return data_image
     else:
         msg = "Cannot find dhis2 data image (pattern={})".format(dhis2_data_image_re)
         raise utils.D2DockerError(msg)
 
 
-def start(args):
-    image_name = args.image
+def start(args, image_name=None):
+    image_name = image_name or args.image
     utils.logger.info("Start image: {}".format(image_name))
     result = utils.get_image_status(image_name)
     if result["state"] == "running":
         msg = "Container already runnning for image {}".format(result["containers"]["db"])
         raise utils.D2DockerError(msg)
-    port = args.port or utils.get_free_port()
+    port = args.port or utils.get_free_port(image_name=image_name)
     utils.logger.info("Port: {}".format(port))
     core_image = args.core_image
     override_containers = not args.keep_containers
@@ -86,10 +119,17 @@ def start(args):
         utils.run_docker_compose(["pull"], image_name, core_image=core_image)
 
     if override_containers:
-        utils.run_docker_compose(["down", "--volumes"], image_name, core_image=core_image)
+        # Keep the data volume: the data container only re-populates the folders that changed
+        utils.run_docker_compose(["down"], image_name, core_image=core_image)
+        utils.remove_instance_volumes(image_name, keep=["data"])
 
+    db_from_snapshot = bool(args.pgdata_cache and override_containers)
+    if db_from_snapshot:
+        restore_pgdata_from_cache(image_name, core_image, args.postgis_version, args.db_jobs)
+
+    detach = args.detach or args.wait_ready
     up_args = filter(
-        bool, ["--force-recreate" if override_containers else None, "-d" if args.detach else None]
+        bool, ["--force-recreate" if override_containers else None, "-d" if detach else None]
     )
 
     deploy_path = "/" + re.sub("^/*", "", args.deploy_path) if args.deploy_path else ""
@@ -113,7 +153,45 @@ def start(args):
             java_opts=args.java_opts,
             postgis_version=args.postgis_version,
             enable_postgres_queries_logging=args.enable_postgres_queries_logging,
+            db_restore_jobs=args.db_jobs,
+            db_from_snapshot=db_from_snapshot,
         )
 
-    if args.detach:
+    if args.wait_ready:
+        wait_until_ready(image_name, port, args.bind_ip, deploy_path, args.wait_timeout)
+
+    if detach:
         utils.logger.info("Detaching... run d2-docker logs to see logs")
+
+
+def wait_until_ready(image_name, port, bind_ip, deploy_path, timeout=None):
+    utils.logger.info("Waiting for DHIS2 instance to be ready: {}".format(image_name))
+    host = bind_ip or "localhost"
+    if not utils.wait_for_server(port, image_name, timeout=timeout, host=host):
+        raise utils.D2DockerError("DHIS2 instance not found at port {}".format(port))
+    utils.logger.info("DHIS2 instance ready: http://{}:{}{}".format(host, port, deploy_path))
+
+
+def restore_pgdata_from_cache(image_name, core_image, postgis_version, db_jobs):
+    """Fill the pgdata volume of the instance from a cached snapshot. If there is no snapshot
+    for the image, restore the DB dump (restore-only run of core) and save it."""
+    key = pgdata_cache.get_cache_key(image_name, postgis_version)
+    pgdata_volume = utils.get_instance_volume_name(image_name, "pgdata")
+    compose_kwargs = dict(core_image=core_image, postgis_version=postgis_version)
+
+    if pgdata_cache.exists(key):
+        labels = utils.get_instance_volume_labels(image_name, "pgdata")
+        pgdata_cache.restore(key, pgdata_volume, labels, postgis_version)
+    else:
+        utils.logger.info("No pgdata snapshot for image, restore DB: {}".format(image_name))
+        utils.run_docker_compose(
+            ["run", "--rm", "core"],
+            image_name,
+            load_from_data=True,
+            db_restore_only=True,
+            db_restore_jobs=db_jobs,
+            **compose_kwargs,
+        )
+        # Stop the DB server so the snapshot is consistent
+        utils.run_docker_compose(["stop"], image_name, **compose_kwargs)
+        pgdata_cache.save(key, pgdata_volume, image_name, postgis_version)
@@ -4,10 +4,14 @@ DESCRIPTION = "Stop docker containers"
 
 
 def setup(parser):
-    parser.add_argument("image", metavar="IMAGE", type=str, nargs="?", help="Docker image")
+    utils.add_batch_args(parser, help="Docker images")
 
 
 def run(args):
-    image_name = args.image or utils.get_running_image_name()
+    image_names = utils.get_batch_images(args) or [utils.get_running_image_name()]
+    utils.run_batch(stop_image, image_names, args.jobs, name="Stop")
+
+
+def stop_image(image_name):
     utils.logger.info("Stop container for image: {}".format(image_name))
     utils.run_docker_compose(["stop"], image_name)
@@ -1,7 +1,8 @@
+import concurrent.futures
 import glob
 import os
 
-from d2_docker import utils, iter_versions
+from d2_docker import utils, iter_versions, ports, tracing
 
 DESCRIPTION = "Upgrade DHIS2 version on core+data containers/images"
 
@@ -26,6 +27,28 @@ def setup(parser):
 
     parser.add_argument("-p", "--port", type=int, metavar="N", help="DHIS2 instance port")
 
+    parser.add_argument(
+        "--chained",
+        action="store_true",
+        help="Upgrade all versions on a single instance (DB loaded once), commit only the last one",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        dest="checkpoints",
+        metavar="VERSION",
+        action="append",
+        default=[],
+        help="With --chained, also commit the image of this intermediate version (repeatable)",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        metavar="N",
+        help="Core images built in parallel (default: {})".format(utils.DEFAULT_BATCH_JOBS),
+    )
+
 
 def run(args):
     source_image = utils.ImageName.from_string(args.from_)
@@ -36,52 +59,107 @@ def run(args):
     temp_dir = utils.get_temp_base_directory(args)
     utils.logger.info("Upgrade versions: {}".format(" -> ".join(versions)))
 
+    invalid_checkpoints = [version for version in args.checkpoints if version not in versions[1:]]
+    if args.checkpoints and not args.chained:
+        raise utils.D2DockerError("Option --checkpoint requires --chained")
+    elif invalid_checkpoints:
+        msg = "Checkpoint versions not in the upgrade: {}".format(", ".join(invalid_checkpoints))
+        raise utils.D2DockerError(msg)
+
+    # Core images depend only on the versions, not on the migrations: build them all in the
+    # background (the earliest versions first) while the migrations run in sequence.
+    max_workers = args.jobs or utils.DEFAULT_BATCH_JOBS
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    core_builds = utils.ProcessGroup()
+
+    core_futures = {}
     for version in versions[1:]:
-        dest_image_with_version = dest_image.with_version(version)
-        core_image = dest_image_with_version.core().with_name(args.core_image_suffix).get()
-        keep_running = args.keep_running and version == versions[-1]
-        upgrade_to_version(
-            migrations_dir=args.migrations_dir,
-            version=version,
-            core_image=core_image,
-            source_image=source_image.get(),
-            dest_image=dest_image_with_version.get(),
-            port=args.port,
-            keep_running=keep_running,
-            temp_dir=temp_dir,
+        core_image = dest_image.with_version(version).core().with_name(args.core_image_suffix)
+        create_core = core_builds.wrap(tracing.propagate(create_core_image))
+        core_futures[version] = executor.submit(
+            create_core, args.migrations_dir, version, core_image.get()
         )
-        source_image = source_image.with_version(version)
+
+    def get_core_image(version):
+        with tracing.span("wait_core_image", version=version):
+            return core_futures[version].result()
+
+    try:
+        if args.chained:
+            upgrade_chained(
+                migrations_dir=args.migrations_dir,
+                versions=versions,
+                get_core_image=get_core_image,
+                source_image=source_image,
+                dest_image=dest_image,
+                checkpoints=args.checkpoints,
+                port=args.port,
+                keep_running=args.keep_running,
+                temp_dir=temp_dir,
+            )
+        else:
+            for version in versions[1:]:
+                dest_image_with_version = dest_image.with_version(version)
+                keep_running = args.keep_running and version == versions[-1]
+                core_image = get_core_image(version)
+                with tracing.span("upgrade_to_version", version=version):
+                    upgrade_to_version(
+                        migrations_dir=args.migrations_dir,
+                        version=version,
+                        core_image=core_image,
+                        source_image=source_image.get(),
+                        dest_image=dest_image_with_version.get(),
+                        port=args.port,
+                        keep_running=keep_running,
+                        temp_dir=temp_dir,
+                    )
+                source_image = source_image.with_version(version)
+    except BaseException:
+        # Do not wait for the running builds: terminate their processes (docker build) and
+        # cancel the pending ones (WAR downloads stop at the next chunk).
+        for future in core_futures.values():
+            future.cancel()
+        core_builds.terminate()
+        executor.shutdown(wait=False)
+        raise
+    else:
+        executor.shutdown()
 
     utils.logger.info("Done")
 
 
-def upgrade_to_version(
-    *, version, source_image, dest_image, core_image, port, migrations_dir, keep_running, temp_dir
-):
-    utils.logger.info("Upgrade: {} -> {}".format(source_image, dest_image))
+def create_core_image(migrations_dir, version, core_image):
+    """Build the core image of a version (WAR and dhis2-home files from the migrations
+    directory, if present). Return the image name."""
     version_path = os.path.join(migrations_dir, version) if migrations_dir else None
-
-    # Create core image
-    dhis_war_path = os.path.join(version_path, "dhis.war") if version_path else None
+    dhis_war_path = get_migrations_war_path(migrations_dir, version)
     dhis2_home_paths = (
         glob.glob(os.path.join(version_path, "dhis2-home", "*")) if version_path else []
     )
-    war_exists = dhis_war_path and os.path.exists(dhis_war_path)
-    create_core_kwargs = dict(war=dhis_war_path) if war_exists else dict(version=version)
+    create_core_kwargs = dict(war=dhis_war_path) if dhis_war_path else dict(version=version)
     core_docker_dir = utils.get_docker_directory("core")
-    utils.create_core(
-        docker_dir=core_docker_dir,
-        image=core_image,
-        dhis2_home_paths=dhis2_home_paths,
-        **create_core_kwargs
-    )
+    with tracing.span("create_core_image", version=version):
+        utils.create_core(
+            docker_dir=core_docker_dir,
+            image=core_image,
+            dhis2_home_paths=dhis2_home_paths,
+            **create_core_kwargs
+        )
+    return core_image
+
+
+def upgrade_to_version(
+    *, version, source_image, dest_image, core_image, port, migrations_dir, keep_running, temp_dir
+):
+    utils.logger.info("Upgrade: {} -> {}".format(source_image, dest_image))
+    version_path = os.path.join(migrations_dir, version) if migrations_dir else None
 
     # Create data image
     data_docker_dir = utils.get_docker_directory("data")
     utils.copy_image(data_docker_dir, source_image, dest_image, temp_dir)
 
     # Start
-    final_port = port or utils.get_free_port()
+    final_port = port or utils.get_free_port(image_name=dest_image)
 
     utils.run_docker_compose(["down", "--volumes"], dest_image, core_image=core_image)
 
@@ -96,7 +174,7 @@ def upgrade_to_version(
             scripts_dir=version_path,
         )
 
-        if not utils.wait_for_server(final_port):
+        if not utils.wait_for_server(final_port, image_name=dest_image):
             raise utils.D2DockerError("Error waiting for DHIS2 instance to be active")
 
         # Commit
@@ -105,3 +183,82 @@ def upgrade_to_version(
     # Stop
     if not keep_running:
         utils.run_docker_compose(["stop"], dest_image)
+
+
+def upgrade_chained(
+    *,
+    versions,
+    get_core_image,
+    source_image,
+    dest_image,
+    checkpoints,
+    port,
+    migrations_dir,
+    keep_running,
+    temp_dir
+):
+    """
+    Upgrade all versions on a single instance: the DB (pgdata volume) is loaded once from the
+    source image, then each version only replaces the core container, which runs the post SQL
+    and scripts of the version against the same DB. Commit the last version and the
+    checkpoint versions.
+    """
+    # The instance runs under a temporal work tag of the source image, the destination images
+    # are only created by the commits (checkpoints and last version).
+    final_image = dest_image.with_version(versions[-1]).get()
+    work_image = final_image + "-chained-work"
+    utils.logger.info("Chained upgrade: {} -> {}".format(source_image.get(), final_image))
+    utils.run(["docker", "tag", source_image.get(), work_image])
+    data_docker_dir = utils.get_docker_directory("data")
+    core_image = get_core_image(versions[1])
+
+    try:
+        final_port = port or utils.get_free_port(image_name=work_image)
+        utils.run_docker_compose(["down", "--volumes"], work_image, core_image=core_image)
+
+        for version in versions[1:]:
+            is_first = version == versions[1]
+            core_image = get_core_image(version)
+            version_path = os.path.join(migrations_dir, version) if migrations_dir else None
+            utils.logger.info("Upgrade (chained): {} -> {}".format(work_image, version))
+
+            with tracing.span("upgrade_to_version", version=version, chained=True):
+                # Recreate only the core container, the DB volume is kept
+                up_args = [] if is_first else ["--no-deps", "core"]
+                utils.run_docker_compose(
+                    ["up", "--force-recreate", "-d", *up_args],
+                    work_image,
+                    port=final_port,
+                    core_image=core_image,
+                    load_from_data=is_first,
+                    post_sql_dir=version_path,
+                    scripts_dir=version_path,
+                )
+
+                if not utils.wait_for_server(final_port, image_name=work_image):
+                    raise utils.D2DockerError("Error waiting for DHIS2 instance to be active")
+
+                if version in checkpoints or version == versions[-1]:
+                    commit_image = dest_image.with_version(version).get()
+                    utils.build_image_from_source(
+                        data_docker_dir, work_image, commit_image, temp_dir
+                    )
+    finally:
+        utils.logger.info("Remove work instance: {}".format(work_image))
+        utils.run_docker_compose(["down", "--volumes"], work_image, core_image=core_image)
+        ports.release_ports(utils.get_project_name(work_image))
+        utils.run(["docker", "image", "rm", work_image])
+
+    if keep_running:
+        final_port = port or utils.get_free_port(image_name=final_image)
+        utils.run_docker_compose(
+            ["up", "-d"], final_image, port=final_port, core_image=core_image, load_from_data=True
+        )
+
+
+def get_migrations_war_path(migrations_dir, version):
+    """Return the WAR file for a version in the migrations directory, None if not present."""
+    if not migrations_dir:
+        return None
+    war_path = os.path.join(migrations_dir, version, "dhis.war")
+    return war_path if os.path.exists(war_path) else None
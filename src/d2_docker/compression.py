@@ -0,0 +1,134 @@
+"""
+Compression codecs (gzip, pigz, zstd) for DB dumps and exported files.
+
+Multi-threaded codecs run as external processes (pigz / zstd must be installed). The gzip codec
+falls back to Python's gzip module when no gzip/pigz binary is available (ex: Windows).
+"""
+import collections
+import contextlib
+import gzip
+import shutil
+import subprocess
+
+Codec = collections.namedtuple("Codec", ["name", "program", "extension", "mimetype", "max_level"])
+
+CODECS = collections.OrderedDict(
+    (codec.name, codec)
+    for codec in [
+        Codec("gzip", "gzip", ".gz", "application/gzip", 9),
+        Codec("pigz", "pigz", ".gz", "application/gzip", 9),
+        Codec("zstd", "zstd", ".zst", "application/zstd", 22),
+    ]
+)
+
+DEFAULT_CODEC = "gzip"
+
+Compression = collections.namedtuple(
+    "Compression", ["codec", "level", "threads"], defaults=[DEFAULT_CODEC, None, None]
+)
+
+
+class CompressionError(Exception):
+    pass
+
+
+def get_compression(codec=None, level=None, threads=None):
+    name = codec or DEFAULT_CODEC
+    if name not in CODECS:
+        raise CompressionError("Unknown codec: {} (available: {})".format(name, ", ".join(CODECS)))
+
+    try:
+        level_value = int(level) if level else None
+        threads_value = int(threads) if threads else None
+    except ValueError as exc:
+        raise CompressionError("Invalid compression options: {}".format(exc))
+
+    if level_value is not None and not 1 <= level_value <= CODECS[name].max_level:
+        raise CompressionError("Invalid {} level: {}".format(name, level_value))
+    return Compression(name, level_value, threads_value)
+
+
+def get_codec(compression):
+    return CODECS[(compression or Compression()).codec]
+
+
+def get_extension(compression):
+    return get_codec(compression).extension
+
+
+def get_compress_command(compression):
+    """Return the command (list) that compresses stdin to stdout, or None if the codec should
+    use the Python fallback (gzip without binaries)."""
+    compression = compression or Compression()
+    codec = get_codec(compression)
+    level = compression.level
+    threads = compression.threads
+
+    if level is not None and not 1 <= level <= codec.max_level:
+        raise CompressionError("Invalid {} level: {}".format(codec.name, level))
+
+    if codec.name == "zstd":
+        check_program(codec.program)
+        level_args = ["--ultra"] if level and level > 19 else []
+        level_args += ["-{}".format(level)] if level else []
+        return ["zstd", "-c", "-q", "-T{}".format(threads or 0), *level_args]
+    else:
+        if codec.name == "pigz":
+            # Explicitly requested, do not fall back to gzip
+            check_program(codec.program)
+        program = get_gzip_program(prefer_pigz=codec.name == "pigz")
+        if not program:
+            return None
+        threads_args = ["-p", str(threads)] if threads and program == "pigz" else []
+        level_args = ["-{}".format(level)] if level else []
+        return [program, "-c", *threads_args, *level_args]
+
+
+def get_decompress_command(codec_name):
+    """Return the command (list) that decompresses stdin to stdout, or None to use the Python
+    fallback."""
+    if codec_name == "zstd":
+        check_program("zstd")
+        return ["zstd", "-d", "-c", "-q", "-T0"]
+    else:
+        program = get_gzip_program(prefer_pigz=True)
+        return [program, "-d", "-c"] if program else None
+
+
+def get_gzip_program(prefer_pigz):
+    programs = ["pigz", "gzip"] if prefer_pigz else ["gzip"]
+    return next((program for program in programs if shutil.which(program)), None)
+
+
+def check_program(program):
+    if not shutil.which(program):
+        raise CompressionError("Compression program not found: {}".format(program))
+
+
+@contextlib.contextmanager
+def compressed_writer(output_path, compression=None):
+    """Yield a binary file-like object, data written to it is compressed into output_path."""
+    compression = compression or Compression()
+    command = get_compress_command(compression)
+
+    if command:
+        with open(output_path, "wb") as output_file:
+            popen = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=output_file)
+            try:
+                yield popen.stdin
+            finally:
+                popen.stdin.close()
+                return_code = popen.wait()
+            if return_code != 0:
+                msg = "Command {} failed with code {}".format(" ".join(command), return_code)
+                raise CompressionError(msg)
+    else:
+        with gzip.open(output_path, "wb", compresslevel=compression.level or 6) as output_file:
+            yield output_file
+
+
+def compress_file(input_path, output_path, compression=None, chunk_size=1024 * 1024):
+    """Compress a file in chunks of bounded size."""
+    with open(input_path, "rb") as input_file:
+        with compressed_writer(output_path, compression) as output_file:
+            shutil.copyfileobj(input_file, output_file, chunk_size)
@@ -43,6 +43,9 @@ wait_for_data_container_to_finish_copy() {
 
 }
 
+# Defines fix_ownership (config is mounted, so it also works with older core images)
+. /config/dhis2-core-fix-ownership.sh
+
 if [ "$(id -u)" = "0" ]; then
     if [ -f $WARFILE ]; then
         unzip -q $WARFILE -d $TOMCATDIR/webapps/ROOT
@@ -51,9 +54,9 @@ if [ "$(id -u)" = "0" ]; then
 
     wait_for_data_container_to_finish_copy
 
-    mkdir -p $DATA_DIR/apps
-    chown -R tomcat:tomcat $TOMCATDIR $DATA_DIR/apps $DHIS2HOME
-    chmod -R u=rwX,g=rX,o-rwx $TOMCATDIR $DATA_DIR/apps $DHIS2HOME
+    # File store folders (apps, documents, data values) are used in place by tomcat
+    mkdir -p $DATA_DIR/apps $DATA_DIR/document $DATA_DIR/dataValue
+    fix_ownership $TOMCATDIR $DATA_DIR/apps $DATA_DIR/document $DATA_DIR/dataValue $DHIS2HOME
 
     # Launch the given command as tomcat, in two ways for backwards compatibility:
     if [ "$(grep '^ID=' /etc/os-release)" = "ID=alpine" ]; then
@@ -0,0 +1,19 @@
+#!/bin/bash
+#
+# fix_ownership PATH...: shared by the core image entrypoint (images/dhis2-core, copied to
+# /usr/local/bin) and the compose entrypoint (config/dhis2-core-entrypoint.sh).
+#
+
+fix_ownership() {
+    # Images are built with the webapp already exploded and owned by tomcat, so only fix the
+    # files that need it (new files in volumes, scripts output, ...) instead of a recursive
+    # chown/chmod of all the tree on every start. Fallback to recursive commands if the find
+    # implementation does not support these expressions (busybox on old images).
+    find "$@" \( ! -user tomcat -o ! -group tomcat \) -exec chown -h tomcat:tomcat {} + &&
+        find "$@" ! -type l \( -perm /g=w,o=rwx -o ! -perm -u=rw,g=r -o \
+            \( -type d ! -perm -u=x,g=x \) \) -exec chmod u=rwX,g=rX,o-rwx {} + ||
+        {
+            chown -R tomcat:tomcat "$@"
+            chmod -R u=rwX,g=rX,o-rwx "$@"
+        }
+}
@@ -12,6 +12,9 @@ set -e -u -o pipefail
 # Global: LOAD_FROM_DATA="yes" | "no"
 # Global: DEPLOY_PATH=string
 # Global: DHIS2_AUTH=string
+# Global: DB_RESTORE_JOBS=number (optional, defaults to the number of CPUs)
+# Global: DB_RESTORE_ONLY="yes" | "no" (load the DB and exit, used to create pgdata snapshots)
+# Global: DB_FROM_SNAPSHOT="yes" | "no" (the DB volume is a restored snapshot, skip the dump)
 
 export PGPASSWORD="dhis"
 
@@ -21,14 +24,14 @@ psql_base_cmd="psql --quiet -h db -U dhis dhis2"
 psql_cmd="$psql_base_cmd -v ON_ERROR_STOP=0"
 psql_strict_cmd="$psql_base_cmd -v ON_ERROR_STOP=1"
 pgrestore_cmd="pg_restore -h db -U dhis -d dhis2"
+restore_jobs="${DB_RESTORE_JOBS:-$(nproc)}"
 configdir="/config"
 homedir="/dhis2-home-files"
 scripts_dir="/data/scripts"
 root_db_path="/data/db"
 post_db_path="/data/db/post"
-source_apps_path="/data/apps"
-source_documents_path="/data/document"
-source_datavalues_path="/data/dataValue"
+data_path="/data"
+data_folders="apps document dataValue"
 files_path="/DHIS2_home/files/"
 tomcat_conf_dir="/usr/local/tomcat/conf"
 
@@ -37,7 +40,7 @@ debug() {
 }
 
 run_sql_files() {
-    base_db_path=$(test "${LOAD_FROM_DATA}" = "yes" && echo "$root_db_path" || echo "$post_db_path")
+    base_db_path=$(is_db_load_required && echo "$root_db_path" || echo "$post_db_path")
     debug "Files in data path"
     find "$base_db_path" >&2
 
@@ -47,10 +50,19 @@ run_sql_files() {
         $pgrestore_cmd "$path" || true
     done
 
-    find "$base_db_path" -type f \( -name '*.sql.gz' \) |
+    # pg_dump directory format (contains a toc.dat file), restore in parallel
+    find "$base_db_path" -type f -name 'toc.dat' |
+        sort | while read -r toc_path; do
+        path=$(dirname "$toc_path")
+        echo "Load SQL dump (directory, jobs=$restore_jobs): $path"
+        $pgrestore_cmd --jobs="$restore_jobs" "$path" || true
+    done
+
+    find "$base_db_path" -type f \( -name '*.sql.gz' -o -name '*.sql.zst' \) |
         sort | while read -r path; do
         echo "Load SQL (compressed): $path"
-        zcat "$path" | $psql_cmd || true
+        # SQL errors are ignored, but a decompression error aborts the start (pipefail)
+        decompress "$path" | { $psql_cmd || true; }
     done
 
     find "$base_db_path" -type f \( -name '*.sql' \) |
@@ -65,6 +77,25 @@ run_sql_files() {
     done
 }
 
+is_db_load_required() {
+    test "${LOAD_FROM_DATA}" = "yes" && test "${DB_FROM_SNAPSHOT:-no}" != "yes"
+}
+
+decompress() {
+    local path=$1
+    if [[ "$path" == *.zst ]]; then
+        if ! command -v zstd >/dev/null; then
+            debug "zstd not found, cannot load $path (the core image must be re-created)"
+            return 1
+        fi
+        zstd -d -c -q -T0 "$path"
+    elif command -v pigz >/dev/null; then
+        pigz -d -c "$path"
+    else
+        zcat "$path"
+    fi
+}
+
 run_psql_cmd() {
     local path=$1
     if [[ "$path" == *strict* ]]; then
@@ -90,28 +121,29 @@ run_post_scripts() {
     done
 }
 
-copy_apps() {
-    debug "Copy Dhis2 apps: $source_apps_path -> $files_path"
-    mkdir -p "$files_path/apps"
-    if test -e "$source_apps_path"; then
-        cp -Rv "$source_apps_path" "$files_path"
-    fi
-}
+# The file store folders are symlinks to the data volume, so DHIS2 uses the files in place
+# (no copy on start). The data container re-populates a folder only when its contents changed.
+link_data_folder() {
+    local folder=$1
+    local source_path="$data_path/$folder" dest_path="$files_path/$folder"
 
-copy_documents() {
-    debug "Copy Dhis2 documents: $source_documents_path -> $files_path"
-    mkdir -p "$files_path/document"
-    if test -e "$source_documents_path"; then
-        cp -Rv "$source_documents_path" "$files_path"
+    if test -L "$dest_path"; then
+        debug "Already linked: $dest_path -> $source_path"
+    elif test -d "$dest_path"; then
+        # Home volume created by an older version, keep using the copied folder
+        debug "Copy Dhis2 $folder: $source_path -> $files_path"
+        cp -R "$source_path" "$files_path"
+    else
+        debug "Link Dhis2 $folder: $dest_path -> $source_path"
+        mkdir -p "$files_path"
+        ln -s "$source_path" "$dest_path"
     fi
 }
 
-copy_datavalues() {
-    debug "Copy Dhis2 dataValues: $source_datavalues_path -> $files_path"
-    mkdir -p "$files_path/dataValue"
-    if test -e "$source_datavalues_path"; then
-        cp -Rv "$source_datavalues_path" "$files_path"
-    fi
+link_data_folders() {
+    for folder in $data_folders; do
+        link_data_folder "$folder"
+    done
 }
 
 copy_non_empty_files() {
@@ -143,13 +175,18 @@ start_tomcat() {
 }
 
 wait_for_tomcat() {
+    local delay=1
     debug "Waiting for Tomcat to start: $dhis2_url"
+    # Tomcat takes minutes to deploy DHIS2, back off up to 5 seconds between checks
     while ! curl -sS -i "$dhis2_url" 2>/dev/null | grep "^Location"; do
-        sleep 1
+        sleep $delay
+        delay=$((delay < 5 ? delay + 1 : 5))
     done
 }
 
 INIT_DONE_FILE="/tmp/dhis2-core-start.done"
+# Checked by the core healthcheck (docker-compose.yml)
+READY_FILE="/tmp/dhis2-core-start.ready"
 
 is_init_done() {
     test -e "$INIT_DONE_FILE"
@@ -162,10 +199,9 @@ init_done() {
 run() {
     local host=$1 psql_port=$2
 
+    rm -f "$READY_FILE"
     setup_tomcat
-    copy_apps
-    copy_documents
-    copy_datavalues
+    link_data_folders
 
     if is_init_done; then
         debug "Container: already configured. Skip DB load"
@@ -173,6 +209,10 @@ run() {
         debug "Container: clean. Load DB"
         wait_for_postgres
         run_sql_files
+        if test "${DB_RESTORE_ONLY:-no}" = "yes"; then
+            debug "DB restored (restore-only mode)"
+            return 0
+        fi
         run_pre_scripts || true
         init_done
     fi
@@ -181,6 +221,7 @@ run() {
     wait_for_tomcat
     run_post_scripts || true
     debug "DHIS2 instance ready"
+    touch "$READY_FILE"
     wait
 }
 
@@ -0,0 +1,229 @@
+"""
+Minimal client for the Docker Engine API over its unix socket.
+
+Read-only queries (containers, images, labels, ports) are much cheaper through the API than
+forking the docker CLI and parsing its text output. Connections are kept alive in a small pool
+so consecutive queries reuse the same socket.
+"""
+import contextlib
+import http.client
+import json
+import math
+import os
+import queue
+import socket
+import threading
+import urllib.parse
+
+DEFAULT_SOCKET_PATH = "/var/run/docker.sock"
+API_VERSION = "v1.41"
+
+
+class DockerApiError(Exception):
+    pass
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a unix socket."""
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class DockerClient:
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH, pool_size=4, timeout=30):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+
+    def _get_connection(self):
+        try:
+            return self.pool.get_nowait()
+        except queue.Empty:
+            return UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+
+    def _release_connection(self, connection):
+        try:
+            self.pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def request(self, method, path, params=None):
+        """Send a request and return (status, body_bytes). Retry once on stale connections."""
+        url = get_url(path, params)
+
+        for attempt in range(2):
+            connection = self._get_connection()
+            try:
+                connection.request(method, url)
+                response = connection.getresponse()
+                body = response.read()
+            except (ConnectionError, http.client.HTTPException) as exc:
+                connection.close()
+                if attempt == 0:
+                    continue
+                raise DockerApiError("Docker API request failed: {} {}: {}".format(method, url, exc))
+            except OSError as exc:
+                connection.close()
+                raise DockerApiError("Docker API request failed: {} {}: {}".format(method, url, exc))
+
+            if response.will_close:
+                connection.close()
+            else:
+                self._release_connection(connection)
+            return (response.status, body)
+
+    def get_json(self, path, params=None, allow_not_found=False):
+        status, body = self.request("GET", path, params)
+        if allow_not_found and status == 404:
+            return None
+        elif status >= 400:
+            raise DockerApiError("Docker API error {}: {}".format(status, body.decode("utf-8")))
+        else:
+            return json.loads(body.decode("utf-8"))
+
+    def ping(self):
+        status, _body = self.request("GET", "/_ping")
+        return status == 200
+
+    def containers(self, labels=None, all_=False):
+        """Return list of containers (as returned by /containers/json), filtered by labels."""
+        filters = {"label": labels} if labels else None
+        params = dict(all="1" if all_ else "0", filters=json.dumps(filters) if filters else None)
+        return self.get_json("/containers/json", params)
+
+    def images(self, reference=None):
+        """Return list of images (as returned by /images/json), filtered by reference."""
+        filters = {"reference": [reference]} if reference else None
+        params = dict(filters=json.dumps(filters) if filters else None)
+        return self.get_json("/images/json", params)
+
+    def inspect_image(self, name):
+        """Return image details or None if the image does not exist."""
+        return self.get_json("/images/{}/json".format(urllib.parse.quote(name, safe="")),
+                             allow_not_found=True)
+
+    @contextlib.contextmanager
+    def get_archive(self, container, path):
+        """Yield a file-like tar stream with the contents of a path in a container (the members
+        are prefixed with the path basename). Yield None if the path does not exist."""
+        connection = UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+        url = get_url("/containers/{}/archive".format(urllib.parse.quote(container)), dict(path=path))
+
+        try:
+            try:
+                connection.request("GET", url)
+                response = connection.getresponse()
+            except (OSError, http.client.HTTPException) as exc:
+                raise DockerApiError("Docker API request failed: GET {}: {}".format(url, exc))
+
+            if response.status == 404:
+                yield None
+            elif response.status >= 400:
+                msg = "Docker API error {}: {}".format(response.status, response.read())
+                raise DockerApiError(msg)
+            else:
+                yield response
+        finally:
+            connection.close()
+
+    def events(self, filters=None, since=None, until=None):
+        """Yield events (decoded JSON objects) from the daemon events stream. Past events are
+        replayed from `since`. Blocks until `until` (unix timestamps), forever if not set."""
+        connection = UnixHTTPConnection(self.socket_path, timeout=None)
+        params = dict(
+            filters=json.dumps(filters) if filters else None,
+            since=str(int(since)) if since else None,
+            until=str(int(math.ceil(until))) if until else None,
+        )
+        try:
+            connection.request("GET", get_url("/events", params))
+            response = connection.getresponse()
+            if response.status >= 400:
+                msg = "Docker API error {}: {}".format(response.status, response.read())
+                raise DockerApiError(msg)
+
+            while True:
+                line = response.readline()
+                if not line:
+                    break
+                elif line.strip():
+                    yield json.loads(line.decode("utf-8"))
+        except (OSError, http.client.HTTPException) as exc:
+            raise DockerApiError("Docker events stream failed: {}".format(exc))
+        finally:
+            connection.close()
+
+    def close(self):
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def get_url(path, params=None):
+    query = urllib.parse.urlencode(dict((k, v) for (k, v) in (params or {}).items() if v is not None))
+    return "/" + API_VERSION + path + ("?" + query if query else "")
+
+
+def get_socket_path():
+    """Return the docker unix socket path from DOCKER_HOST (or the default path). None if the
+    daemon is not reachable through a unix socket (tcp://, npipe://, ...)."""
+    docker_host = os.environ.get("DOCKER_HOST")
+    if not docker_host:
+        return DEFAULT_SOCKET_PATH
+    elif docker_host.startswith("unix://"):
+        return docker_host[len("unix://"):]
+    else:
+        return None
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the shared docker client, or None if the Docker Engine API socket is unavailable."""
+    global _client
+
+    with _client_lock:
+        if _client is None:
+            socket_path = get_socket_path()
+            if not hasattr(socket, "AF_UNIX") or not socket_path or not os.path.exists(socket_path):
+                _client = False
+            else:
+                _client = DockerClient(socket_path)
+        return _client or None
+
+
+def reset_client():
+    """Drop the shared client (ex: after changing DOCKER_HOST)."""
+    global _client
+
+    with _client_lock:
+        if _client:
+            _client.close()
+        _client = None
+
+
+def get_public_port(container, private_port, type_="tcp"):
+    """Return the host port published for a private container port, or None."""
+    for port in container.get("Ports") or []:
+        matches = port.get("PrivatePort") == private_port and port.get("Type") == type_
+        if matches and port.get("PublicPort"):
+            return port["PublicPort"]
+    return None
+
+
+def get_container_name(container):
+    names = container.get("Names") or []
+    return names[0].lstrip("/") if names else container.get("Id")
@@ -9,15 +9,18 @@ TOMCATDIR=/usr/local/tomcat
 DHIS2HOME=/DHIS2_home
 DATA_DIR=/data
 
+# Defines fix_ownership
+. /usr/local/bin/dhis2-core-fix-ownership.sh
+
 if [ "$(id -u)" = "0" ]; then
     if [ -f $WARFILE ]; then
         unzip -q $WARFILE -d $TOMCATDIR/webapps/ROOT
         rm -v $WARFILE  # just to save space
     fi
 
-    mkdir -p $DATA_DIR/apps
-    chown -R tomcat:tomcat $TOMCATDIR $DATA_DIR/apps $DHIS2HOME
-    chmod -R u=rwX,g=rX,o-rwx $TOMCATDIR $DATA_DIR/apps $DHIS2HOME
+    # File store folders (apps, documents, data values) are used in place by tomcat
+    mkdir -p $DATA_DIR/apps $DATA_DIR/document $DATA_DIR/dataValue
+    fix_ownership $TOMCATDIR $DATA_DIR/apps $DATA_DIR/document $DATA_DIR/dataValue $DHIS2HOME
 
     # Launch the given command as tomcat, in two ways for backwards compatibility:
     if [ "$(grep '^ID=' /etc/os-release)" = "ID=alpine" ]; then
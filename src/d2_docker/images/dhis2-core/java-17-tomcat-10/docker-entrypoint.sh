@@ -0,0 +1 @@
+../docker-entrypoint.sh
\ No newline at end of file
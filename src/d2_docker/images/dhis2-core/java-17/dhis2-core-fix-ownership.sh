@@ -0,0 +1 @@
+../dhis2-core-fix-ownership.sh
\ No newline at end of file
@@ -4,14 +4,76 @@ set -e -u
 # Global: VOLUME="/path/to/destination"
 # Global: LOAD_FROM_DATA="yes" | "no"
 
+manifest=/data/.d2-docker-manifest
+markers_folder=.d2-docker-markers
+
 main() { local volume=$1
     if test "$LOAD_FROM_DATA" = "yes"; then
-        cp -av /data/* $volume
-        chmod -R u+rwX,go+rX,go-w $volume
+        if test -f "$manifest"; then
+            populate $volume
+        else
+            # Images built without a content manifest
+            cp -a /data/* $volume
+            chmod -R u+rwX,go+rX,go-w $volume
+        fi
     else
-        rm -rf /$volume/*
+        # Keep the file store folders, the core container uses them in place. Remove the DB dump.
+        rm -rf $volume/db $volume/$markers_folder/db
     fi
 }
 
+# Copy the folders whose hash (in the image manifest) differs from the marker in the volume.
+populate() { local volume=$1
+    local markers="$volume/$markers_folder"
+    mkdir -p "$markers"
+
+    for path in "$volume"/*; do
+        local folder=$(basename "$path")
+        if test -e "$path" && ! is_in_manifest "$folder"; then
+            echo "Remove: $folder"
+            rm -rf "$path" "$markers/$folder"
+        fi
+    done
+
+    while read -r folder hash; do
+        if is_up_to_date "$volume" "$folder" "$hash"; then
+            echo "Up to date: $folder"
+            continue
+        fi
+
+        echo "Populate: $folder"
+        rm -rf "$markers/$folder" "$volume/$folder"
+        copy_folder "/data/$folder" "$volume/$folder"
+        chmod -R u+rwX,go+rX,go-w "$volume/$folder"
+        echo "$hash $(count_files "$volume/$folder")" >"$markers/$folder"
+    done <"$manifest"
+}
+
+is_in_manifest() { local folder=$1
+    awk -v folder="$folder" '$1 == folder { found = 1 } END { exit !found }' "$manifest"
+}
+
+# A folder is up to date if its marker has the hash in the manifest and no file was added,
+# removed or modified afterwards (the core container uses the file store folders in place).
+# Only files are checked: directories may get mountpoints (ex: db/post) from the core container.
+is_up_to_date() { local volume=$1 folder=$2 hash=$3
+    local marker="$volume/$markers_folder/$folder"
+    test -e "$volume/$folder" &&
+        test "$(cat "$marker" 2>/dev/null)" = "$hash $(count_files "$volume/$folder")" &&
+        test -z "$(find "$volume/$folder" -type f -newer "$marker" | head -n 1)"
+}
+
+count_files() { local path=$1
+    find "$path" -type f | wc -l | tr -d " "
+}
+
+# Use reflinks (copy-on-write) when the filesystem allows it, fallback to a plain copy. Note
+# that hardlinks are not used: the files in the volume must not share inodes with the image.
+copy_folder() { local source=$1 dest=$2
+    cp -a --reflink=auto "$source" "$dest" 2>/dev/null && return 0
+    rm -rf "$dest"
+    cp -a "$source" "$dest"
+}
+
 env
 main $VOLUME
@@ -0,0 +1,282 @@
+"""
+Import of image archives created by `docker save` / `d2-docker export` (tar, tar.gz, tar.zst).
+
+Images already present locally (same image ID) are not loaded again, only tagged:
+
+- Uncompressed archives: the manifest is read beforehand (only tar headers, with seeks) and
+  only the files of the missing images are sent to `docker load`.
+- Compressed archives are decompressed once, as a stream into `docker load`. `docker save`
+  writes manifest.json at the end, so the layers are sent as they are read and the top-level
+  files (manifest.json, image configs) are held back and written at the end, with the manifest
+  filtered to the missing images (docker load ignores the layers not in the manifest).
+"""
+import collections
+import contextlib
+import gzip
+import io
+import json
+import re
+import subprocess
+import tarfile
+
+from . import compression, docker_api
+from .utils import D2DockerError, DHIS2_DATA_IMAGE, TAR_BUFFER_SIZE
+from .utils import copy_stream, logger, run, wait_popen
+
+ArchiveInfo = collections.namedtuple("ArchiveInfo", ["manifest", "is_oci"])
+
+MAGIC_NUMBERS = [
+    (b"\x1f\x8b", "gzip"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+]
+
+
+def detect_codec(path):
+    """Return the codec of a compressed file (gzip | zstd) or None for uncompressed files."""
+    with open(path, "rb") as input_file:
+        header = input_file.read(4)
+    return next((codec for (magic, codec) in MAGIC_NUMBERS if header.startswith(magic)), None)
+
+
+@contextlib.contextmanager
+def open_decompressed(path):
+    """Yield a binary stream with the decompressed contents of a file."""
+    codec = detect_codec(path)
+    command = compression.get_decompress_command(codec) if codec else None
+
+    if not codec:
+        with open(path, "rb") as input_file:
+            yield input_file
+    elif not command:
+        with gzip.open(path, "rb") as input_file:
+            yield input_file
+    else:
+        popen_kwargs = dict(return_popen=True, universal_newlines=False, stdout=subprocess.PIPE)
+        popen = run([*command, path], **popen_kwargs)
+        try:
+            yield popen.stdout
+            # Consume the trailing data (ex: tar padding) so the process can finish
+            while popen.stdout.read(TAR_BUFFER_SIZE):
+                pass
+        except BaseException:
+            popen.kill()
+            popen.wait()
+            raise
+        else:
+            wait_popen(popen, " ".join(command))
+
+
+@contextlib.contextmanager
+def open_archive_tar(path):
+    """Yield a TarFile to iterate the members of an images archive."""
+    if not detect_codec(path):
+        # Uncompressed tar: members data is skipped with seeks, only headers are read.
+        with tarfile.open(path, mode="r:") as tar:
+            yield tar
+    else:
+        logger.info("Read compressed archive: {}".format(path))
+        with open_decompressed(path) as stream:
+            with tarfile.open(fileobj=stream, mode="r|", bufsize=TAR_BUFFER_SIZE) as tar:
+                yield tar
+
+
+def read_archive_info(path):
+    """Return the manifest.json contents of an images archive (and if it uses the OCI layout)."""
+    manifest = None
+    is_oci = False
+
+    with open_archive_tar(path) as tar:
+        for member in tar:
+            name = get_member_name(member.name)
+            if name == "manifest.json":
+                manifest = json.load(tar.extractfile(member))
+            elif name in ["index.json", "oci-layout"]:
+                is_oci = True
+
+    if manifest is None:
+        msg = "Not a docker images archive (manifest.json not found): {}".format(path)
+        raise D2DockerError(msg)
+    else:
+        return ArchiveInfo(manifest=manifest, is_oci=is_oci)
+
+
+def get_image_id(manifest_entry):
+    """Return the image ID from a manifest entry.
+
+    Examples (Config):
+        "1d6c...ef.json" -> "sha256:1d6c...ef"
+        "blobs/sha256/1d6c...ef" -> "sha256:1d6c...ef"
+    """
+    config = manifest_entry["Config"]
+    match = re.search(r"([0-9a-f]{64})(\.json)?$", config)
+    if not match:
+        raise D2DockerError("Cannot get image ID from manifest config: {}".format(config))
+    return "sha256:" + match.group(1)
+
+
+def image_exists(image_id):
+    client = docker_api.get_client()
+    if client:
+        try:
+            return client.inspect_image(image_id) is not None
+        except docker_api.DockerApiError as exc:
+            logger.debug("Docker API not available, fallback to CLI: {}".format(exc))
+
+    cmd = ["docker", "image", "inspect", "--format={{.Id}}", image_id]
+    return run(cmd, raise_on_error=False, capture_output=True).returncode == 0
+
+
+def get_data_image_name(repo_tags):
+    dhis2_data_image_re = "/{}:".format(DHIS2_DATA_IMAGE)
+    return next((repo_tag for repo_tag in repo_tags if re.search(dhis2_data_image_re, repo_tag)), None)
+
+
+def import_images(path):
+    """
+    Load the images of an archive in the docker daemon. Images already present are not loaded
+    again (only tagged). Return the list of RepoTags in the archive.
+    """
+    if detect_codec(path):
+        manifest = import_compressed_archive(path)
+    else:
+        manifest = import_archive(path)
+
+    return [repo_tag for entry in manifest for repo_tag in entry.get("RepoTags") or []]
+
+
+def import_archive(path):
+    info = read_archive_info(path)
+    present, missing = split_present_images(info.manifest)
+    tag_present_images(present)
+
+    if missing:
+        # Filter out the present images only on the classic layout, where docker load uses
+        # manifest.json. OCI archives are loaded whole (docker skips existing layers).
+        filtered_entries = missing if present and not info.is_oci else None
+        load_images(path, filtered_entries)
+
+    return info.manifest
+
+
+def import_compressed_archive(path):
+    load_popen = start_docker_load()
+    try:
+        with open_decompressed(path) as stream:
+            info, present = write_archive_with_missing_images(stream, load_popen.stdin)
+        load_popen.stdin.close()
+    except BaseException:
+        load_popen.kill()
+        load_popen.wait()
+        raise
+
+    finish_docker_load(load_popen)
+    tag_present_images(present)
+    return info.manifest
+
+
+def split_present_images(manifest):
+    """Return the manifest entries whose image exists locally and the missing ones."""
+    present, missing = [], []
+    for entry in manifest:
+        if image_exists(get_image_id(entry)):
+            present.append(entry)
+        else:
+            missing.append(entry)
+    return (present, missing)
+
+
+def tag_present_images(entries):
+    for entry in entries:
+        for repo_tag in entry.get("RepoTags") or []:
+            logger.info("Image already present: {}".format(repo_tag))
+            run(["docker", "tag", get_image_id(entry), repo_tag], capture_output=True)
+
+
+def load_images(path, filtered_entries=None):
+    """Stream the decompressed archive into docker load. If filtered_entries is passed, load
+    only these images (manifest.json is rewritten, docker load ignores the other files)."""
+    load_popen = start_docker_load()
+
+    try:
+        with open_decompressed(path) as stream:
+            if filtered_entries is None:
+                copy_stream(stream, load_popen.stdin, "Import")
+            else:
+                write_archive_with_manifest(stream, load_popen.stdin, filtered_entries)
+        load_popen.stdin.close()
+    except BaseException:
+        load_popen.kill()
+        load_popen.wait()
+        raise
+
+    finish_docker_load(load_popen)
+
+
+def start_docker_load():
+    popen_kwargs = dict(return_popen=True, universal_newlines=False)
+    return run(["docker", "load"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, **popen_kwargs)
+
+
+def finish_docker_load(load_popen):
+    output = load_popen.stdout.read().decode("utf-8")
+    wait_popen(load_popen, "docker load")
+    for line in output.splitlines():
+        logger.info(line)
+
+
+def write_archive_with_missing_images(stream, output):
+    """
+    Copy a docker save tar stream in a single pass. The top-level files (manifest.json, image
+    configs, repositories, OCI index) are small and held back until the end, when the manifest
+    is known: on the classic layout, manifest.json is rewritten with the missing images only.
+    Return the ArchiveInfo and the manifest entries of the present images.
+    """
+    held_files = []
+    input_tar = tarfile.open(fileobj=stream, mode="r|", bufsize=TAR_BUFFER_SIZE)
+    output_tar = tarfile.open(fileobj=output, mode="w|", bufsize=TAR_BUFFER_SIZE)
+
+    with input_tar, output_tar:
+        for member in input_tar:
+            if member.isfile() and "/" not in get_member_name(member.name):
+                held_files.append((member, input_tar.extractfile(member).read()))
+            else:
+                fileobj = input_tar.extractfile(member) if member.isfile() else None
+                output_tar.addfile(member, fileobj)
+
+        files = dict((get_member_name(member.name), data) for (member, data) in held_files)
+        if "manifest.json" not in files:
+            raise D2DockerError("Not a docker images archive (manifest.json not found)")
+        manifest = json.loads(files["manifest.json"].decode("utf-8"))
+        info = ArchiveInfo(manifest=manifest, is_oci="index.json" in files or "oci-layout" in files)
+        present, missing = split_present_images(manifest)
+
+        for member, data in held_files:
+            if get_member_name(member.name) == "manifest.json" and present and not info.is_oci:
+                data = json.dumps(missing).encode("utf-8")
+                member.size = len(data)
+            output_tar.addfile(member, io.BytesIO(data))
+
+    return (info, present)
+
+
+def write_archive_with_manifest(stream, output, entries):
+    """Copy a docker save tar stream with manifest.json rewritten to some entries. All the other
+    members are kept: on the legacy layout a layer.tar may be a symlink into the layer directory
+    of an image not in the entries, so dropping it would leave a dangling link."""
+    manifest_bytes = json.dumps(entries).encode("utf-8")
+
+    input_tar = tarfile.open(fileobj=stream, mode="r|", bufsize=TAR_BUFFER_SIZE)
+    output_tar = tarfile.open(fileobj=output, mode="w|", bufsize=TAR_BUFFER_SIZE)
+
+    with input_tar, output_tar:
+        for member in input_tar:
+            if get_member_name(member.name) == "manifest.json":
+                member.size = len(manifest_bytes)
+                output_tar.addfile(member, io.BytesIO(manifest_bytes))
+            else:
+                fileobj = input_tar.extractfile(member) if member.isfile() else None
+                output_tar.addfile(member, fileobj)
+
+
+def get_member_name(name):
+    return re.sub(r"^\./", "", name)
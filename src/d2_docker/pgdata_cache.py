@@ -0,0 +1,153 @@
+"""
+Cache of restored PostgreSQL data volumes (pgdata snapshots).
+
+The first start of a data image (with `start --pgdata-cache`) restores its DB dump in a
+restore-only run of the core container and then saves a copy of the pgdata volume, keyed by
+the data image ID and the PostGIS version. Next starts clone that volume instead of loading
+the SQL dump again. The least recently used snapshots are removed when there are more than
+D2_DOCKER_PGDATA_CACHE_MAX_ENTRIES (default: 5).
+"""
+import hashlib
+import json
+import os
+import time
+
+from . import docker_api, utils
+
+MAX_ENTRIES_ENV = "D2_DOCKER_PGDATA_CACHE_MAX_ENTRIES"
+DEFAULT_MAX_ENTRIES = 5
+VOLUME_LABEL = "com.eyeseetea.d2-docker.pgdata-cache"
+
+
+def get_cache_key(image_name, postgis_version=None):
+    """Return the key of a data image (by image ID, so re-tagged or re-pulled images with the
+    same contents share the snapshot) and PostGIS version."""
+    image_id = get_image_id(image_name)
+    postgis_version = postgis_version or utils.DEFAULT_POSTGIS_VERSION
+    value = "{}:{}".format(image_id, postgis_version)
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()[:16]
+
+
+def get_image_id(image_name):
+    client = docker_api.get_client()
+    if client:
+        try:
+            image = client.inspect_image(image_name)
+            if image:
+                return image["Id"]
+        except docker_api.DockerApiError as exc:
+            utils.logger.debug("Docker API not available, fallback to CLI: {}".format(exc))
+
+    cmd = ["docker", "image", "inspect", "--format={{.Id}}", image_name]
+    result = utils.run(cmd, capture_output=True)
+    return result.stdout.decode("utf-8").strip()
+
+
+def get_volume_name(key):
+    return "d2-docker-pgdata-{}".format(key)
+
+
+def exists(key):
+    cmd = ["docker", "volume", "inspect", get_volume_name(key)]
+    return utils.run(cmd, raise_on_error=False, capture_output=True).returncode == 0
+
+
+def save(key, source_volume, image_name, postgis_version=None):
+    """Save a copy of a (stopped) pgdata volume as the snapshot for a key."""
+    volume = get_volume_name(key)
+    utils.logger.info("Save pgdata snapshot: {} -> {}".format(source_volume, volume))
+    utils.run(["docker", "volume", "rm", "--force", volume], capture_output=True)
+    utils.run(["docker", "volume", "create", "--label", "{}={}".format(VOLUME_LABEL, key), volume],
+              capture_output=True)
+
+    try:
+        clone_volume(source_volume, volume, postgis_version)
+    except BaseException:
+        utils.run(["docker", "volume", "rm", "--force", volume], capture_output=True)
+        raise
+
+    update_registry(key, dict(volume=volume, image=image_name, postgis_version=postgis_version))
+    evict(get_max_entries(), keep=[key])
+
+
+def restore(key, dest_volume, labels=None, postgis_version=None):
+    """Create a volume (with labels) with a copy of the snapshot of a key."""
+    volume = get_volume_name(key)
+    utils.logger.info("Restore pgdata snapshot: {} -> {}".format(volume, dest_volume))
+    label_args = [arg for (name, value) in (labels or {}).items()
+                  for arg in ["--label", "{}={}".format(name, value)]]
+    utils.run(["docker", "volume", "create", *label_args, dest_volume], capture_output=True)
+    clone_volume(volume, dest_volume, postgis_version)
+    update_registry(key, {})
+
+
+def clone_volume(source_volume, dest_volume, postgis_version=None):
+    """Copy the contents of a volume into another, preserving owners and permissions."""
+    image = "postgis/postgis:{}".format(postgis_version or utils.DEFAULT_POSTGIS_VERSION)
+    cmd = [
+        "docker",
+        "run",
+        "--rm",
+        "--volume={}:/from:ro".format(source_volume),
+        "--volume={}:/to".format(dest_volume),
+        "--entrypoint=cp",
+        image,
+        "-a",
+        "/from/.",
+        "/to/",
+    ]
+    utils.run(cmd, capture_output=True)
+
+
+def evict(max_entries, keep=None):
+    """Remove the least recently used snapshots so there are at most max_entries."""
+    with registry_lock():
+        registry = read_registry()
+        entries = sorted(registry.items(), key=lambda item: item[1].get("last_used", 0))
+        removable = [key for (key, _entry) in entries if key not in (keep or [])]
+
+        for key in removable[:max(len(entries) - max_entries, 0)]:
+            volume = get_volume_name(key)
+            utils.logger.info("pgdata cache full, remove snapshot: {}".format(volume))
+            result = utils.run(["docker", "volume", "rm", volume], raise_on_error=False,
+                               capture_output=True)
+            if result.returncode == 0 or not exists(key):
+                registry.pop(key)
+
+        write_registry(registry)
+
+
+def get_max_entries():
+    value = os.environ.get(MAX_ENTRIES_ENV)
+    return int(value) if value else DEFAULT_MAX_ENTRIES
+
+
+def update_registry(key, values):
+    with registry_lock():
+        registry = read_registry()
+        registry[key] = dict(registry.get(key, {}), last_used=time.time(), **values)
+        write_registry(registry)
+
+
+def registry_lock():
+    return utils.file_lock(os.path.join(utils.get_cache_directory("pgdata"), "registry.lock"))
+
+
+def get_registry_path():
+    return os.path.join(utils.get_cache_directory("pgdata"), "registry.json")
+
+
+def read_registry():
+    path = get_registry_path()
+    if not os.path.exists(path):
+        return {}
+    with open(path) as registry_file:
+        return json.load(registry_file)
+
+
+def write_registry(registry):
+    path = get_registry_path()
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as registry_file:
+        json.dump(registry, registry_file, indent=2)
+    os.replace(temp_path, path)
@@ -0,0 +1,141 @@
+"""
+Allocation of host ports for d2-docker instances.
+
+A port is free when it's not published by any container (read in one batch from the Docker
+Engine API, or `docker ps`), not reserved by another d2-docker project and can be bound on all
+interfaces. The reservations are kept in a registry shared by all d2-docker processes and
+protected by a file lock, so concurrent starts (API, CI) never get the same port. A reservation
+expires after RESERVATION_TTL seconds: by then the instance has published its port.
+"""
+import json
+import os
+import re
+import socket
+import threading
+import time
+
+from . import docker_api, utils
+
+DEFAULT_START_PORT = 8080
+RESERVATION_TTL = 30 * 60
+
+_lock = threading.Lock()
+
+
+def allocate_port(project=None, start=DEFAULT_START_PORT, end=65535):
+    """Return a free port (and reserve it for the project). A project that has a reservation
+    gets the same port, if still available."""
+    with _lock, utils.file_lock(get_path("registry.lock")):
+        now = time.time()
+        registry = read_registry()
+        other_reservations = dict(
+            (port, reservation)
+            for (port, reservation) in registry.items()
+            if now - reservation["time"] < RESERVATION_TTL
+            and (not project or reservation["project"] != project)
+        )
+        own_ports = [int(port) for (port, reservation) in registry.items()
+                     if project and reservation["project"] == project]
+        published_ports = get_published_ports()
+
+        for port in own_ports + list(range(start, end)):
+            if port in published_ports or str(port) in other_reservations or not can_bind(port):
+                continue
+            other_reservations[str(port)] = dict(project=project, time=now)
+            write_registry(other_reservations)
+            utils.logger.debug("Port reserved: {} ({})".format(port, project))
+            return port
+
+    raise utils.D2DockerError("No free port available in range {}-{}".format(start, end))
+
+
+def release_ports(project):
+    """Remove the port reservations of a project."""
+    with _lock, utils.file_lock(get_path("registry.lock")):
+        registry = read_registry()
+        registry2 = dict((port, value) for (port, value) in registry.items()
+                         if value["project"] != project)
+        if registry2 != registry:
+            write_registry(registry2)
+
+
+def can_bind(port):
+    """Return True if the port can be bound on all IPv4 interfaces and, when the host has IPv6,
+    on all IPv6 interfaces (so it's not in use on any of them)."""
+    for family, host in get_bind_addresses():
+        try:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+        except OSError:
+            # Family not supported by the kernel (IPv6 disabled), nothing can listen there
+            continue
+
+        with sock:
+            try:
+                if family == socket.AF_INET6:
+                    sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+                sock.bind((host, port))
+            except OSError:
+                return False
+
+    return True
+
+
+def get_bind_addresses():
+    """Return the pairs (family, wildcard address) to probe when checking a port."""
+    addresses = [(socket.AF_INET, "")]
+    if socket.has_ipv6:
+        addresses.append((socket.AF_INET6, "::"))
+    return addresses
+
+
+def get_published_ports():
+    """Return the set of host ports published by the containers."""
+    client = docker_api.get_client()
+    if client:
+        try:
+            containers = client.containers()
+        except docker_api.DockerApiError as exc:
+            utils.logger.debug("Docker API not available, fallback to CLI: {}".format(exc))
+        else:
+            return set(
+                port_info["PublicPort"]
+                for container in containers
+                for port_info in container.get("Ports") or []
+                if port_info.get("PublicPort")
+            )
+
+    result = utils.run(["docker", "ps", "--format={{.Ports}}"], capture_output=True)
+    return get_ports_from_docker_ps(result.stdout.decode("utf-8"))
+
+
+def get_ports_from_docker_ps(output):
+    """Parse the host ports of `docker ps --format={{.Ports}}`.
+
+    Example: 0.0.0.0:8080->80/tcp, :::8080->80/tcp, 0.0.0.0:9000-9001->9000-9001/tcp
+    """
+    ports = set()
+    for match in re.finditer(r":(\d+)(?:-(\d+))?->", output):
+        first = int(match.group(1))
+        last = int(match.group(2)) if match.group(2) else first
+        ports.update(range(first, last + 1))
+    return ports
+
+
+def get_path(filename):
+    return os.path.join(utils.get_cache_directory("ports"), filename)
+
+
+def read_registry():
+    path = get_path("registry.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path) as registry_file:
+        return json.load(registry_file)
+
+
+def write_registry(registry):
+    path = get_path("registry.json")
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as registry_file:
+        json.dump(registry, registry_file, indent=2)
+    os.replace(temp_path, path)
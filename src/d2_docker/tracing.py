@@ -0,0 +1,188 @@
+"""
+Span-based timing instrumentation.
+
+A span records the wall time of a phase (a command run, a DB export, a docker build, ...),
+its exit status and some arguments (bytes moved, return code). Spans are collected by the
+active recorders:
+
+    with tracing.recording() as recorder:
+        with tracing.span("export_database", image=image_name) as span:
+            ...
+            span.args["bytes"] = size
+
+    tracing.write_chrome_trace(path, recorder.spans)
+
+A recorder created with all_threads=False only collects the spans of the current thread (and
+of the functions wrapped with tracing.propagate), so concurrent jobs get their own spans. The
+same applies to the values set with tracing.context (ex: the current job).
+"""
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+_recorders = []
+_recorders_lock = threading.Lock()
+_local = threading.local()
+
+
+class Span:
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.status = None
+        self.start = time.time()
+        self.duration = None
+        self.thread_id = threading.get_ident()
+        self._start_counter = time.perf_counter()
+
+    def finish(self, status):
+        self.status = status
+        self.duration = time.perf_counter() - self._start_counter
+
+    def to_dict(self):
+        return dict(
+            name=self.name,
+            category=self.category,
+            start=self.start,
+            duration=self.duration,
+            status=self.status,
+            args=self.args,
+        )
+
+
+class Recorder:
+    def __init__(self, all_threads=False):
+        self.all_threads = all_threads
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+    def to_list(self):
+        with self.lock:
+            return [span.to_dict() for span in self.spans]
+
+
+@contextlib.contextmanager
+def recording(all_threads=False):
+    """Yield a Recorder that collects the spans finished in this context."""
+    recorder = Recorder(all_threads=all_threads)
+    if all_threads:
+        with _recorders_lock:
+            _recorders.append(recorder)
+    else:
+        _set_thread_recorders(_get_thread_recorders() + [recorder])
+
+    try:
+        yield recorder
+    finally:
+        if all_threads:
+            with _recorders_lock:
+                _recorders.remove(recorder)
+        else:
+            _set_thread_recorders([r for r in _get_thread_recorders() if r is not recorder])
+
+
+@contextlib.contextmanager
+def span(name, category="d2-docker", **args):
+    """Record the wall time and status (ok/error) of a block. Yield the span, so the block can
+    add arguments (span.args)."""
+    current_span = Span(name, category, args)
+    try:
+        yield current_span
+    except BaseException:
+        current_span.finish("error")
+        raise
+    else:
+        current_span.finish("ok")
+    finally:
+        for recorder in get_active_recorders():
+            recorder.add(current_span)
+
+
+def propagate(func):
+    """Wrap a function to be run in another thread (executor), so its spans are collected by
+    the thread recorders of the caller, and it sees the context values of the caller."""
+    recorders = _get_thread_recorders()
+    context_values = _get_thread_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = _get_thread_recorders()
+        previous_context = _get_thread_context()
+        _set_thread_recorders(previous + [r for r in recorders if r not in previous])
+        _set_thread_context(dict(previous_context, **context_values))
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _set_thread_recorders(previous)
+            _set_thread_context(previous_context)
+
+    return wrapper
+
+
+@contextlib.contextmanager
+def context(**values):
+    """Set context values for the current thread (and the functions wrapped with propagate)."""
+    previous = _get_thread_context()
+    _set_thread_context(dict(previous, **values))
+    try:
+        yield
+    finally:
+        _set_thread_context(previous)
+
+
+def get_context_value(name):
+    return _get_thread_context().get(name)
+
+
+def get_active_recorders():
+    with _recorders_lock:
+        global_recorders = list(_recorders)
+    return global_recorders + _get_thread_recorders()
+
+
+def _get_thread_recorders():
+    return getattr(_local, "recorders", [])
+
+
+def _set_thread_recorders(recorders):
+    _local.recorders = recorders
+
+
+def _get_thread_context():
+    return getattr(_local, "context", {})
+
+
+def _set_thread_context(values):
+    _local.context = values
+
+
+def get_chrome_trace(spans):
+    """Return the spans in Chrome trace event format (chrome://tracing, Perfetto)."""
+    pid = os.getpid()
+    events = [
+        dict(
+            name=span.name,
+            cat=span.category,
+            ph="X",
+            ts=int(span.start * 1e6),
+            dur=int((span.duration or 0) * 1e6),
+            pid=pid,
+            tid=span.thread_id,
+            args=dict(span.args, status=span.status),
+        )
+        for span in sorted(spans, key=lambda span: span.start)
+    ]
+    return dict(traceEvents=events, displayTimeUnit="ms")
+
+
+def write_chrome_trace(path, spans):
+    with open(path, "w") as trace_file:
+        json.dump(get_chrome_trace(spans), trace_file, indent=1, default=str)
@@ -1,28 +1,42 @@
-import atexit
+import collections
+import concurrent.futures
 import contextlib
+import functools
+import hashlib
 import subprocess
 import logging
 import re
 import os
 import shutil
-import socket
+import tarfile
 import tempfile
+import threading
 import time
-import yaml
 import urllib.request
-from setuptools._distutils import dir_util
 from pathlib import Path
 from typing import Optional
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
 import d2_docker
+from . import build_context, compression, docker_api, ports, tracing, war_cache
 from .image_name import ImageName
 
 PROJECT_NAME_PREFIX = "d2-docker"
 DHIS2_DATA_IMAGE = "dhis2-data"
 IMAGE_NAME_LABEL = "com.eyeseetea.image-name"
+DEPLOY_PATH_LABEL = "com.eyeseetea.deploy-path"
+COMPOSE_SERVICE_LABEL = "com.docker.compose.service"
+COMPOSE_PROJECT_LABEL = "com.docker.compose.project"
+COMPOSE_VOLUME_LABEL = "com.docker.compose.volume"
 DOCKER_COMPOSE_SERVICES = ["gateway", "core", "db"]
 PROJECT_DIR = os.path.dirname(os.path.realpath(__file__))
 ROOT_PATH = os.environ.get("ROOT_PATH") or PROJECT_DIR
+RELEASES_URL_ENV = "D2_DOCKER_RELEASES_URL"
+CACHE_DIR_ENV = "D2_DOCKER_CACHE_DIR"
 
 def get_dhis2_war_url(version):
     match = (re.match(r"^(\d+.\d+)", version) if version.startswith("2.")
@@ -31,7 +45,7 @@ def get_dhis2_war_url(version):
         raise D2DockerError("Invalid version: {}".format(version))
     short_version = match[1]
     has_no_patch_version = version == short_version
-    releases_base_url = "https://releases.dhis2.org"
+    releases_base_url = os.environ.get(RELEASES_URL_ENV) or "https://releases.dhis2.org"
     path = (
         "{}/dhis.war".format(short_version)
         if has_no_patch_version
@@ -41,7 +55,8 @@ def get_dhis2_war_url(version):
 
 
 def docker_build(directory, tag):
-    return run(["docker", "build", "--platform", "linux/amd64", "--tag", tag, directory])
+    with tracing.span("docker_build", tags=[tag], context=directory):
+        return run(["docker", "build", "--platform", "linux/amd64", "--tag", tag, directory])
 
 
 def get_logger():
@@ -57,13 +72,112 @@ class D2DockerError(Exception):
     pass
 
 
+class CancelledError(D2DockerError):
+    pass
+
+
+_local = threading.local()
+
+
+class ProcessGroup:
+    """
+    Track the processes started (with run) by the functions wrapped with group.wrap, so they
+    can be terminated from another thread (ex: background tasks on error or Control+C). Once
+    terminated, the next run/copy_stream calls of the group raise CancelledError.
+    """
+
+    def __init__(self):
+        self.processes = set()
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    def wrap(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            previous = getattr(_local, "process_group", None)
+            _local.process_group = self
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _local.process_group = previous
+
+        return wrapper
+
+    def run(self, command_parts, input=None, **kwargs):
+        """Like subprocess.run, with the process registered in the group."""
+        if input is not None:
+            kwargs["stdin"] = subprocess.PIPE
+
+        with self.lock:
+            self.check()
+            process = subprocess.Popen(command_parts, **kwargs)  # nosec
+            self.processes.add(process)
+
+        try:
+            stdout, stderr = process.communicate(input)
+        finally:
+            with self.lock:
+                self.processes.discard(process)
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+
+        # A terminated process fails as cancelled, not as a command error
+        self.check()
+        return subprocess.CompletedProcess(command_parts, process.returncode, stdout, stderr)
+
+    def terminate(self):
+        with self.lock:
+            self.cancelled = True
+            processes = list(self.processes)
+        for process in processes:
+            process.terminate()
+
+    def check(self):
+        if self.cancelled:
+            raise CancelledError("Cancelled")
+
+
+def check_cancelled():
+    """Raise CancelledError if the process group of the current thread has been terminated."""
+    group = getattr(_local, "process_group", None)
+    if group:
+        group.check()
+
+
 def mkdir_p(path):
     """Create directory. Do nothing if it exists."""
     os.makedirs(path, exist_ok=True)
 
 
+def get_cache_directory(*parts):
+    """Return a directory in the d2-docker cache (created if it does not exist)."""
+    xdg_cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(Path.home(), ".cache")
+    base_dir = os.environ.get(CACHE_DIR_ENV) or os.path.join(xdg_cache_dir, "d2-docker")
+    path = os.path.join(base_dir, *parts)
+    mkdir_p(path)
+    return path
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on a file, shared between processes (no-op without fcntl)."""
+    mkdir_p(os.path.dirname(path))
+    with open(path, "a") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
 def copytree(source, dest):
     """Copy full tree path from source to dest, create dest if it does not exists."""
+    # Imported here, setuptools is slow to import
+    from setuptools._distutils import dir_util
+
     dir_util.copy_tree(source, dest)
 
 
@@ -95,43 +209,30 @@ def run(
             popen_cmd = cmd if shell else command_parts
             return subprocess.Popen(popen_cmd, env=env2, shell=shell, **kwargs)  # nosec
         else:
-            return subprocess.run(command_parts, check=raise_on_error, env=env2, **kwargs)
+            with tracing.span("run", category="command", command=cmd[:200]) as run_span:
+                group = getattr(_local, "process_group", None)
+                run_process = group.run if group else subprocess.run
+                result = run_process(command_parts, env=env2, **kwargs)
+                run_span.args["returncode"] = result.returncode
+                if capture_output:
+                    run_span.args["bytes"] = len(result.stdout or "")
+                if raise_on_error:
+                    result.check_returncode()
+                return result
     except subprocess.CalledProcessError as exc:
         msg = "Command {} failed with code {}: {}"
         raise D2DockerError(msg.format(cmd, exc.returncode, exc.stderr))
 
 
-@contextlib.contextmanager
-def possible_errors():
-    try:
-        yield
-    except D2DockerError:
-        pass
-
-
-def get_free_port(start=8080, end=65535):
-    for port in range(start, end):
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            port_is_open = sock.connect_ex(("localhost", port)) == 0
-            if not port_is_open:
-                return port
-    raise D2DockerError("No free open available")
+def get_free_port(start=8080, end=65535, image_name=None):
+    """Return a free host port, reserved for the instance of the image (see ports module)."""
+    project = get_project_name(image_name) if image_name else None
+    return ports.allocate_port(project, start, end)
 
 
 def get_running_image_name():
     """Return the name of the single running d2-docker image. Otherwise, raise an D2DockerError."""
-    result = run(
-        [
-            "docker",
-            "ps",
-            "--filter",
-            "label=" + IMAGE_NAME_LABEL,
-            '--format={{.Label "%s"}}' % IMAGE_NAME_LABEL,
-        ],
-        capture_output=True,
-    )
-    output_lines = result.stdout.decode("utf-8").splitlines()
-    image_names = set(line for line in output_lines if line.strip())
+    image_names = set(info["image_name"] for info in get_running_containers_info())
 
     if len(image_names) == 0:
         raise D2DockerError("There are no d2-docker images running")
@@ -158,6 +259,109 @@ def run_docker_ps(args):
     return result.stdout.decode("utf-8").splitlines()
 
 
+def get_running_containers_info():
+    """
+    Return the running d2-docker containers:
+
+        [
+            {
+                "image_name": DATA_IMAGE,
+                "name": CONTAINER_NAME,
+                "service": SERVICE,
+                "port": HOST_PORT_FOR_HTTP | None,
+                "deploy_path": DEPLOY_PATH,
+            },
+            ...
+        ]
+
+    Use the Docker Engine API when available, fallback to the docker CLI otherwise.
+    """
+    client = docker_api.get_client()
+    if client:
+        try:
+            containers = client.containers(labels=[IMAGE_NAME_LABEL])
+        except docker_api.DockerApiError as exc:
+            logger.debug("Docker API not available, fallback to CLI: {}".format(exc))
+        else:
+            return [get_container_info_from_api(container) for container in containers]
+
+    return get_running_containers_info_from_cli()
+
+
+def get_container_info_from_api(container):
+    labels = container.get("Labels") or {}
+    name = docker_api.get_container_name(container)
+    return dict(
+        image_name=labels.get(IMAGE_NAME_LABEL),
+        name=name,
+        service=labels.get(COMPOSE_SERVICE_LABEL) or get_service_from_container_name(name),
+        port=docker_api.get_public_port(container, 80),
+        deploy_path=labels.get(DEPLOY_PATH_LABEL) or "",
+    )
+
+
+def get_running_containers_info_from_cli():
+    sep = " | "
+    fmt = [
+        '{{.Label "%s"}}' % IMAGE_NAME_LABEL,
+        "{{.Names}}",
+        "{{.Ports}}",
+        '{{.Label "%s"}}' % COMPOSE_SERVICE_LABEL,
+        '{{.Label "%s"}}' % DEPLOY_PATH_LABEL,
+    ]
+    infos = []
+
+    for line in run_docker_ps(["--format=" + sep.join(fmt)]):
+        parts = line.split(sep)
+        if len(parts) != len(fmt):
+            continue
+        image_name, name, ports, service, deploy_path = (part.strip() for part in parts)
+        info = dict(
+            image_name=image_name,
+            name=name,
+            service=service or get_service_from_container_name(name),
+            port=get_port_from_docker_ports(ports),
+            deploy_path=deploy_path,
+        )
+        infos.append(info)
+
+    return infos
+
+
+def get_service_from_container_name(container_name):
+    # Depending on the docker version, the container name may be stringfromimage_service-1 OR
+    # stringfromimage_service_1. Split by all posible character separators.
+    parts = re.split(r"[-_]", container_name)
+    return parts[-2] if len(parts) >= 2 else None
+
+
+def get_data_image_names():
+    """Return the names (REPOSITORY:TAG) of the local dhis2-data images."""
+    client = docker_api.get_client()
+    if client:
+        try:
+            images = client.images()
+        except docker_api.DockerApiError as exc:
+            logger.debug("Docker API not available, fallback to CLI: {}".format(exc))
+        else:
+            repo_tags = [repo_tag for image in images for repo_tag in image.get("RepoTags") or []]
+            return [name for name in repo_tags if is_data_image_name(name)]
+
+    cmd_image = ["docker", "image", "ls", "--format={{.Repository}}:{{.Tag}}"]
+    result_image = run(cmd_image, capture_output=True)
+    lines = result_image.stdout.decode("utf-8").splitlines()
+    return [line.strip() for line in lines if is_data_image_name(line.strip())]
+
+
+def is_data_image_name(image_name):
+    void_tag = "<none>"
+    repo, _sep, tag = image_name.rpartition(":")
+    if not repo or not tag or void_tag in repo or void_tag in tag:
+        return False
+    else:
+        return DHIS2_DATA_IMAGE in repo
+
+
 def get_image_status(image_name):
     """
     If the container for the image is not running, return:
@@ -177,35 +381,17 @@ def get_image_status(image_name):
             },
             "port": PORT,
         }
-    Return a Result(status=True, value=value) available port for an image.
-    If it's already running, return Result(status=False, error=error).
     """
     final_image_name = image_name or get_running_image_name()
-    output_lines = run_docker_ps(
-        [
-            "--filter",
-            "label=" + IMAGE_NAME_LABEL,
-            '--format={{.Label "%s"}} {{.Names}} {{.Ports}}' % IMAGE_NAME_LABEL,
-        ]
-    )
-
     containers = {}
     port = None
 
-    for line in output_lines:
-        parts = line.split(None, 2)
-        if len(parts) != 3:
-            continue
-        image_name_part, container_name, ports = parts
-        # Depending on the docker version, the container name may be stringfromimage_service-1 OR
-        # stringfromimage_service_1. Split by all posible character separators.
-        parts = re.split(r"[-_]", container_name)
-        service = parts[-2] if len(parts) >= 2 else None
-
-        if image_name_part == final_image_name and service:
-            containers[service] = container_name
+    for info in get_running_containers_info():
+        service = info["service"]
+        if info["image_name"] == final_image_name and service:
+            containers[service] = info["name"]
             if service == "gateway":
-                port = get_port_from_docker_ports(ports)
+                port = info["port"]
 
     if containers and set(containers.keys()) == set(DOCKER_COMPOSE_SERVICES) and port:
         return {"state": "running", "containers": containers, "port": port}
@@ -233,6 +419,35 @@ def get_project_name(image_name):
     return re.sub(r"[^\w]", "-", name_with_prefix)
 
 
+def get_instance_volume_name(image_name, volume):
+    """Return the docker name of a compose volume of an instance."""
+    return "{}_{}".format(get_project_name(image_name), volume)
+
+
+def get_instance_volume_labels(image_name, volume):
+    """Return the labels docker compose expects in the volumes of an instance."""
+    return {COMPOSE_PROJECT_LABEL: get_project_name(image_name), COMPOSE_VOLUME_LABEL: volume}
+
+
+def remove_instance_volumes(image_name, keep=None):
+    """Remove the docker compose volumes of an instance, except the ones in keep."""
+    project_name = get_project_name(image_name)
+    label_format = "{{{{.Name}}}} {{{{.Label \"{}\"}}}}".format(COMPOSE_VOLUME_LABEL)
+    cmd = [
+        "docker",
+        "volume",
+        "ls",
+        "--filter=label={}={}".format(COMPOSE_PROJECT_LABEL, project_name),
+        "--format={}".format(label_format),
+    ]
+    result = run(cmd, capture_output=True)
+    volumes = [line.split() for line in result.stdout.decode("utf-8").splitlines() if line.strip()]
+    volume_names = [parts[0] for parts in volumes if len(parts) < 2 or parts[1] not in (keep or [])]
+
+    if volume_names:
+        run(["docker", "volume", "rm", *volume_names], capture_output=True)
+
+
 def get_core_image_name(data_image_name):
     """Return core image name from the data image.
 
@@ -261,6 +476,9 @@ def run_docker_compose(
     tomcat_server=None,
     postgis_version=None,
     enable_postgres_queries_logging=False,
+    db_restore_jobs=None,
+    db_restore_only=False,
+    db_from_snapshot=False,
     **kwargs,
 ):
     """
@@ -292,6 +510,9 @@ def run_docker_compose(
         ("TOMCAT_SERVER", get_absfile_for_docker_volume(tomcat_server)),
         ("DHIS_CONF", get_absfile_for_docker_volume(dhis_conf)),
         ("POSTGIS_VERSION", postgis_version),
+        ("DB_RESTORE_JOBS", str(db_restore_jobs) if db_restore_jobs else ""),
+        ("DB_RESTORE_ONLY", "yes" if db_restore_only else "no"),
+        ("DB_FROM_SNAPSHOT", "yes" if db_from_snapshot else "no"),
         ("DB_PORT", ("{}:5432".format(db_port) if db_port else "0:1000")),
         # Add ROOT_PATH from environment (required when run inside a docker)
         ("ROOT_PATH", ROOT_PATH),
@@ -299,34 +520,95 @@ def run_docker_compose(
     ]
     env = dict((k, v) for (k, v) in [pair for pair in env_pairs if pair] if v is not None)
 
-    def process_yaml(data):
-        if "DHIS2_CORE_DEBUG_PORT" not in env:
-            core = data["services"]["core"]
-            core["ports"] = [port for port in core["ports"] if "DHIS2_CORE_DEBUG_PORT" not in port]
+    compose_file_args, compose_kwargs = get_docker_compose_args(
+        args, with_debug_port="DHIS2_CORE_DEBUG_PORT" in env, **kwargs
+    )
+    cmd = ["docker", "compose", *compose_file_args, "-p", project_name, *args]
+
+    return run(cmd, env=env, **compose_kwargs)
 
-        return data
 
-    temp_compose = build_docker_compose(process_yaml)
+COMPOSE_CACHE_MAX_ENTRIES = 32
+# Non-interactive compose commands, the compose file can be passed on stdin
+COMPOSE_STDIN_COMMANDS = ["config", "ps", "pull", "push", "stop", "down", "images"]
 
-    return run(["docker", "compose", "-f", temp_compose.name, "-p", project_name, *args], env=env, **kwargs)
+_compose_cache = collections.OrderedDict()
+_compose_cache_lock = threading.Lock()
+
+
+def get_docker_compose_args(args, with_debug_port=True, **kwargs):
+    """Return the compose file arguments and the run kwargs for a docker compose command. The
+    compose file is sent on stdin when the command does not use it, otherwise a cached file
+    is used (one per rendered contents)."""
+    key, contents = render_docker_compose(with_debug_port)
+    # Fixed project directory, so a .env file in the current directory is not used
+    compose_dir = get_cache_directory("compose")
+    directory_args = ["--project-directory", compose_dir]
+    uses_stdin = kwargs.get("return_popen") or "stdin" in kwargs or "input" in kwargs
+
+    if args and args[0] in COMPOSE_STDIN_COMMANDS and not uses_stdin:
+        return ([*directory_args, "-f", "-"], dict(kwargs, input=contents.encode("utf-8")))
+    else:
+        path = get_docker_compose_file(compose_dir, key, contents)
+        return ([*directory_args, "-f", path], kwargs)
 
 
-def build_docker_compose(process_yaml):
+def render_docker_compose(with_debug_port=True):
+    """Return (key, contents) of the docker compose file. Cached in memory by the template file
+    (path, mtime, size) and the options; key is a hash of the rendered contents."""
     docker_compose_path = os.path.join(ROOT_PATH, "docker-compose.yml")
+    stat = os.stat(docker_compose_path)
+    cache_key = (docker_compose_path, stat.st_mtime_ns, stat.st_size, with_debug_port)
 
-    with open(docker_compose_path, 'r') as file:
+    with _compose_cache_lock:
+        if cache_key in _compose_cache:
+            _compose_cache.move_to_end(cache_key)
+            return _compose_cache[cache_key]
+
+    import yaml  # Only needed on cache misses, slow to import
+
+    with open(docker_compose_path, "r") as file:
         data = yaml.safe_load(file)
 
-    data_processed = process_yaml(data)
+    if not with_debug_port:
+        core = data["services"]["core"]
+        core["ports"] = [port for port in core["ports"] if "DHIS2_CORE_DEBUG_PORT" not in port]
+
+    contents = yaml.dump(data)
+    value = (hashlib.sha256(contents.encode("utf-8")).hexdigest()[:16], contents)
+
+    with _compose_cache_lock:
+        _compose_cache[cache_key] = value
+        while len(_compose_cache) > COMPOSE_CACHE_MAX_ENTRIES:
+            _compose_cache.popitem(last=False)
+
+    return value
+
+
+def get_docker_compose_file(compose_dir, key, contents):
+    """Return the path of the compose file for the rendered contents (written once, the least
+    recently used files are removed when there are more than COMPOSE_CACHE_MAX_ENTRIES)."""
+    path = os.path.join(compose_dir, "docker-compose-{}.yml".format(key))
+
+    if os.path.exists(path):
+        os.utime(path)
+    else:
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp_path, "w") as compose_file:
+            compose_file.write(contents)
+        os.replace(temp_path, path)
+        logger.debug("Docker compose file: {}".format(path))
 
-    with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.yml') as temp_compose:
-        yaml_contents = yaml.dump(data_processed)
-        temp_compose.write(yaml_contents)
+        paths = [os.path.join(compose_dir, name) for name in os.listdir(compose_dir)
+                 if name.startswith("docker-compose-") and name.endswith(".yml")]
+        for old_path in sorted(paths, key=os.path.getmtime)[:-COMPOSE_CACHE_MAX_ENTRIES]:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass  # Removed by another process
 
-    atexit.register(lambda: os.remove(temp_compose.name))
-    logger.debug("Docker compose file: {}".format(temp_compose.name))
+    return path
 
-    return temp_compose
 
 def get_config_path(default_filename, path):
     return os.path.abspath(path) if path else get_config_file(default_filename)
@@ -405,46 +687,135 @@ def get_temp_base_directory(args):
     return temp_base_dir
 
 
-def build_image_from_source(docker_dir, source_image, dest_image, temp_dir: Optional[str] = None, folders=None):
-    """Build a docker image from source local directory."""
+def build_image_from_source(
+    docker_dir,
+    source_image,
+    dest_image,
+    temp_dir: Optional[str] = None,
+    folders=None,
+    db_format=None,
+    db_jobs=None,
+    db_compression=None,
+):
+    """Build a docker image from a running instance, streaming the build context."""
     status = get_image_status(source_image)
     if status["state"] != "running":
         raise D2DockerError("Container must be running to build image")
 
-    with tempfile.TemporaryDirectory(dir=temp_dir) as temp_dir_root:
-        logger.info("Create temporal directory: {}".format(temp_dir_root))
-        temp_dir = os.path.join(temp_dir_root, "contents")
+    if folders is None:
+        folders = default_folders
 
-        logger.info("Copy base docker files: {}".format(docker_dir))
-        copytree(docker_dir, temp_dir)
-        export_data_from_running_containers(source_image, status["containers"], temp_dir, folders=folders)
-        docker_build(temp_dir, dest_image)
+    # The DB dump is spooled to disk (tar headers need the file sizes), the rest of the
+    # context (skeleton files, DHIS2 files) is streamed into docker build.
+    with tempfile.TemporaryDirectory(dir=temp_dir) as db_temp_dir:
+        db_path = get_db_dump_path(db_temp_dir, db_format, db_compression)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            db_future = executor.submit(
+                tracing.propagate(export_database),
+                source_image,
+                db_path,
+                db_format,
+                db_jobs,
+                db_compression,
+            )
+            with build_context.docker_build_stream([dest_image]) as context:
+                context.add_directory_contents(docker_dir)
+                core_container = status["containers"]["core"]
+                context.add_container_folders(core_container, "/DHIS2_home/files", folders)
+                db_future.result()
+                context.add_path(db_temp_dir, "db")
+
+
+def copy_image(
+    docker_dir,
+    source_image,
+    dest_image,
+    temp_dir: Optional[str] = None,
+    db_format=None,
+    db_jobs=None,
+    tags=None,
+):
+    """Build a docker image using another one as template. Add the extra tags to the image."""
+    with tracing.span("copy_image", source=source_image, dest=dest_image):
+        _copy_image(docker_dir, source_image, dest_image, temp_dir, db_format, db_jobs, tags)
 
 
-def copy_image(docker_dir, source_image, dest_image, temp_dir: Optional[str] = None):
-    """Build a docker image using another one as template."""
-    with tempfile.TemporaryDirectory(dir=temp_dir) as temp_dir_root:
-        logger.info("Create temporal directory: {}".format(temp_dir_root))
-        temp_dir = os.path.join(temp_dir_root, "contents")
+def _copy_image(docker_dir, source_image, dest_image, temp_dir, db_format, db_jobs, tags):
+    dest_images = [dest_image, *(tags or [])]
 
-        logger.info("Copy base docker files: {}".format(docker_dir))
-        copytree(docker_dir, temp_dir)
-        export_data_from_image(source_image, temp_dir)
-        docker_build(temp_dir, dest_image)
+    if db_format:
+        # The DB dump must be converted on disk, build from an exported data directory.
+        with tempfile.TemporaryDirectory(dir=temp_dir) as data_dir:
+            export_data_from_image(source_image, data_dir)
+            convert_database(os.path.join(data_dir, "db"), db_format, db_jobs)
+            build_image_from_directory(docker_dir, data_dir, dest_image, temp_dir, tags=tags)
+        return
 
+    logger.info("Stream data from image: {} -> {}".format(source_image, ", ".join(dest_images)))
+    result = run(["docker", "create", source_image], capture_output=True)
+    container_id = result.stdout.decode("utf8").splitlines()[0]
+    try:
+        with build_context.docker_build_stream(dest_images) as context:
+            context.add_directory_contents(docker_dir)
+            folders = ["db", "apps", "document", "dataValue"]
+            found_folders = context.add_container_folders(container_id, "/data", folders)
+            if "db" not in found_folders:
+                raise D2DockerError("Database folder not found in image: {}".format(source_image))
+    finally:
+        run(["docker", "rm", "-v", container_id])
 
-def build_image_from_directory(docker_dir, data_dir, dest_image_name, temp_dir: Optional[str] = None):
-    """Build docker image from data (db + apps + documents) directory."""
-    with tempfile.TemporaryDirectory(dir=temp_dir) as temp_dir_root:
-        logger.info("Create temporal directory: {}".format(temp_dir_root))
-        temp_dir = os.path.join(temp_dir_root, "contents")
 
-        logger.info("Copy base docker files: {}".format(docker_dir))
-        copytree(docker_dir, temp_dir)
+def build_image_from_directory(
+    docker_dir,
+    data_dir,
+    dest_image_name,
+    temp_dir: Optional[str] = None,
+    db_format=None,
+    db_jobs=None,
+    tags=None,
+    db_dir=None,
+):
+    """Build docker image from data (db + apps + documents) directory. Use db_dir (if given)
+    instead of the db/ folder of data_dir. Add the extra tags to the image."""
+    dest_images = [dest_image_name, *(tags or [])]
+    db_source_dir = db_dir or os.path.join(data_dir, "db")
+
+    with converted_db_directory(db_source_dir, temp_dir, db_format, db_jobs) as db_build_dir:
+        logger.info("Stream data: {} -> {}".format(data_dir, ", ".join(dest_images)))
+        with build_context.docker_build_stream(dest_images) as context:
+            context.add_directory_contents(docker_dir)
+            for entry in sorted(os.listdir(data_dir)):
+                if entry == "db":
+                    context.add_path(db_build_dir, "db")
+                else:
+                    context.add_path(os.path.join(data_dir, entry), entry)
 
-        logger.info("Copy data: {} -> {}".format(data_dir, temp_dir))
-        copytree(data_dir, temp_dir)
-        docker_build(temp_dir, dest_image_name)
+
+@contextlib.contextmanager
+def converted_db_directory(db_dir, temp_dir: Optional[str] = None, db_format=None, db_jobs=None):
+    """Yield a DB folder with the dump in db_format: db_dir itself if no conversion is needed,
+    otherwise a converted copy (db_dir is never modified)."""
+    if not db_format or not os.path.isdir(db_dir) or get_db_format(db_dir) == db_format:
+        yield db_dir
+        return
+
+    with tempfile.TemporaryDirectory(dir=temp_dir) as db_temp_dir:
+        copytree(db_dir, db_temp_dir)
+        convert_database(db_temp_dir, db_format, db_jobs)
+        yield db_temp_dir
+
+
+def copy_data_directory(data_dir, dest_dir, db_dir=None):
+    """Copy a data (db + apps + documents) directory. Use db_dir (if given) instead of the db/
+    folder of data_dir."""
+    os.makedirs(dest_dir, exist_ok=True)
+    for entry in os.listdir(data_dir):
+        source_path = db_dir if entry == "db" and db_dir else os.path.join(data_dir, entry)
+        if os.path.isdir(source_path):
+            copytree(source_path, os.path.join(dest_dir, entry))
+        else:
+            shutil.copy2(source_path, os.path.join(dest_dir, entry))
 
 
 def export_data_from_image(source_image, dest_path):
@@ -453,11 +824,10 @@ def export_data_from_image(source_image, dest_path):
     container_id = result.stdout.decode("utf8").splitlines()[0]
     mkdir_p(dest_path)
     try:
-        run(["docker", "cp", container_id + ":" + "/data/db", dest_path])
-        with possible_errors():
-            run(["docker", "cp", container_id + ":" + "/data/apps", dest_path])
-            run(["docker", "cp", container_id + ":" + "/data/document", dest_path])
-            run(["docker", "cp", container_id + ":" + "/data/dataValue", dest_path])
+        folders = ["db", "apps", "document", "dataValue"]
+        found_folders = extract_container_folders(container_id, "/data", folders, dest_path)
+        if "db" not in found_folders:
+            raise D2DockerError("Database folder not found in image: {}".format(source_image))
     finally:
         run(["docker", "rm", "-v", container_id])
 
@@ -475,41 +845,223 @@ default_folders = [
     "jobData"
 ]
 
-def export_data_from_running_containers(image_name, containers, destination, folders=None):
-    """Export data (db + apps + documents) from a running Docker container to some folder."""
-    logger.info("Copy Dhis2 apps")
-    mkdir_p(destination)
+@contextlib.contextmanager
+def open_container_archive(container, path):
+    """
+    Yield a tar stream (file-like object) with the contents of a path in a container. Members
+    are prefixed with the basename of the path. Yield None if the path does not exist.
 
-    if folders is None:
-        folders = default_folders
+    Use the Docker Engine API when available, fallback to `docker cp CONTAINER:PATH -`.
+    """
+    client = docker_api.get_client()
+    if client:
+        with client.get_archive(container, path) as stream:
+            yield stream
+    else:
+        with open_container_archive_from_cli(container, path) as stream:
+            yield stream
 
-    # Note: source files/ folders may not exists
 
-    def copy(folder):
-        logger.info("Include folder: {}".format(folder))
-        source = "{}:/DHIS2_home/files/{}/".format(containers["core"], folder)
-        run(["docker", "cp", source, destination], raise_on_error=False)
+# docker cp errors (stderr) for a path that does not exist in the container
+CP_NOT_FOUND_ERRORS = ["Could not find the file", "No such container:path"]
+
+
+@contextlib.contextmanager
+def open_container_archive_from_cli(container, path):
+    cmd = ["docker", "cp", "{}:{}".format(container, path), "-"]
+    popen = run(
+        cmd,
+        return_popen=True,
+        universal_newlines=False,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    # Read stderr in the background, so a large output cannot block the process
+    stderr_chunks = []
+    stderr_thread = threading.Thread(target=lambda: stderr_chunks.append(popen.stderr.read()))
+    stderr_thread.start()
+
+    def wait():
+        popen.stdout.close()
+        return_code = popen.wait()
+        stderr_thread.join()
+        return (return_code, b"".join(stderr_chunks).decode("utf-8", "replace").strip())
+
+    if not popen.stdout.peek(1):
+        return_code, stderr = wait()
+        if return_code == 0 or any(error in stderr for error in CP_NOT_FOUND_ERRORS):
+            yield None
+            return
+        else:
+            raise D2DockerError("Command {} failed: {}".format(" ".join(cmd), stderr))
+
+    try:
+        yield popen.stdout
+    except BaseException:
+        popen.kill()
+        wait()
+        raise
+
+    # Consume the rest of the stream (tar padding), so the process does not fail on EPIPE
+    while popen.stdout.read(TAR_BUFFER_SIZE):
+        pass
+    return_code, stderr = wait()
+    if return_code != 0:
+        raise D2DockerError("Command {} failed: {}".format(" ".join(cmd), stderr))
+
+
+TAR_BUFFER_SIZE = 1024 * 1024
+
+
+def extract_container_folders(container, source_path, folders, destination):
+    """
+    Extract folders of a path in a container to a destination directory (DEST/FOLDER) using
+    a single tar stream. Return the set of folders found.
+    """
+    found_folders = set()
+
+    with open_container_archive(container, source_path) as stream:
+        if not stream:
+            logger.debug("Path not found in container {}: {}".format(container, source_path))
+            return found_folders
 
-    for folder in folders:
-        copy(folder)
+        tar = tarfile.open(
+            fileobj=stream, mode="r|", bufsize=TAR_BUFFER_SIZE, copybufsize=TAR_BUFFER_SIZE
+        )
+        with tar:
+            for member in tar:
+                relative_name = get_relative_member_name(member.name)
+                folder = relative_name.split("/")[0] if relative_name else None
+                if folder not in folders:
+                    continue
+                elif folder not in found_folders:
+                    logger.info("Include folder: {}".format(folder))
+                    found_folders.add(folder)
 
-    db_path = os.path.join(destination, "db", "db.sql.gz")
-    export_database(image_name, db_path)
+                member.name = relative_name
+                if member.islnk():
+                    member.linkname = get_relative_member_name(member.linkname)
+                tar.extract(member, destination, **get_tar_extract_kwargs())
 
+    return found_folders
 
-def export_database(image_name, db_path):
-    """Export Dhis2 database into a gzipped file."""
+
+def get_relative_member_name(name):
+    """Remove the first component (the archived folder) of a tar member name."""
+    parts = [part for part in name.split("/") if part not in ("", ".")]
+    if ".." in parts:
+        raise D2DockerError("Unsafe path in archive: {}".format(name))
+    return "/".join(parts[1:])
+
+
+def get_tar_extract_kwargs():
+    # Python >= 3.12 warns if no extraction filter is given
+    return dict(filter="tar") if hasattr(tarfile, "tar_filter") else {}
+
+
+DB_FORMATS = ["sql", "directory"]
+DEFAULT_POSTGIS_VERSION = "14-3.2-alpine"
+
+
+def get_db_dump_path(db_dir, db_format=None, db_compression=None):
+    """Return the DB dump path in a data db/ directory for a format (sql | directory)."""
+    if db_format == "directory":
+        filename = "db.dir"
+    else:
+        filename = "db.sql" + compression.get_extension(db_compression)
+    return os.path.join(db_dir, filename)
+
+
+def get_db_format(db_dir):
+    """Return the format of the DB dump in a data db/ directory (sql | directory)."""
+    for _root, _dirs, files in os.walk(db_dir):
+        if "toc.dat" in files:
+            return "directory"
+    return "sql"
+
+
+def get_db_jobs(db_jobs=None):
+    return int(db_jobs) if db_jobs else (os.cpu_count() or 1)
+
+
+def export_database(image_name, db_path, db_format=None, db_jobs=None, db_compression=None):
+    """Export Dhis2 database into a compressed file (sql) or a pg_dump directory (directory)."""
     logger.info("Dump DB: {}".format(db_path))
-    mkdir_p(os.path.dirname(db_path))
 
-    with open(db_path, "wb") as db_file:
-        pg_dump = "set -o pipefail; " + " ".join(get_pg_dump_command())
+    def run_in_db(shell_cmd, **kwargs):
         # -T: Disable pseudo-tty allocation. Otherwise the compressed output pipe is corrupted.
-        cmd = ["exec", "-T", "db", "bash", "-c", pg_dump]
-        run_docker_compose(cmd, image_name, stdout=db_file)
+        cmd = ["exec", "-T", "db", "bash", "-c", shell_cmd]
+        return run_docker_compose(cmd, image_name, **kwargs)
+
+    with tracing.span("export_database", image=image_name, format=db_format) as db_span:
+        save_database_dump(run_in_db, db_path, db_format, db_jobs, db_compression)
+        db_span.args["bytes"] = get_path_size(db_path)
+
+
+def get_path_size(path):
+    """Return the size in bytes of a file or the files of a directory."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(dirpath, filename))
+        for (dirpath, _dirnames, filenames) in os.walk(path)
+        for filename in filenames
+    )
 
 
-def get_pg_dump_command(exclude_table=True, compress=True):
+def save_database_dump(run_in_db, db_path, db_format=None, db_jobs=None, db_compression=None):
+    """Dump the database to db_path. run_in_db(shell_cmd, **run_kwargs) must run a bash
+    command in the db container."""
+    mkdir_p(os.path.dirname(db_path))
+
+    if db_format == "directory":
+        # Parallel dump to a temporal directory in the container, then stream it as a tar.
+        script = " && ".join([
+            "set -e -o pipefail",
+            "dump_dir=$(mktemp -d)",
+            "trap 'rm -rf \"$dump_dir\"' EXIT",
+            " ".join(get_pg_dump_directory_command("$dump_dir/dump", get_db_jobs(db_jobs))),
+            'tar -C "$dump_dir/dump" -cf - .',
+        ])
+        popen = run_in_db(
+            script, return_popen=True, universal_newlines=False, stdout=subprocess.PIPE
+        )
+        try:
+            extract_tar_stream(popen.stdout, db_path)
+        except Exception:
+            # A failed pg_dump gives an empty/truncated tar: report the process error instead
+            wait_popen(popen, "pg_dump (directory format)")
+            raise
+        wait_popen(popen, "pg_dump (directory format)")
+    else:
+        compress_cmd = get_host_compress_command(db_compression)
+
+        with open(db_path, "wb") as db_file:
+            if compress_cmd:
+                # Compress in the host: multi-threaded codecs may not exist in the db container.
+                pg_dump = " ".join(get_pg_dump_command(compress=False))
+                popen_kwargs = dict(return_popen=True, universal_newlines=False)
+                dump_popen = run_in_db(pg_dump, stdout=subprocess.PIPE, **popen_kwargs)
+                compress_popen = run(compress_cmd, stdin=dump_popen.stdout, stdout=db_file, **popen_kwargs)
+                dump_popen.stdout.close()
+                wait_popen(compress_popen, " ".join(compress_cmd))
+                wait_popen(dump_popen, "pg_dump")
+            else:
+                level = db_compression.level if db_compression else None
+                pg_dump_cmd = get_pg_dump_command(compress_level=level)
+                pg_dump = "set -o pipefail; " + " ".join(pg_dump_cmd)
+                run_in_db(pg_dump, stdout=db_file)
+
+
+def get_host_compress_command(db_compression):
+    """Return the command to compress a DB dump in the host, None to gzip in the db container."""
+    if not db_compression or db_compression.codec == compression.DEFAULT_CODEC:
+        return None
+    else:
+        return compression.get_compress_command(db_compression)
+
+
+def get_pg_dump_command(exclude_table=True, compress=True, compress_level=None):
     cmd = ["pg_dump", "-U", "dhis", "dhis2"]
 
     if exclude_table:
@@ -517,13 +1069,176 @@ def get_pg_dump_command(exclude_table=True, compress=True):
 
     if compress:
         cmd += ["|", "gzip"]
+        if compress_level:
+            cmd += ["-{}".format(compress_level)]
 
     return cmd
 
 
-def load_images_file(input_file):
-    """Load docker images from local file."""
-    return run(["docker", "load", "-i", input_file], capture_output=True)
+def get_pg_dump_directory_command(output_dir, jobs, exclude_table=True):
+    cmd = ["pg_dump", "-U", "dhis", "--format=directory", "--jobs={}".format(jobs)]
+    cmd += ["--file", '"{}"'.format(output_dir)]
+
+    if exclude_table:
+        cmd += ["--exclude-table", "'analytics*'"]
+
+    return cmd + ["dhis2"]
+
+
+def extract_tar_stream(stream, destination):
+    """Extract a tar stream (file-like object) into a directory."""
+    mkdir_p(destination)
+    tar = tarfile.open(fileobj=stream, mode="r|", bufsize=TAR_BUFFER_SIZE)
+    with tar:
+        tar.extractall(destination, **get_tar_extract_kwargs())
+
+
+def wait_popen(popen, name):
+    """Close the output of a process, wait for it and raise an error on failure."""
+    if popen.stdout:
+        popen.stdout.close()
+    return_code = popen.wait()
+    if return_code != 0:
+        raise D2DockerError("Command {} failed with code {}".format(name, return_code))
+
+
+def convert_database(db_dir, db_format, db_jobs=None):
+    """Convert the DB dump in a data db/ directory to another format (sql | directory)
+    using a temporal postgis container."""
+    if not os.path.isdir(db_dir):
+        raise D2DockerError("DB directory not found: {}".format(db_dir))
+
+    current_format = get_db_format(db_dir)
+    if current_format == db_format:
+        return
+
+    logger.info("Convert DB dump: {} -> {} ({})".format(current_format, db_format, db_dir))
+    jobs = get_db_jobs(db_jobs)
+
+    with temporal_db_container() as container:
+        restore_database_dump(container, db_dir, jobs)
+
+        for entry in os.listdir(db_dir):
+            path = os.path.join(db_dir, entry)
+            if entry == "post":
+                continue
+            elif os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+        def run_in_db(shell_cmd, **kwargs):
+            return run(["docker", "exec", container, "bash", "-c", shell_cmd], **kwargs)
+
+        save_database_dump(run_in_db, get_db_dump_path(db_dir, db_format), db_format, jobs)
+
+
+@contextlib.contextmanager
+def temporal_db_container(postgis_version=None):
+    """Run a temporal postgis container with an empty dhis2 DB, yield the container ID."""
+    image = "postgis/postgis:{}".format(postgis_version or DEFAULT_POSTGIS_VERSION)
+    env_args = ["-e", "POSTGRES_DB=dhis2", "-e", "POSTGRES_USER=dhis", "-e", "POSTGRES_PASSWORD=dhis"]
+    result = run(["docker", "run", "-d", *env_args, image], capture_output=True)
+    container = result.stdout.decode("utf-8").strip()
+
+    try:
+        # The entrypoint starts a temporal server for the initialization (socket only), so
+        # check the TCP port to know when the final server is ready.
+        is_ready_cmd = ["docker", "exec", container, "pg_isready", "-h", "127.0.0.1", "-U", "dhis"]
+        timeout = time.monotonic() + 300
+        while run(is_ready_cmd, raise_on_error=False, capture_output=True).returncode != 0:
+            if time.monotonic() > timeout:
+                raise D2DockerError("Timeout waiting for temporal DB container: {}".format(image))
+            time.sleep(1)
+        yield container
+    finally:
+        run(["docker", "rm", "-f", "-v", container], capture_output=True)
+
+
+def restore_database_dump(container, db_dir, jobs):
+    """Restore the dump files in a data db/ directory in a postgis container."""
+    psql = "psql --quiet -U dhis dhis2"
+
+    for root, dirs, files in os.walk(db_dir):
+        dirs[:] = sorted(d for d in dirs if d != "post")
+        if "toc.dat" in files:
+            logger.info("Restore DB dump (directory): {}".format(root))
+            script = " && ".join([
+                "set -e",
+                "dump_dir=$(mktemp -d)",
+                'tar -C "$dump_dir" -xf -',
+                'pg_restore -U dhis -d dhis2 --jobs={} "$dump_dir" || true'.format(jobs),
+                'rm -rf "$dump_dir"',
+            ])
+            cmd = ["docker", "exec", "-i", container, "bash", "-c", script]
+            popen = run(cmd, return_popen=True, universal_newlines=False, stdin=subprocess.PIPE)
+            with tarfile.open(fileobj=popen.stdin, mode="w|", bufsize=TAR_BUFFER_SIZE) as tar:
+                tar.add(root, arcname=".")
+            popen.stdin.close()
+            if popen.wait() != 0:
+                raise D2DockerError("Could not restore DB dump: {}".format(root))
+            dirs[:] = []
+            continue
+
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            if filename.endswith(".sql.zst"):
+                logger.info("Restore DB dump: {}".format(path))
+                decompress_cmd = compression.get_decompress_command("zstd")
+                popen_kwargs = dict(return_popen=True, universal_newlines=False)
+                decompress_popen = run([*decompress_cmd, path], stdout=subprocess.PIPE, **popen_kwargs)
+                restore_cmd = ["docker", "exec", "-i", container, "bash", "-c", psql]
+                run(restore_cmd, stdin=decompress_popen.stdout)
+                wait_popen(decompress_popen, " ".join(decompress_cmd))
+                continue
+            elif filename.endswith(".dump"):
+                shell_cmd = "pg_restore -U dhis -d dhis2 || true"
+            elif filename.endswith(".sql.gz"):
+                shell_cmd = "zcat | {} || true".format(psql)
+            elif filename.endswith(".sql"):
+                shell_cmd = psql
+            else:
+                continue
+            logger.info("Restore DB dump: {}".format(path))
+            with open(path, "rb") as input_file:
+                run(["docker", "exec", "-i", container, "bash", "-c", shell_cmd], stdin=input_file)
+
+
+def add_compression_args(parser, help_subject="DB dump"):
+    parser.add_argument(
+        "--compression",
+        choices=list(compression.CODECS),
+        help="Compression codec for the {} (default: {})".format(help_subject, compression.DEFAULT_CODEC),
+    )
+    parser.add_argument(
+        "--compression-level", type=int, metavar="LEVEL", help="Compression level"
+    )
+    parser.add_argument(
+        "--compression-threads",
+        type=int,
+        metavar="N",
+        help="Compression threads for pigz/zstd (default: all cores)",
+    )
+
+
+def get_compression_from_args(args):
+    return compression.get_compression(
+        args.compression, args.compression_level, args.compression_threads
+    )
+
+
+def add_db_format_args(parser):
+    parser.add_argument(
+        "--db-format",
+        choices=DB_FORMATS,
+        help="Database dump format: sql (gzipped plain SQL) or directory (parallel pg_dump)",
+    )
+    parser.add_argument(
+        "--db-jobs",
+        type=int,
+        metavar="N",
+        help="Parallel jobs for directory-format dumps/restores (default: number of CPUs)",
+    )
 
 
 def push_image(image_name):
@@ -536,9 +1251,57 @@ def pull_image(image_name):
     return run(["docker", "pull", image_name])
 
 
-def save_images(image_names, output_file_path):
-    """Save list of Docker images into a local file."""
-    run(["docker", "save", *image_names, "-o", output_file_path])
+@contextlib.contextmanager
+def saved_images_stream(image_names):
+    """Yield the (binary) stdout stream of `docker save IMAGES`."""
+    cmd = ["docker", "save", *image_names]
+    popen = run(cmd, return_popen=True, universal_newlines=False, stdout=subprocess.PIPE)
+    try:
+        yield popen.stdout
+    except BaseException:
+        popen.kill()
+        popen.wait()
+        raise
+    else:
+        wait_popen(popen, "docker save")
+
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def copy_stream(source, dest, name, chunk_size=STREAM_CHUNK_SIZE, progress_interval=5):
+    """Copy a binary stream to another in chunks, logging the progress (bytes/sec).
+    Return the number of bytes copied."""
+    total = 0
+    start_time = last_log_time = time.monotonic()
+
+    while True:
+        check_cancelled()
+        data = source.read(chunk_size)
+        if not data:
+            break
+        dest.write(data)
+        total += len(data)
+        now = time.monotonic()
+        if now - last_log_time >= progress_interval:
+            last_log_time = now
+            logger.info("{}: {}".format(name, get_transfer_info(total, now - start_time)))
+
+    logger.info("{}: {} (done)".format(name, get_transfer_info(total, time.monotonic() - start_time)))
+    return total
+
+
+def get_transfer_info(size, elapsed):
+    rate = size / elapsed if elapsed > 0 else 0
+    return "{} in {:.1f}s ({}/s)".format(format_size(size), elapsed, format_size(rate))
+
+
+def format_size(size):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            return "{:.1f} {}".format(size, unit)
+        size /= 1024
+    return "{:.1f} TB".format(size)
 
 
 def add_image_arg(parser):
@@ -551,6 +1314,77 @@ def add_core_image_arg(parser):
     )
 
 
+DEFAULT_BATCH_JOBS = 4
+
+BatchResult = collections.namedtuple("BatchResult", ["item", "value", "error"])
+
+
+def add_batch_args(parser, metavar="IMAGE", help="Docker dhis2-data images", required=False):
+    """Add arguments for commands that accept many images (args.images, run in parallel). The
+    images may be intermixed with options (see cli.parse_args)."""
+    parser.add_argument(
+        "images",
+        metavar=metavar,
+        type=str,
+        nargs="+" if required else "*",
+        help=help + " (run in parallel)",
+    )
+    add_jobs_arg(parser)
+
+
+def add_jobs_arg(parser):
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        metavar="N",
+        help="Images processed in parallel (default: {})".format(DEFAULT_BATCH_JOBS),
+    )
+
+
+def get_batch_images(args):
+    """Return the images of a command with add_batch_args (IMAGE [IMAGE...]), without repeats.
+    API requests pass a single image in args.image."""
+    images = [getattr(args, "image", None), *(args.images or [])]
+    return list(dict.fromkeys(image for image in images if image))
+
+
+def run_batch(func, items, jobs=None, name="Run"):
+    """
+    Run func(item) for each item in a pool of `jobs` threads and return the BatchResult's
+    (in the order of items). With a single item, just call the function.
+
+    Raise a D2DockerError with the failed items, after all items have been processed.
+    """
+    if len(items) <= 1:
+        return [BatchResult(item, func(item), None) for item in items]
+
+    max_workers = min(jobs or DEFAULT_BATCH_JOBS, len(items))
+    logger.info("{}: {} items ({} in parallel)".format(name, len(items), max_workers))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(tracing.propagate(func), item) for item in items]
+        concurrent.futures.wait(futures)
+
+    results = [
+        BatchResult(item, None, future.exception())
+        if future.exception()
+        else BatchResult(item, future.result(), None)
+        for (item, future) in zip(items, futures)
+    ]
+    for result in results:
+        status = "ERROR: {}".format(result.error) if result.error else "OK"
+        logger.info("{} {}: {}".format(name, result.item, status))
+
+    failed = [result for result in results if result.error]
+    if failed:
+        errors = ", ".join("{} ({})".format(result.item, result.error) for result in failed)
+        msg = "{}: {} of {} failed: {}".format(name, len(failed), len(results), errors)
+        raise D2DockerError(msg)
+
+    return results
+
+
 @contextlib.contextmanager
 def running_containers(image_name, *up_args, **run_docker_compose_kwargs):
     """Start docker compose services for an image in a context manager and stop it afterwards."""
@@ -592,13 +1426,89 @@ def temporal_build_directory(source_dir, temp_dir: Optional[str] = None):
         yield build_dir
 
 
-def wait_for_server(port):
-    url = "http://localhost:{}".format(port)
+def wait_for_server(port, image_name=None, timeout=None, host="localhost"):
+    """
+    Wait until the DHIS2 instance is ready. Return False if the server responds with a 404.
+
+    If image_name is given, wait first for the core container to be ready: from its health
+    events (Docker Engine API) or, if not available, from its log ("DHIS2 instance ready").
+    Then (or if no image_name is given) poll the server URL with an adaptive backoff. Raise a
+    D2DockerError after timeout seconds (no limit if None).
+    """
+    deadline = time.time() + timeout if timeout else None
+    if image_name:
+        wait_for_core_ready(image_name, deadline)
+    return poll_server("http://{}:{}".format(host, port), deadline)
+
+
+def wait_for_core_ready(image_name, deadline=None):
+    client = docker_api.get_client()
+    if client:
+        try:
+            return wait_for_core_healthy(client, image_name, deadline)
+        except docker_api.DockerApiError as exc:
+            logger.debug("Docker API not available, fallback to logs: {}".format(exc))
+
+    wait_for_core_log_marker(image_name, deadline)
+
+
+def wait_for_core_healthy(client, image_name, deadline=None):
+    labels = ["{}={}".format(IMAGE_NAME_LABEL, image_name), COMPOSE_SERVICE_LABEL + "=core"]
+    # Events since this moment are replayed, so no health change is lost after the check
+    since = time.time()
+    if any("(healthy)" in (container.get("Status") or "")
+           for container in client.containers(labels=labels)):
+        return
+
+    logger.debug("Waiting for core container health: {}".format(image_name))
+    filters = {"type": ["container"], "event": ["health_status", "die"], "label": labels}
+    for event in client.events(filters=filters, since=since, until=deadline):
+        action = event.get("Action") or event.get("status") or ""
+        if action == "health_status: healthy":
+            return
+        elif action == "die":
+            raise D2DockerError("DHIS2 core container stopped: {}".format(image_name))
+
+    raise D2DockerError("Timeout waiting for DHIS2 instance: {}".format(image_name))
+
+
+def wait_for_core_log_marker(image_name, deadline=None, marker="DHIS2 instance ready"):
+    logger.debug("Waiting for core log marker: {}".format(image_name))
+    popen = run_docker_compose(
+        ["logs", "--follow", "--no-log-prefix", "core"],
+        image_name,
+        return_popen=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    )
+    timer = threading.Timer(deadline - time.time(), popen.kill) if deadline else None
+    if timer:
+        timer.start()
+
+    try:
+        for line in popen.stdout:
+            if marker in line:
+                return
+    finally:
+        if timer:
+            timer.cancel()
+        popen.kill()
+        popen.wait()
+
+    if deadline and time.time() >= deadline:
+        raise D2DockerError("Timeout waiting for DHIS2 instance: {}".format(image_name))
+    else:
+        raise D2DockerError("DHIS2 core container stopped: {}".format(image_name))
+
+
+def poll_server(url, deadline=None, initial_delay=0.5, max_delay=10):
+    """Request the URL until it responds, with growing delays. Return False on a 404."""
+    delay = initial_delay
 
     while True:
         try:
             logger.debug("wait_for_server:url={}".format(url))
-            urllib.request.urlopen(url)  # nosec
+            urllib.request.urlopen(url, timeout=30)  # nosec
             logger.debug("wait_for_server:ok")
             return True
         except urllib.request.HTTPError as exc:
@@ -606,10 +1516,13 @@ def wait_for_server(port):
                 return False
             else:
                 logger.debug("wait_for_server:http-error: {}".format(exc.code))
-        except urllib.request.URLError as exc:
-            logger.debug("wait_for_server:url-error: {}".format(exc.reason))
+        except (urllib.request.URLError, OSError) as exc:
+            logger.debug("wait_for_server:url-error: {}".format(getattr(exc, "reason", exc)))
 
-        time.sleep(5)
+        if deadline and time.time() + delay > deadline:
+            raise D2DockerError("Timeout waiting for server: {}".format(url))
+        time.sleep(delay)
+        delay = min(delay * 1.5, max_delay)
 
 
 def create_core(
@@ -628,9 +1541,7 @@ def create_core(
             logger.debug("Copy WAR file: {} -> {}".format(war, war_path))
             shutil.copy(war, war_path)
         elif version:
-            war_url = get_dhis2_war_url(version)
-            logger.info("Download file: {}".format(war_url))
-            urllib.request.urlretrieve(war_url, war_path)  # nosec
+            war_cache.copy_war(get_dhis2_war_url(version), war_path)
         else:
             raise D2DockerError("One option is required: --version | --war")
 
@@ -0,0 +1,290 @@
+"""
+Local cache of DHIS2 WAR files.
+
+WAR files are stored by content (blobs/SHA256.war) and indexed by URL (urls/KEY.sha256), so
+`create core` and `upgrade` download each version once. Downloads are written to a .part file
+(resumed with HTTP Range requests after a failure), verified against the published SHA-256
+checksum when available and moved atomically into the cache. The cache size is bounded by
+evicting the least recently used blobs.
+
+Environment variables:
+    D2_DOCKER_CACHE_DIR: Base cache directory (default: $XDG_CACHE_HOME/d2-docker).
+    D2_DOCKER_WAR_CACHE_MAX_SIZE: Maximum size of the WAR cache (default: 5G).
+"""
+import hashlib
+import os
+import re
+import shutil
+import time
+import urllib.error
+import urllib.request
+
+from . import utils
+
+MAX_SIZE_ENV = "D2_DOCKER_WAR_CACHE_MAX_SIZE"
+DEFAULT_MAX_SIZE = "5G"
+DOWNLOAD_ATTEMPTS = 3
+DOWNLOAD_TIMEOUT = 60
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def get_war(url, expected_sha256=None):
+    """Return the path of the cached WAR file for an URL, downloading it if necessary."""
+    key = get_url_key(url)
+
+    with utils.file_lock(get_path("locks", key + ".lock")):
+        path = get_cached_path(url)
+        if path and not is_pinned_url(url) and not is_fresh(url, path):
+            utils.logger.info("WAR changed on the server, download again: {}".format(url))
+            path = None
+
+        if path:
+            utils.logger.info("WAR cache hit: {} ({})".format(url, path))
+        else:
+            path = download_to_cache(url, expected_sha256)
+        # Mark as recently used (for the LRU eviction)
+        os.utime(path)
+
+    evict(get_max_size(), keep=[path])
+    return path
+
+
+def copy_war(url, dest_path):
+    """Put the cached WAR of an URL in dest_path (hard link if possible, copy otherwise)."""
+    for attempt in range(2):
+        path = get_war(url)
+        utils.logger.debug("Copy WAR file: {} -> {}".format(path, dest_path))
+        try:
+            link_or_copy(path, dest_path)
+            return
+        except FileNotFoundError:
+            # Evicted by another process between get_war and the copy: fetch it again
+            if attempt > 0 or os.path.exists(path):
+                raise
+            utils.logger.debug("WAR evicted from the cache, retrying: {}".format(path))
+
+
+def link_or_copy(path, dest_path):
+    try:
+        os.link(path, dest_path)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copy(path, dest_path)
+
+
+def get_cached_path(url):
+    index_path = get_path("urls", get_url_key(url) + ".sha256")
+    if not os.path.exists(index_path):
+        return None
+
+    with open(index_path) as index_file:
+        sha256 = index_file.read().strip()
+    blob_path = get_blob_path(sha256)
+    return blob_path if os.path.exists(blob_path) else None
+
+
+def is_pinned_url(url):
+    """Return True if the URL is for a patch version (dhis2-stable-2.39.1.war), which never
+    changes. Other URLs (2.39/dhis.war) point to the latest build and must be revalidated."""
+    return bool(re.search(r"/dhis2-stable-\d+\.\d+\.\d+[^/]*\.war$", url))
+
+
+def is_fresh(url, blob_path):
+    """Return True if the cached WAR of an URL is still the file on the server: compare the
+    published checksum or, if not available, the ETag/Last-Modified of the download."""
+    sha256 = os.path.basename(blob_path)[: -len(".war")]
+    published_sha256 = get_published_sha256(url)
+    if published_sha256:
+        return published_sha256 == sha256
+
+    validator_path = get_path("urls", get_url_key(url) + ".validator")
+    if not os.path.exists(validator_path):
+        return False
+    validator = read_file(validator_path)
+
+    request = urllib.request.Request(url, method="HEAD")
+    try:
+        with urllib.request.urlopen(request, timeout=DOWNLOAD_TIMEOUT) as response:  # nosec
+            return get_validator(response) == validator
+    except (urllib.error.URLError, OSError) as exc:
+        utils.logger.warning("Cannot revalidate {}, using the cached file: {}".format(url, exc))
+        return True
+
+
+def download_to_cache(url, expected_sha256=None):
+    key = get_url_key(url)
+    part_path = get_path("downloads", key + ".part")
+    expected_sha256 = expected_sha256 or get_published_sha256(url)
+
+    download(url, part_path)
+    sha256 = get_file_sha256(part_path)
+
+    if expected_sha256 and sha256 != expected_sha256.lower():
+        os.remove(part_path)
+        msg = "Checksum mismatch for {}: expected {}, got {}"
+        raise utils.D2DockerError(msg.format(url, expected_sha256, sha256))
+
+    blob_path = get_blob_path(sha256)
+    os.replace(part_path, blob_path)
+    write_atomic(get_path("urls", key + ".sha256"), sha256 + "\n")
+    validator_path = get_path("urls", key + ".validator")
+    if os.path.exists(part_path + ".validator"):
+        os.replace(part_path + ".validator", validator_path)
+    elif os.path.exists(validator_path):
+        os.remove(validator_path)
+    return blob_path
+
+
+def download(url, dest_path):
+    """
+    Download an URL to a file, resuming a previous partial download if present.
+
+    The ETag/Last-Modified of the response is stored in DEST_PATH.validator and sent as If-Range
+    on resume, so a file changed on the server is downloaded again instead of appended.
+    """
+    validator_path = dest_path + ".validator"
+    attempt = 1
+
+    while True:
+        validator = read_file(validator_path) if os.path.exists(validator_path) else None
+        offset = os.path.getsize(dest_path) if os.path.exists(dest_path) and validator else 0
+        headers = {"Range": "bytes={}-".format(offset), "If-Range": validator} if offset else {}
+        request = urllib.request.Request(url, headers=headers)
+        resume_info = " (resume at byte {})".format(offset) if offset else ""
+        utils.logger.info("Download file: {}{}".format(url, resume_info))
+
+        try:
+            with urllib.request.urlopen(request, timeout=DOWNLOAD_TIMEOUT) as response:  # nosec
+                resumed = offset and response.status == 206
+                total_size = get_total_size(response, offset if resumed else 0)
+                if not resumed:
+                    write_validator(validator_path, get_validator(response))
+                with open(dest_path, "ab" if resumed else "wb") as output:
+                    utils.copy_stream(response, output, "Download")
+        except urllib.error.HTTPError as exc:
+            if exc.code == 416 and offset:
+                # Range not satisfiable: the partial file is not valid for this URL. Start
+                # again, it does not count as a failed attempt.
+                os.remove(dest_path)
+                continue
+            raise utils.D2DockerError("Cannot download {}: {}".format(url, exc))
+        except (urllib.error.URLError, OSError) as exc:
+            if attempt >= DOWNLOAD_ATTEMPTS:
+                raise utils.D2DockerError("Cannot download {}: {}".format(url, exc))
+            utils.logger.warning("Download interrupted, retrying: {}".format(exc))
+            time.sleep(attempt)
+            attempt += 1
+            continue
+
+        size = os.path.getsize(dest_path)
+        if total_size is not None and size != total_size:
+            if attempt >= DOWNLOAD_ATTEMPTS:
+                msg = "Incomplete download {}: {}/{} bytes".format(url, size, total_size)
+                raise utils.D2DockerError(msg)
+            attempt += 1
+            continue
+        return dest_path
+
+
+def get_validator(response):
+    """Return the validator of a response (ETag, or Last-Modified), None if not available."""
+    return response.headers.get("ETag") or response.headers.get("Last-Modified")
+
+
+def write_validator(path, validator):
+    if validator:
+        write_atomic(path, validator + "\n")
+    elif os.path.exists(path):
+        # No validator: a partial download cannot be safely resumed
+        os.remove(path)
+
+
+def read_file(path):
+    with open(path) as input_file:
+        return input_file.read().strip()
+
+
+def get_total_size(response, offset):
+    content_range = response.headers.get("Content-Range")
+    content_length = response.headers.get("Content-Length")
+    match = re.match(r"bytes \d+-\d+/(\d+)", content_range or "")
+
+    if match:
+        return int(match.group(1))
+    elif content_length:
+        return offset + int(content_length)
+    else:
+        return None
+
+
+def get_published_sha256(url):
+    """Return the checksum published next to the WAR (URL.sha256) or None if not available."""
+    try:
+        with urllib.request.urlopen(url + ".sha256", timeout=DOWNLOAD_TIMEOUT) as response:  # nosec
+            contents = response.read(1024).decode("utf-8", "replace")
+    except (urllib.error.URLError, OSError) as exc:
+        utils.logger.debug("No published checksum for {}: {}".format(url, exc))
+        return None
+
+    match = re.search(r"\b([0-9a-fA-F]{64})\b", contents)
+    return match.group(1).lower() if match else None
+
+
+def get_file_sha256(path, chunk_size=1024 * 1024):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as input_file:
+        for chunk in iter(lambda: input_file.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def evict(max_size, keep=None):
+    """Remove the least recently used blobs until the cache size is below max_size."""
+    keep = set(keep or [])
+
+    with utils.file_lock(get_path("locks", "evict.lock")):
+        blobs_dir = get_path("blobs")
+        utils.mkdir_p(blobs_dir)
+        paths = [os.path.join(blobs_dir, name) for name in os.listdir(blobs_dir)]
+        entries = sorted((os.stat(path).st_mtime, os.path.getsize(path), path) for path in paths)
+        total_size = sum(size for (_mtime, size, _path) in entries)
+
+        for (_mtime, size, path) in entries:
+            if total_size <= max_size:
+                break
+            elif path in keep:
+                continue
+            utils.logger.info("WAR cache full, remove: {}".format(path))
+            os.remove(path)
+            total_size -= size
+
+
+def get_max_size():
+    value = os.environ.get(MAX_SIZE_ENV) or DEFAULT_MAX_SIZE
+    match = re.match(r"^\s*(\d+)\s*([KMGT]?)B?\s*$", value.upper())
+    if not match:
+        raise utils.D2DockerError("Invalid {}: {}".format(MAX_SIZE_ENV, value))
+    return int(match.group(1)) * SIZE_UNITS[match.group(2)]
+
+
+def get_url_key(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def get_blob_path(sha256):
+    return get_path("blobs", sha256 + ".war")
+
+
+def get_path(*parts):
+    """Return a path in the WAR cache (the parent directory is created)."""
+    path = os.path.join(utils.get_cache_directory("wars"), *parts)
+    utils.mkdir_p(os.path.dirname(path))
+    return path
+
+
+def write_atomic(path, contents):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as output:
+        output.write(contents)
+    os.replace(temp_path, path)
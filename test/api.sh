@@ -23,6 +23,16 @@ post() {
     curl -f -X POST -sS -H "Content-Type: application/json" "${url}${path}" -d "$data"
 }
 
+# POST a job endpoint and wait until the job is finished (fail if the job failed)
+post_job() {
+    local job_id status
+    job_id=$(post "$@" | jq -r .job.id)
+    debug "Wait job: $job_id"
+    get "/jobs/$job_id/stream"
+    status=$(get "/jobs/$job_id" | jq -r .status)
+    test "$status" = "SUCCESS"
+}
+
 harbor_api="$url/harbor/https://docker.eyeseetea.com/api/v2.0"
 
 run_tests() {
@@ -33,16 +43,22 @@ run_tests() {
     get "/version"
     get "/instances"
 
-    post "/instances/pull" '{"image": "$image"}'
+    post_job "/instances/pull" '{"image": "$image"}'
     post "/instances/stop" '{"image": "$image"}'
-    post "/instances/start" '{"image": "$image", "detach": true, "port": 9999}'
+    post_job "/instances/start" '{"image": "$image", "detach": true, "port": 9999}'
     get "/instances"
     while ! curl -f "http://localhost:9999" 2>/dev/null; do sleep 1; done
 
-    post "/instances/commit" '{"image": "$image"}'
-    post "/instances/copy" '{"source": "$image", "destinations": ["$image2"]}'
-    post "/instances/push" '{"image": "$image2"}'
-    post "/instances/stop" '{"image": "$image"}'
+    post "/instances/snapshots/create" '{"image": "$image", "name": "before_commit"}'
+    get "/instances/snapshots?image=$image"
+    post "/instances/snapshots/restore" '{"image": "$image", "name": "before_commit"}'
+    post "/instances/snapshots/drop" '{"image": "$image", "name": "before_commit"}'
+
+    post_job "/instances/commit" '{"image": "$image"}'
+    get "/jobs"
+    post_job "/instances/copy" '{"source": "$image", "destinations": ["$image2"]}'
+    post_job "/instances/push" '{"image": "$image2"}'
+    post "/instances/batch/stop" '{"images": ["$image", "$image2"], "wait": true}'
     post "/instances/rm" '{"images": ["$image2"]}'
 }
 
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Scripted stand-in for the docker CLI, used by the benchmarks (see run.py).
+
+The fake state is configured with environment variables:
+
+    FAKE_DOCKER_IMAGES: Number of local dhis2-data images (default: 10).
+    FAKE_DOCKER_INSTANCES: Number of running d2-docker instances, 3 containers each (default: 1).
+    FAKE_DOCKER_STREAM_SIZE: Bytes of the synthetic streams of save/cp/exec (default: 16 MiB).
+
+Supported: ps, image ls, compose (config prints the compose file; other subcommands do
+nothing), save, cp CONTAINER:PATH -, exec (pg_dump output), create, rm, inspect, volume, version.
+Other commands exit with 0 and no output.
+"""
+import io
+import os
+import re
+import sys
+import tarfile
+
+SERVICES = ["gateway", "core", "db"]
+CHUNK = bytes(range(256)) * 256
+
+
+def get_config():
+    return dict(
+        images=int(os.environ.get("FAKE_DOCKER_IMAGES", "10")),
+        instances=int(os.environ.get("FAKE_DOCKER_INSTANCES", "1")),
+        stream_size=int(os.environ.get("FAKE_DOCKER_STREAM_SIZE", str(16 * 1024 * 1024))),
+    )
+
+
+def get_data_image(index):
+    return "docker.eyeseetea.com/eyeseetea/dhis2-data:2.{}-bench{}".format(30 + index % 10, index)
+
+
+def get_project_name(image_name):
+    return re.sub(r"[^\w]", "-", image_name.replace("/dhis2-data", "")).lower()
+
+
+def get_containers(config):
+    for index in range(min(config["instances"], config["images"])):
+        image_name = get_data_image(index)
+        for service in SERVICES:
+            ports = "0.0.0.0:{}->80/tcp".format(8080 + index) if service == "gateway" else ""
+            yield dict(
+                ID="{:012x}".format(index * len(SERVICES) + SERVICES.index(service)),
+                Names="{}-{}-1".format(get_project_name(image_name), service),
+                Image=image_name if service == "db" else "nginx",
+                Ports=ports,
+                Labels={
+                    "com.eyeseetea.image-name": image_name,
+                    "com.docker.compose.service": service,
+                    "com.docker.compose.project": get_project_name(image_name),
+                },
+            )
+
+
+def render(template, values):
+    """Render the subset of Go templates used by d2-docker ({{.Field}}, {{.Label "name"}})."""
+
+    def replace(match):
+        label, field = match.group(1), match.group(2)
+        if label:
+            return values.get("Labels", {}).get(label, "")
+        else:
+            return str(values.get(field, ""))
+
+    return re.sub(r'{{\s*(?:\.Label\s+"([^"]+)"|\.(\w+))\s*}}', replace, template)
+
+
+def get_format(args, default):
+    for index, arg in enumerate(args):
+        if arg.startswith("--format="):
+            return arg[len("--format="):]
+        elif arg == "--format" and index + 1 < len(args):
+            return args[index + 1]
+    return default
+
+
+def write_lines(lines):
+    sys.stdout.write("".join(line + "\n" for line in lines))
+
+
+def write_stream(size, output=None):
+    output = output or sys.stdout.buffer
+    remaining = size
+    while remaining > 0:
+        data = CHUNK[:remaining]
+        output.write(data)
+        remaining -= len(data)
+    output.flush()
+
+
+def ps(config, args):
+    template = get_format(args, "{{.ID}} {{.Names}}")
+    write_lines(render(template, container) for container in get_containers(config))
+
+
+def image_ls(config, args):
+    template = get_format(args, "{{.Repository}}:{{.Tag}}")
+    images = [get_data_image(index) for index in range(config["images"])]
+    images += ["nginx:latest", "postgis/postgis:13-3.1-alpine", "<none>:<none>"]
+    values = [dict(zip(["Repository", "Tag"], image.rsplit(":", 1))) for image in images]
+    write_lines(render(template, value) for value in values)
+
+
+def compose(_config, args):
+    if "config" not in args:
+        return
+    compose_file = args[args.index("-f") + 1] if "-f" in args else "docker-compose.yml"
+    contents = sys.stdin.read() if compose_file == "-" else open(compose_file).read()
+
+    def replace(match):
+        name, default = match.group(1), match.group(3)
+        return os.environ.get(name) or default or ""
+
+    sys.stdout.write(re.sub(r"\$\{(\w+)(:?-([^}]*))?\}", replace, contents))
+
+
+def cp(config, args):
+    """docker cp CONTAINER:PATH - -> tar stream with a folder and a synthetic file."""
+    source = next(arg for arg in args if ":" in arg)
+    folder = os.path.basename(source.split(":", 1)[1].rstrip("/")) or "root"
+    with tarfile.open(fileobj=sys.stdout.buffer, mode="w|") as tar:
+        directory = tarfile.TarInfo(folder)
+        directory.type = tarfile.DIRTYPE
+        directory.mode = 0o755
+        tar.addfile(directory)
+        for name in ["db", "apps", "document", "dataValue"]:
+            subdirectory = tarfile.TarInfo("{}/{}".format(folder, name))
+            subdirectory.type = tarfile.DIRTYPE
+            subdirectory.mode = 0o755
+            tar.addfile(subdirectory)
+        info = tarfile.TarInfo("{}/db/db.sql.gz".format(folder))
+        info.size = config["stream_size"]
+        buffer = io.BytesIO()
+        write_stream(info.size, buffer)
+        buffer.seek(0)
+        tar.addfile(info, buffer)
+
+
+def main(args):
+    config = get_config()
+    command, rest = (args[0], args[1:]) if args else ("", [])
+
+    if command == "ps" or args[:2] == ["container", "ls"]:
+        ps(config, rest)
+    elif args[:2] == ["image", "ls"] or command == "images":
+        image_ls(config, rest)
+    elif command == "compose":
+        compose(config, rest)
+    elif command in ("save", "exec"):
+        write_stream(config["stream_size"])
+    elif command == "cp":
+        cp(config, rest)
+    elif command == "create":
+        write_lines(["{:064x}".format(1)])
+    elif command == "version":
+        write_lines(["Docker version 24.0.0, build fake"])
+    elif command in ("inspect", "image") and "--format={{.Id}}" in rest:
+        write_lines(["sha256:{:064x}".format(1)])
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
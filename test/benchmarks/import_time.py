@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+CLI startup benchmark and guard: time the import of d2_docker.cli plus the parser setup for
+some commands (in fresh interpreters) and check that no heavy dependency is imported.
+
+    $ python3 test/benchmarks/import_time.py --output import-time.json
+    $ python3 test/benchmarks/import_time.py --compare import-time.json --threshold 0.2
+
+The exit code is 1 if a command imports a module in HEAVY_MODULES, if the median time of a
+command is over --max-ms or (with --compare) if it's slower than the baseline.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+
+import run
+
+COMMANDS = ["list", "logs", "start", "stop", "version", "commit", "copy"]
+
+# Dependencies that the CLI must not import, unless the command needs them
+HEAVY_MODULES = ["flask", "flask_cors", "werkzeug", "requests", "dotenv", "yaml", "setuptools"]
+
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from d2_docker import cli
+cli.get_parser(cli.get_command_name(sys.argv[1:]))
+elapsed = time.perf_counter() - start
+print(json.dumps(dict(elapsed=elapsed, modules=sorted(sys.modules))))
+"""
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Benchmark d2-docker CLI startup")
+    parser.add_argument("--repeat", type=int, default=10, help="Runs per command (default: 10)")
+    parser.add_argument("--max-ms", type=float, help="Fail if a command median is over this")
+    parser.add_argument("--output", metavar="FILE", help="Write results as JSON to FILE")
+    parser.add_argument("--compare", metavar="FILE", help="Compare against a JSON results file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Relative slowdown considered a regression with --compare (default: 0.2)",
+    )
+    return parser
+
+
+def measure(command):
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(run.SOURCE_DIR))
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    cmd = [sys.executable, "-c", SCRIPT, command]
+    result = subprocess.run(cmd, env=env, stdout=subprocess.PIPE, check=True)
+    return json.loads(result.stdout.decode("utf-8"))
+
+
+def main():
+    args = get_parser().parse_args()
+    results = []
+    errors = []
+
+    for command in COMMANDS:
+        # Warm-up run, so the bytecode is cached
+        measure(command)
+        measurements = [measure(command) for _index in range(args.repeat)]
+        durations = [measurement["elapsed"] for measurement in measurements]
+        result = dict(
+            name="cli import+parser " + command,
+            size=1,
+            min=min(durations),
+            median=statistics.median(durations),
+            mean=statistics.mean(durations),
+            runs=durations,
+        )
+        print("{:<36} median={:.1f}ms min={:.1f}ms".format(
+            result["name"], result["median"] * 1000, result["min"] * 1000
+        ))
+        results.append(result)
+
+        modules = measurements[0]["modules"]
+        heavy_modules = [name for name in HEAVY_MODULES if name in modules]
+        if heavy_modules:
+            errors.append("{}: imports {}".format(command, ", ".join(heavy_modules)))
+        if args.max_ms and result["median"] * 1000 > args.max_ms:
+            errors.append("{}: {:.1f}ms > {}ms".format(command, result["median"] * 1000,
+                                                        args.max_ms))
+
+    if args.output:
+        report = dict(python=platform.python_version(), platform=platform.platform(),
+                      repeat=args.repeat, results=results)
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if args.compare:
+        regressions = run.compare(results, args.compare, args.threshold)
+        errors += ["{}: regression ({:+.1%})".format(r["name"], r["change"]) for r in regressions]
+
+    for error in errors:
+        print("ERROR: {}".format(error), file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of the d2-docker CLI/API overhead, using a fake docker binary (fake_docker.py) on the
+PATH, so no Docker daemon is needed.
+
+    $ python3 test/benchmarks/run.py --sizes 10,100,1000 --output results.json
+    $ python3 test/benchmarks/run.py --output new.json --compare results.json --threshold 0.2
+
+Results are written as JSON (one entry per benchmark and size, with min/median/mean seconds).
+With --compare, the medians are compared against a previous results file and the exit code is
+1 if any benchmark is slower than the threshold (relative).
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIR = os.path.join(BENCHMARKS_DIR, "..", "..", "src")
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Run d2-docker benchmarks with a fake docker")
+    parser.add_argument(
+        "--sizes",
+        default="10,100,1000",
+        help="Comma-separated number of fake images/instances (default: 10,100,1000)",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per benchmark (default: 5)")
+    parser.add_argument(
+        "--stream-size",
+        type=int,
+        default=16 * 1024 * 1024,
+        help="Bytes of the synthetic save/exec streams (default: 16 MiB)",
+    )
+    parser.add_argument("--filter", help="Run only benchmarks whose name contains this string")
+    parser.add_argument("--output", metavar="FILE", help="Write results as JSON to FILE")
+    parser.add_argument("--compare", metavar="FILE", help="Compare against a JSON results file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Relative slowdown considered a regression with --compare (default: 0.2)",
+    )
+    return parser
+
+
+def setup_environment(temp_dir):
+    """Put the fake docker first on the PATH and disable the Docker Engine API client."""
+    bin_dir = os.path.join(temp_dir, "bin")
+    os.makedirs(bin_dir)
+    docker_path = os.path.join(bin_dir, "docker")
+    with open(docker_path, "w") as docker_file:
+        fake_docker = os.path.join(BENCHMARKS_DIR, "fake_docker.py")
+        docker_file.write('#!/bin/sh\nexec "{}" "{}" "$@"\n'.format(sys.executable, fake_docker))
+    os.chmod(docker_path, 0o755)
+
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ["PATH"]
+    os.environ["DOCKER_HOST"] = "unix://" + os.path.join(temp_dir, "no-docker.sock")
+    os.environ["D2_DOCKER_CACHE_DIR"] = os.path.join(temp_dir, "cache")
+    sys.path.insert(0, os.path.abspath(SOURCE_DIR))
+
+
+def set_fake_state(size, stream_size):
+    os.environ["FAKE_DOCKER_IMAGES"] = str(size)
+    os.environ["FAKE_DOCKER_INSTANCES"] = str(max(size // 10, 1))
+    os.environ["FAKE_DOCKER_STREAM_SIZE"] = str(stream_size)
+
+
+def get_benchmarks(temp_dir):
+    """Return a list of (name, setup) pairs; setup() returns the function to time (or None if
+    the benchmark cannot run in this environment)."""
+    from d2_docker import utils
+    from d2_docker.commands import export, list_
+
+    running_image = "docker.eyeseetea.com/eyeseetea/dhis2-data:2.30-bench0"
+
+    def list_containers():
+        return list_.get_containers
+
+    def image_status():
+        return lambda: utils.get_image_status(running_image)
+
+    def compose_config():
+        return lambda: utils.run_docker_compose(["config"], running_image, capture_output=True)
+
+    def export_images():
+        parser = argparse.ArgumentParser()
+        export.setup(parser)
+        output_file = os.path.join(temp_dir, "export.tgz")
+        args = parser.parse_args(["-i", running_image, output_file, "--compression-level=1"])
+        return lambda: export.run(args)
+
+    def api_client():
+        try:
+            from d2_docker.api import main as api_main
+        except ImportError as exc:
+            print("API benchmarks skipped: {}".format(exc), file=sys.stderr)
+            return None
+        return api_main
+
+    def api_instances():
+        api_main = api_client()
+        if not api_main:
+            return None
+        client = api_main.api.test_client()
+
+        def get():
+            # Measure the full listing, not the in-memory cache
+            api_main.get_instances_state().invalidate()
+            assert client.get("/instances").status_code == 200
+
+        return get
+
+    def api_db():
+        api_main = api_client()
+        if not api_main:
+            return None
+        client = api_main.api.test_client()
+
+        def get():
+            response = client.get("/instances/db?image=" + running_image)
+            assert response.status_code == 200
+            for _chunk in response.response:
+                pass
+
+        return get
+
+    return [
+        ("list_.get_containers", list_containers),
+        ("utils.get_image_status", image_status),
+        ("utils.run_docker_compose[config]", compose_config),
+        ("export", export_images),
+        ("api GET /instances", api_instances),
+        ("api GET /instances/db", api_db),
+    ]
+
+
+def time_function(func, repeat):
+    durations = []
+    for _index in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def run_benchmarks(args, temp_dir):
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = []
+
+    for size in sizes:
+        set_fake_state(size, args.stream_size)
+        for name, setup in get_benchmarks(temp_dir):
+            if args.filter and args.filter not in name:
+                continue
+            func = setup()
+            if not func:
+                continue
+            durations = time_function(func, args.repeat)
+            result = dict(
+                name=name,
+                size=size,
+                min=min(durations),
+                median=statistics.median(durations),
+                mean=statistics.mean(durations),
+                runs=durations,
+            )
+            print("{:<36} size={:<6} median={:.4f}s min={:.4f}s".format(
+                name, size, result["median"], result["min"]
+            ))
+            results.append(result)
+
+    return results
+
+
+def compare(results, baseline_path, threshold):
+    """Print the relative change of each benchmark. Return the regressions."""
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    baseline_medians = dict(((r["name"], r["size"]), r["median"]) for r in baseline["results"])
+    regressions = []
+
+    for result in results:
+        key = (result["name"], result["size"])
+        if key not in baseline_medians:
+            continue
+        base = baseline_medians[key]
+        change = (result["median"] - base) / base if base > 0 else 0
+        is_regression = change > threshold
+        print("{:<36} size={:<6} {:.4f}s -> {:.4f}s ({:+.1%}){}".format(
+            key[0], key[1], base, result["median"], change, " REGRESSION" if is_regression else ""
+        ))
+        if is_regression:
+            regressions.append(dict(result, baseline=base, change=change))
+
+    return regressions
+
+
+def main():
+    args = get_parser().parse_args()
+    temp_dir = tempfile.mkdtemp(prefix="d2-docker-benchmarks-")
+
+    try:
+        setup_environment(temp_dir)
+        results = run_benchmarks(args, temp_dir)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    report = dict(
+        python=platform.python_version(),
+        platform=platform.platform(),
+        repeat=args.repeat,
+        stream_size=args.stream_size,
+        results=results,
+    )
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        return 1 if regressions else 0
+    else:
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,45 @@
+"""
+Tests of the CLI argument parsing.
+
+    $ python3 -m pytest test/
+"""
+import contextlib
+import io
+import os
+import sys
+import unittest
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, os.path.abspath(SOURCE_DIR))
+
+from d2_docker import cli  # noqa: E402
+
+
+def parse_args(argv):
+    parser = cli.get_parser(cli.get_command_name(argv))
+    return cli.parse_args(parser, argv)
+
+
+class CliTest(unittest.TestCase):
+    def test_batch_images_intermixed_with_options(self):
+        args = parse_args(["start", "a", "-d", "b", "-j", "2", "c"])
+
+        self.assertEqual(args.images, ["a", "b", "c"])
+        self.assertTrue(args.detach)
+        self.assertEqual(args.jobs, 2)
+
+        for command in ["stop", "pull", "push", "rm"]:
+            args = parse_args([command, "a", "-j", "2", "b"])
+            self.assertEqual(args.images, ["a", "b"])
+
+    def test_batch_images_optional(self):
+        self.assertEqual(parse_args(["stop"]).images, [])
+
+    def test_unrecognized_arguments(self):
+        for argv in [["stop", "a", "--unknown", "b"], ["list", "a"], ["start"]]:
+            with contextlib.redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+                parse_args(argv)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,175 @@
+"""
+Tests of the Docker Engine API client against a fake daemon (a HTTP server on a unix socket).
+
+    $ python3 -m pytest test/
+"""
+import http.server
+import json
+import os
+import shutil
+import socketserver
+import sys
+import tempfile
+import threading
+import unittest
+import urllib.parse
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, os.path.abspath(SOURCE_DIR))
+
+from d2_docker import docker_api, utils  # noqa: E402
+
+CONTAINERS = [
+    {
+        "Id": "c1",
+        "Names": ["/d2-docker-dhis2-data-2-38-core-1"],
+        "Labels": {"com.eyeseetea.image-name": "eyeseetea/dhis2-data:2.38"},
+        "Ports": [{"PrivatePort": 80, "PublicPort": 8080, "Type": "tcp"}],
+    },
+    {
+        "Id": "c2",
+        "Names": ["/other"],
+        "Labels": {},
+        "Ports": [],
+    },
+]
+
+IMAGES = [
+    {"Id": "i1", "RepoTags": ["eyeseetea/dhis2-data:2.38", "eyeseetea/dhis2-core:2.38"]},
+    {"Id": "i2", "RepoTags": None},
+]
+
+EVENTS = [
+    {"Type": "container", "Action": "start", "id": "c1"},
+    {"Type": "container", "Action": "health_status: healthy", "id": "c1"},
+]
+
+
+class FakeDockerHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        path = url.path[len("/" + docker_api.API_VERSION):]
+        params = urllib.parse.parse_qs(url.query)
+
+        if path == "/_ping":
+            self.send_body(200, b"OK")
+        elif path == "/containers/json":
+            filters = json.loads(params["filters"][0]) if "filters" in params else {}
+            containers = [c for c in CONTAINERS if matches_labels(c, filters.get("label", []))]
+            self.send_body(200, json.dumps(containers).encode("utf-8"))
+        elif path == "/images/json":
+            self.send_body(200, json.dumps(IMAGES).encode("utf-8"))
+        elif path == "/events":
+            self.send_events()
+        elif path.startswith("/containers/") and path.endswith("/archive"):
+            self.send_body(404, b'{"message": "Could not find the file"}')
+        else:
+            self.send_body(404, b'{"message": "page not found"}')
+
+    def send_body(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_events(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for event in EVENTS:
+            chunk = json.dumps(event).encode("utf-8") + b"\n"
+            self.wfile.write("{:x}\r\n".format(len(chunk)).encode("ascii") + chunk + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+        self.close_connection = True
+
+    def address_string(self):
+        return "unix"
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeDockerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def matches_labels(container, labels):
+    """Match labels filters as the daemon does: KEY (label present) or KEY=VALUE."""
+    for label in labels:
+        key, sep, value = label.partition("=")
+        if key not in container["Labels"] or (sep and container["Labels"][key] != value):
+            return False
+    return True
+
+
+class DockerApiTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.old_environ = dict(os.environ)
+        self.socket_path = os.path.join(self.temp_dir, "docker.sock")
+        self.server = FakeDockerServer(self.socket_path, FakeDockerHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        os.environ["DOCKER_HOST"] = "unix://" + self.socket_path
+        docker_api.reset_client()
+
+    def tearDown(self):
+        docker_api.reset_client()
+        self.server.shutdown()
+        self.server.server_close()
+        os.environ.clear()
+        os.environ.update(self.old_environ)
+        shutil.rmtree(self.temp_dir)
+
+    def test_client_uses_socket_from_docker_host(self):
+        client = docker_api.get_client()
+
+        self.assertEqual(client.socket_path, self.socket_path)
+        self.assertTrue(client.ping())
+
+    def test_containers_filtered_by_labels(self):
+        client = docker_api.get_client()
+        label = "com.eyeseetea.image-name=eyeseetea/dhis2-data:2.38"
+
+        self.assertEqual([c["Id"] for c in client.containers()], ["c1", "c2"])
+        containers = client.containers(labels=[label])
+        self.assertEqual([c["Id"] for c in containers], ["c1"])
+        self.assertEqual(docker_api.get_public_port(containers[0], 80), 8080)
+        self.assertEqual(docker_api.get_container_name(containers[0]),
+                         "d2-docker-dhis2-data-2-38-core-1")
+
+    def test_images(self):
+        self.assertEqual(utils.get_data_image_names(), ["eyeseetea/dhis2-data:2.38"])
+
+    def test_events_chunked_stream(self):
+        client = docker_api.get_client()
+
+        self.assertEqual(list(client.events(filters={"type": ["container"]})), EVENTS)
+
+    def test_get_archive_not_found(self):
+        client = docker_api.get_client()
+
+        with client.get_archive("c1", "/data/apps") as stream:
+            self.assertIsNone(stream)
+
+    def test_cli_fallback_without_socket(self):
+        bin_dir = os.path.join(self.temp_dir, "bin")
+        os.makedirs(bin_dir)
+        docker_path = os.path.join(bin_dir, "docker")
+        with open(docker_path, "w") as docker_file:
+            docker_file.write("#!/bin/sh\necho eyeseetea/dhis2-data:2.40\necho '<none>:<none>'\n")
+        os.chmod(docker_path, 0o755)
+        os.environ["PATH"] = bin_dir + os.pathsep + os.environ["PATH"]
+        os.environ["DOCKER_HOST"] = "unix://" + os.path.join(self.temp_dir, "missing.sock")
+        docker_api.reset_client()
+
+        self.assertIsNone(docker_api.get_client())
+        self.assertEqual(utils.get_data_image_names(), ["eyeseetea/dhis2-data:2.40"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+"""
+Tests of the WAR download cache against a local HTTP server with Range/If-Range support.
+
+    $ python3 -m pytest test/
+"""
+import hashlib
+import http.server
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, os.path.abspath(SOURCE_DIR))
+
+from d2_docker import utils, war_cache  # noqa: E402
+
+WAR_DATA = bytes(range(256)) * 1024
+
+
+class FakeReleasesHandler(http.server.BaseHTTPRequestHandler):
+    """Serve server.files ({path: (data, etag)}). If server.truncate is set, the next GET sends
+    only half of the body (with the full Content-Length) and closes the connection."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def respond(self, send_body):
+        if self.path not in self.server.files:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        data, etag = self.server.files[self.path]
+        range_match = re.match(r"bytes=(\d+)-$", self.headers.get("Range") or "")
+        if_range = self.headers.get("If-Range")
+        offset = int(range_match.group(1)) if range_match else 0
+        use_range = range_match and (not if_range or if_range == etag)
+
+        if use_range and offset >= len(data):
+            status = 416
+            self.send_response(status)
+            self.send_header("Content-Range", "bytes */{}".format(len(data)))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        else:
+            status = 206 if use_range else 200
+            body = data[offset:] if use_range else data
+            self.send_response(status)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(body)))
+            if use_range:
+                self.send_header("Content-Range", "bytes {}-{}/{}".format(
+                    offset, len(data) - 1, len(data)))
+            self.end_headers()
+
+            if send_body and self.server.truncate:
+                self.server.truncate = False
+                self.wfile.write(body[:len(body) // 2])
+                self.close_connection = True
+            elif send_body:
+                self.wfile.write(body)
+
+        if send_body:
+            self.server.requests.append((self.path, self.headers.get("Range"), status))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class WarCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.old_environ = dict(os.environ)
+        os.environ["D2_DOCKER_CACHE_DIR"] = os.path.join(self.temp_dir, "cache")
+        os.environ["no_proxy"] = "*"
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeReleasesHandler)
+        self.server.daemon_threads = True
+        self.server.files = {"/2.40/dhis.war": (WAR_DATA, '"v1"')}
+        self.server.truncate = False
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:{}/2.40/dhis.war".format(self.server.server_address[1])
+        self.part_path = os.path.join(self.temp_dir, "dhis.war.part")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.environ.clear()
+        os.environ.update(self.old_environ)
+        shutil.rmtree(self.temp_dir)
+
+    def get_war_requests(self):
+        return [(range_, status) for (path, range_, status) in self.server.requests
+                if path == "/2.40/dhis.war"]
+
+    def write_partial(self, data, validator):
+        with open(self.part_path, "wb") as part_file:
+            part_file.write(data)
+        with open(self.part_path + ".validator", "w") as validator_file:
+            validator_file.write(validator + "\n")
+
+    def read(self, path):
+        with open(path, "rb") as input_file:
+            return input_file.read()
+
+    def test_resume_after_truncated_response(self):
+        self.server.truncate = True
+
+        path = war_cache.get_war(self.url)
+
+        self.assertEqual(self.read(path), WAR_DATA)
+        self.assertEqual(os.path.basename(path), hashlib.sha256(WAR_DATA).hexdigest() + ".war")
+        half = len(WAR_DATA) // 2
+        self.assertEqual(self.get_war_requests(),
+                         [(None, 200), ("bytes={}-".format(half), 206)])
+
+    def test_changed_etag_downloads_again(self):
+        self.write_partial(b"old contents", '"v0"')
+
+        war_cache.download(self.url, self.part_path)
+
+        self.assertEqual(self.read(self.part_path), WAR_DATA)
+        self.assertEqual(self.get_war_requests(), [("bytes=12-", 200)])
+        self.assertEqual(war_cache.read_file(self.part_path + ".validator"), '"v1"')
+
+    def test_range_not_satisfiable_restarts(self):
+        self.write_partial(WAR_DATA + b"garbage", '"v1"')
+
+        war_cache.download(self.url, self.part_path)
+
+        self.assertEqual(self.read(self.part_path), WAR_DATA)
+        requests = self.get_war_requests()
+        self.assertEqual([status for (_range, status) in requests], [416, 200])
+
+    def test_checksum_mismatch_removes_partial_download(self):
+        with self.assertRaises(utils.D2DockerError):
+            war_cache.get_war(self.url, expected_sha256="0" * 64)
+
+        part_path = war_cache.get_path("downloads", war_cache.get_url_key(self.url) + ".part")
+        self.assertFalse(os.path.exists(part_path))
+        self.assertIsNone(war_cache.get_cached_path(self.url))
+
+    def test_mutable_url_revalidated(self):
+        path1 = war_cache.get_war(self.url)
+        self.server.files["/2.40/dhis.war"] = (WAR_DATA[::-1], '"v2"')
+
+        path2 = war_cache.get_war(self.url)
+
+        self.assertNotEqual(path1, path2)
+        self.assertEqual(self.read(path2), WAR_DATA[::-1])
+
+    def test_copy_war_after_concurrent_eviction(self):
+        get_war = war_cache.get_war
+        calls = []
+
+        def get_war_evicted_once(url):
+            path = get_war(url)
+            calls.append(path)
+            if len(calls) == 1:
+                os.remove(path)
+            return path
+
+        war_cache.get_war = get_war_evicted_once
+        try:
+            dest_path = os.path.join(self.temp_dir, "ROOT.war")
+            war_cache.copy_war(self.url, dest_path)
+        finally:
+            war_cache.get_war = get_war
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.read(dest_path), WAR_DATA)
+
+
+if __name__ == "__main__":
+    unittest.main()